@@ -18,8 +18,27 @@
 #
 
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from api.models import Algorithm
+        from ml.registry import (algorithm_deleted, algorithm_saved, registry,
+                                 sync_manifest)
+
+        post_save.connect(algorithm_saved, sender=Algorithm)
+        post_delete.connect(algorithm_deleted, sender=Algorithm)
+
+        manifest = getattr(settings, 'SCORECARD_MODEL_MANIFEST', None)
+        if manifest:
+            # Only the manifest is read here. Model artifacts load on first
+            # use (or in server.wsgi when preloading) and the algorithm rows
+            # are resolved on the first request, since apps must not query
+            # the database while they are being initialised.
+            registry.load_manifest(manifest, sync=False)
+            post_migrate.connect(sync_manifest, sender=self)
@@ -0,0 +1,267 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Prediction audit trail
+
+Persists the PredictionRequest rows written for every score. In the default
+``sync`` mode each row is saved before the response is returned. In ``async``
+mode rows are queued in memory and a background thread saves them with
+``bulk_create`` whenever a batch fills up or the flush interval passes.
+The applicants are counted by the feature drift monitor (api.drift) where
+their rows are written.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import List
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from api.drift import record_drift
+from api.models import PredictionRequest
+
+log = logging.getLogger(__name__)
+
+SYNC = 'sync'
+ASYNC = 'async'
+
+
+class AuditWriter(object):
+    """
+    Background writer for PredictionRequest rows
+
+    Memory is bounded by ``max_queue_size``. When the queue is full, callers
+    wait up to ``put_timeout`` seconds for room and then save the row
+    themselves, which slows producers down to the speed of the database
+    instead of dropping audit records.
+
+    Parameters
+    ----------
+    max_queue_size: int
+        maximum number of rows waiting to be written
+    batch_size: int
+        rows written per bulk_create
+    flush_interval: float
+        maximum number of seconds a row waits in the queue
+    put_timeout: float
+        seconds to wait for room in a full queue before writing inline
+    autostart: bool
+        start the background thread on the first write. When False rows
+        are only written by explicit flush calls.
+    """
+    def __init__(self,
+                 max_queue_size: int = 10000,
+                 batch_size: int = 500,
+                 flush_interval: float = 1.0,
+                 put_timeout: float = 0.5,
+                 autostart: bool = True):
+        self.autostart = autostart
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_queue_size)
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._exit_hook = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Start the background thread, flushing the queue at interpreter exit
+
+        Threads do not survive a fork, so the writer is started lazily by
+        the first write of each worker process.
+        """
+        with self._start_lock:
+            if self.running:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name='audit-writer',
+                                            daemon=True)
+            self._thread.start()
+            if not self._exit_hook:
+                atexit.register(self.stop)
+                self._exit_hook = True
+
+    def stop(self, timeout: float = None):
+        """
+        Stop the background thread once everything queued is written
+        """
+        self._stopping.set()
+        if self.running:
+            self._thread.join(timeout)
+        # anything queued after the thread stopped
+        self.flush()
+
+    def write(self, prediction_request: PredictionRequest):
+        """
+        Queue a row for writing
+
+        Parameters
+        ----------
+        prediction_request: PredictionRequest
+            unsaved row, identified to clients by its uuid
+        """
+        if self.autostart and not (self.running or self._stopping.is_set()):
+            self.start()
+
+        try:
+            self.queue.put(prediction_request, timeout=self.put_timeout)
+        except queue.Full:
+            log.warning('Audit queue is full, writing prediction inline')
+            prediction_request.save(force_insert=True)
+            record_drift([prediction_request])
+
+    def flush(self):
+        """
+        Write everything currently queued from the calling thread
+        """
+        while True:
+            batch = self._take(block=False)
+            if not batch:
+                return
+            self._save(batch)
+
+    def _take(self, block=True) -> List[PredictionRequest]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                if block:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _save(self, batch: List[PredictionRequest]):
+        try:
+            with transaction.atomic():
+                PredictionRequest.objects.bulk_create(batch)
+        except Exception:
+            log.warning(
+                f'Could not write {len(batch)} audit records at once, '
+                'writing them one by one',
+                exc_info=True)
+            # a broken connection is reopened for the retries
+            connection.close_if_unusable_or_obsolete()
+            self._save_rows(batch)
+        finally:
+            connection.close_if_unusable_or_obsolete()
+        record_drift(batch)
+
+    def _save_rows(self, batch: List[PredictionRequest]):
+        for prediction_request in batch:
+            try:
+                with transaction.atomic():
+                    prediction_request.save(force_insert=True)
+            except Exception:
+                log.exception('Could not write audit record '
+                              f'{prediction_request.uuid}')
+                connection.close_if_unusable_or_obsolete()
+
+    def _run(self):
+        try:
+            while not (self._stopping.is_set() and self.queue.empty()):
+                batch = self._take()
+                if batch:
+                    self._save(batch)
+        finally:
+            connection.close()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer() -> AuditWriter:
+    """
+    Return the process wide audit writer configured by
+    SCORECARD_AUDIT_WRITER
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                options = getattr(settings, 'SCORECARD_AUDIT_WRITER', {})
+                _writer = AuditWriter(
+                    max_queue_size=options.get('MAX_QUEUE_SIZE', 10000),
+                    batch_size=options.get('BATCH_SIZE', 500),
+                    flush_interval=options.get('FLUSH_INTERVAL', 1.0),
+                    put_timeout=options.get('PUT_TIMEOUT', 0.5))
+    return _writer
+
+
+def audit_mode() -> str:
+    return getattr(settings, 'SCORECARD_AUDIT_MODE', SYNC)
+
+
+def record_predictions(prediction_requests: List[PredictionRequest]):
+    """
+    Persist audit rows according to SCORECARD_AUDIT_MODE
+
+    Parameters
+    ----------
+    prediction_requests: list
+        unsaved PredictionRequest rows
+
+    Returns
+    -------
+    list
+        the primary key of every row, None in async mode where rows are
+        written later; clients then use the row uuid
+    """
+    if audit_mode() == ASYNC:
+        writer = get_audit_writer()
+        for prediction_request in prediction_requests:
+            writer.write(prediction_request)
+        return [None] * len(prediction_requests)
+
+    if len(prediction_requests) == 1:
+        prediction_requests[0].save()
+    else:
+        PredictionRequest.objects.bulk_create(prediction_requests,
+                                              batch_size=1000)
+        missing = {
+            p.uuid: p
+            for p in prediction_requests if p.id is None
+        }
+        if missing:
+            # backends that do not return primary keys from a bulk insert,
+            # MySQL among them
+            for uuid, pk in PredictionRequest.objects.filter(
+                    uuid__in=list(missing)).values_list('uuid', 'id'):
+                missing[uuid].id = pk
+    record_drift(prediction_requests)
+    return [prediction_request.id for prediction_request in prediction_requests]
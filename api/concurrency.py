@@ -0,0 +1,110 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Executors of the async predict view
+
+Under ASGI a worker serves every request from one event loop, so nothing
+that blocks may run on it. Model inference is CPU bound and runs on a
+bounded thread pool; when more calls are waiting for it than the pool is
+allowed to queue, new calls are refused instead of piling up. Database work
+goes through ``sync_to_async``, as Django requires.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class Overloaded(Exception):
+    """
+    Raised when an executor already has its maximum of pending calls
+    """
+    pass
+
+
+class BoundedExecutor(object):
+    """
+    Thread pool that refuses calls beyond a number of pending ones
+
+    Parameters
+    ----------
+    max_workers: int
+        number of threads
+    max_pending: int
+        maximum number of calls running or waiting for a thread
+    thread_name_prefix: str
+        prefix of the thread names
+    """
+    def __init__(self,
+                 max_workers: int,
+                 max_pending: int,
+                 thread_name_prefix: str = ''):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run func in the pool and wait for its result
+
+        Raises
+        ------
+        Overloaded
+            when max_pending calls are already pending
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise Overloaded(f'{self.pending} calls already pending')
+            self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs))
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_inference_executor() -> BoundedExecutor:
+    """
+    Return the process wide inference executor configured by
+    SCORECARD_ASYNC
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                options = getattr(settings, 'SCORECARD_ASYNC', {})
+                _executor = BoundedExecutor(
+                    max_workers=options.get('INFERENCE_THREADS', 4),
+                    max_pending=options.get('MAX_PENDING', 1024),
+                    thread_name_prefix='inference')
+    return _executor
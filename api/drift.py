@@ -0,0 +1,353 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Feature drift monitor
+
+Every prediction request scored by a registered algorithm adds its applicant
+to the feature histograms of the algorithm, binned like the baseline of the
+algorithm's training dataset (see ml.drift). The histograms are kept in the
+memory of each process and added to the AlgorithmDrift row of the algorithm
+at most every FLUSH_INTERVAL seconds, so recording a request costs one bin
+lookup per feature. Requests are recorded where their audit rows are
+written: inline in the ``sync`` audit mode, by the audit writer thread in
+the ``async`` mode. Counts not yet flushed when a process exits are lost,
+which does not matter for the distributions. The dataset baselines are
+built when the server application loads (see preload_baselines), not by the
+first scored requests.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from api.models import AlgorithmDrift, PredictionRequest
+from ml import drift
+from ml.datasets import DATASETS
+from ml.registry import registry
+
+log = logging.getLogger(__name__)
+
+STABLE = 'stable'
+WARNING = 'warning'
+ALERT = 'alert'
+
+
+def drift_options() -> dict:
+    """
+    Return the drift monitor settings with their defaults
+    """
+    options = getattr(settings, 'SCORECARD_DRIFT', {})
+    return {
+        'ENABLED': options.get('ENABLED', True),
+        'BINS': options.get('BINS', drift.BINS),
+        'FLUSH_INTERVAL': options.get('FLUSH_INTERVAL', 10.0),
+        'MIN_OBSERVATIONS': options.get('MIN_OBSERVATIONS', 100),
+        'PSI_WARNING': options.get('PSI_WARNING', 0.1),
+        'PSI_ALERT': options.get('PSI_ALERT', 0.25),
+    }
+
+
+def enabled() -> bool:
+    return drift_options()['ENABLED']
+
+
+def algorithm_baseline(algorithm_id: int,
+                       bins: int = drift.BINS) -> Optional[drift.Baseline]:
+    """
+    Return the baseline of the features of a registered algorithm, None
+    when it has no training dataset in the zoo
+    """
+    classifier = registry.classifiers.get(algorithm_id)
+    dataset = getattr(classifier, 'zone', None)
+    if dataset not in DATASETS:
+        return None
+    try:
+        return drift.baseline(dataset, bins).select(classifier.features)
+    except Exception as e:
+        log.warning(f'No drift baseline for {dataset}; {str(e)}')
+        return None
+
+
+def preload_baselines():
+    """
+    Build the baselines of the training datasets of the registered and
+    pending classifiers, so that the first requests scored by an algorithm
+    do not wait for its dataset to be read and binned
+    """
+    if not enabled():
+        return
+    bins = drift_options()['BINS']
+    classifiers = list(registry.classifiers.values())
+    classifiers += [attr['classifier'] for attr in registry.pending]
+    for dataset in sorted({
+            classifier.zone
+            for classifier in classifiers if classifier.zone in DATASETS
+    }):
+        try:
+            drift.baseline(dataset, bins)
+        except Exception as e:
+            log.warning(f'No drift baseline for {dataset}; {str(e)}')
+
+
+def applicant(prediction_request: PredictionRequest) -> Optional[dict]:
+    """
+    Return the applicant data of a prediction request
+
+    Views store the request body as a JSON string.
+    """
+    data = prediction_request.input
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return None
+    return data if isinstance(data, dict) else None
+
+
+class DriftMonitor(object):
+    """
+    Feature histograms of the applicants scored by each algorithm in this
+    process, flushed to the database periodically
+
+    Parameters
+    ----------
+    bins: int
+        number of quantile bins of the numeric features
+    flush_interval: float
+        minimum number of seconds between flushes triggered by
+        observe_requests
+    """
+    def __init__(self, bins: int = drift.BINS, flush_interval: float = 10.0):
+        self.bins = bins
+        self.flush_interval = flush_interval
+        self._baselines: Dict[int, Optional[drift.Baseline]] = {}
+        self._pending: Dict[int, drift.FeatureHistograms] = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def observe(self, algorithm_id: int, data: Dict[str, Any]):
+        """
+        Count the features of an applicant scored by an algorithm
+        """
+        if algorithm_id not in self._baselines:
+            # cheap once the dataset baseline is built, see
+            # preload_baselines
+            self._baselines[algorithm_id] = algorithm_baseline(
+                algorithm_id, self.bins)
+        baseline = self._baselines[algorithm_id]
+        if baseline is None:
+            return
+
+        with self._lock:
+            histograms = self._pending.get(algorithm_id)
+            if histograms is None:
+                histograms = self._pending[algorithm_id] = \
+                    baseline.histograms()
+            histograms.add(data)
+
+    def observe_requests(self,
+                         prediction_requests: Iterable[PredictionRequest]):
+        """
+        Count the applicants of prediction requests and flush when the
+        flush interval has passed. Never raises, drift is not worth failing
+        a request for.
+        """
+        try:
+            for prediction_request in prediction_requests:
+                if prediction_request.algorithm_id is None:
+                    continue
+                data = applicant(prediction_request)
+                if data is not None:
+                    self.observe(prediction_request.algorithm_id, data)
+            if time.monotonic() - self._flushed_at >= self.flush_interval:
+                self.flush()
+        except Exception:
+            log.exception('Could not record feature drift')
+
+    def flush(self):
+        """
+        Add the histograms counted since the last flush to the database
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+
+        for algorithm_id in sorted(pending):
+            try:
+                save_histograms(algorithm_id, pending[algorithm_id])
+            except Exception:
+                log.exception(
+                    f'Could not save the drift of algorithm {algorithm_id}')
+
+    def clear(self):
+        """
+        Forget the histograms not flushed yet and the cached baselines
+        """
+        with self._lock:
+            self._pending = {}
+            self._baselines = {}
+
+
+def save_histograms(algorithm_id: int, histograms: drift.FeatureHistograms):
+    """
+    Add histograms to the AlgorithmDrift row of an algorithm
+
+    Stored histograms of another dataset, or of a feature whose number of
+    bins changed, are started over.
+    """
+    dataset = histograms.baseline.dataset
+    with transaction.atomic():
+        row, _ = AlgorithmDrift.objects.select_for_update().get_or_create(
+            algorithm_id=algorithm_id, defaults={'dataset': dataset})
+        if row.dataset != dataset:
+            row.dataset, row.observations, row.histograms = dataset, 0, {}
+        for name, counts in histograms.counts.items():
+            stored = row.histograms.get(name)
+            if stored is None or len(stored) != len(counts):
+                stored = [0] * len(counts)
+            row.histograms[name] = [a + b for a, b in zip(stored, counts)]
+        row.observations += histograms.observations
+        row.save()
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_drift_monitor() -> DriftMonitor:
+    """
+    Return the process wide drift monitor configured by SCORECARD_DRIFT
+    """
+    global _monitor
+    if _monitor is None:
+        with _monitor_lock:
+            if _monitor is None:
+                options = drift_options()
+                _monitor = DriftMonitor(
+                    bins=options['BINS'],
+                    flush_interval=options['FLUSH_INTERVAL'])
+    return _monitor
+
+
+def record_drift(prediction_requests: Iterable[PredictionRequest]):
+    """
+    Count the applicants of prediction requests when drift is enabled
+    """
+    if enabled():
+        get_drift_monitor().observe_requests(prediction_requests)
+
+
+def drift_status(psi: Optional[float], observations: int) -> Optional[str]:
+    """
+    Return stable, warning or alert by the PSI thresholds, None with too few
+    observations to tell
+    """
+    options = drift_options()
+    if psi is None or observations < options['MIN_OBSERVATIONS']:
+        return None
+    if psi >= options['PSI_ALERT']:
+        return ALERT
+    if psi >= options['PSI_WARNING']:
+        return WARNING
+    return STABLE
+
+
+def drift_report(algorithm_id: int) -> Dict[str, Any]:
+    """
+    Compare the stored histograms of an algorithm with its baseline
+
+    Returns
+    -------
+    dict
+        the dataset, the number of observations, the worst feature status
+        and the PSI, KS and status of every feature, most drifted first
+    """
+    report = {
+        "algorithm": algorithm_id,
+        "dataset": None,
+        "observations": 0,
+        "updated_at": None,
+        "status": None,
+        "features": [],
+    }
+    row = AlgorithmDrift.objects.filter(algorithm_id=algorithm_id).first()
+    if row is None:
+        return report
+
+    report.update(dataset=row.dataset,
+                  observations=row.observations,
+                  updated_at=row.updated_at)
+    baseline = drift.baseline(row.dataset, drift_options()['BINS'])
+    for name, counts in row.histograms.items():
+        feature = baseline.by_name.get(name)
+        if feature is None or feature.size != len(counts):
+            continue
+        result = baseline.compare(name, counts)
+        result["status"] = drift_status(result["psi"],
+                                        result["observations"])
+        report["features"].append(result)
+
+    report["features"].sort(key=lambda result: -(result["psi"] or 0))
+    statuses = [result["status"] for result in report["features"]]
+    for status in (ALERT, WARNING, STABLE):
+        if status in statuses:
+            report["status"] = status
+            break
+    return report
+
+
+def rebuild_drift(since=None, chunk_size: int = 2000) -> int:
+    """
+    Recompute the drift histograms from the stored prediction requests
+
+    Parameters
+    ----------
+    since: datetime
+        only count the requests created since then, all when None
+    chunk_size: int
+        requests read at a time
+
+    Returns
+    -------
+    int
+        the number of requests counted
+    """
+    registry.ensure_ready()
+    monitor = DriftMonitor(bins=drift_options()['BINS'])
+    rows = PredictionRequest.objects.filter(algorithm__isnull=False)
+    if since is not None:
+        rows = rows.filter(created_at__gte=since)
+    count = 0
+    for row in rows.only('id', 'input', 'algorithm_id').order_by().iterator(
+            chunk_size=chunk_size):
+        data = applicant(row)
+        if data is not None:
+            monitor.observe(row.algorithm_id, data)
+            count += 1
+
+    with transaction.atomic():
+        AlgorithmDrift.objects.all().delete()
+        monitor.flush()
+    return count
@@ -0,0 +1,188 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Streaming export of the prediction audit trail
+
+Exports PredictionRequest rows as JSON Lines, one object per row in the
+format of the retention archives, or as CSV with the JSON columns as JSON
+text, optionally gzip compressed. Rows are read in chunks and encoded and
+compressed as they go, so memory does not depend on the number of rows.
+
+``.iterator()`` streams from a server-side cursor on PostgreSQL and Oracle
+and with fetchmany on SQLite, but MySQL drivers buffer the whole result of
+a query. On MySQL the rows are therefore read with one keyset query per
+chunk on (created_at, id), which the created_at index serves.
+"""
+
+import csv
+import json
+import zlib
+from typing import Any, Dict, Iterable, Iterator
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q, QuerySet
+
+FIELDS = ('id', 'uuid', 'input', 'response', 'prediction', 'feedback',
+          'notes', 'algorithm_id', 'created_at', 'created_by')
+
+JSONL = 'jsonl'
+CSV = 'csv'
+FORMATS = (JSONL, CSV)
+
+CONTENT_TYPES = {JSONL: 'application/x-ndjson', CSV: 'text/csv'}
+
+# bytes collected before a chunk is compressed or sent
+BUFFER_SIZE = 64 * 1024
+
+
+def export_options() -> Dict[str, Any]:
+    options = getattr(settings, 'SCORECARD_EXPORT', {})
+    return {
+        'CHUNK_SIZE': options.get('CHUNK_SIZE', 2000),
+        'COMPRESS_LEVEL': options.get('COMPRESS_LEVEL', 6),
+    }
+
+
+def jsonl_line(row: Dict[str, Any]) -> bytes:
+    return json.dumps(row, cls=DjangoJSONEncoder).encode() + b'\n'
+
+
+def keyset_rows(queryset: QuerySet,
+                chunk_size: int) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the rows of a queryset in (created_at, id) order, reading one
+    chunk per query from the position of the last row read
+    """
+    queryset = queryset.order_by('created_at', 'id').values(*FIELDS)
+    last = None
+    while True:
+        chunk = queryset
+        if last is not None:
+            chunk = chunk.filter(
+                Q(created_at__gt=last['created_at'])
+                | Q(created_at=last['created_at'], id__gt=last['id']))
+        rows = list(chunk[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+
+
+def iter_rows(queryset: QuerySet,
+              chunk_size: int) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the export rows of a queryset in (created_at, id) order, reading
+    ``chunk_size`` rows at a time
+    """
+    if connections[queryset.db].vendor == 'mysql':
+        return keyset_rows(queryset, chunk_size)
+    return queryset.order_by('created_at', 'id').values(*FIELDS).iterator(
+        chunk_size=chunk_size)
+
+
+class _Line(object):
+    """
+    File-like object handing back what csv.writer writes to it
+    """
+    def write(self, value: str) -> str:
+        return value
+
+
+def csv_lines(rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    writer = csv.writer(_Line())
+    yield writer.writerow(FIELDS).encode()
+    for row in rows:
+        yield writer.writerow([
+            json.dumps(row[field], cls=DjangoJSONEncoder) if field in (
+                'input', 'response') else row[field] for field in FIELDS
+        ]).encode()
+
+
+def jsonl_lines(rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    for row in rows:
+        yield jsonl_line(row)
+
+
+def buffered(chunks: Iterable[bytes],
+             size: int = BUFFER_SIZE) -> Iterator[bytes]:
+    """
+    Join small chunks into chunks of about ``size`` bytes
+    """
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    Compress a stream of chunks into a gzip stream as they come
+    """
+    # wbits 31 writes the gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_requests(queryset: QuerySet,
+                    format: str = JSONL,
+                    compress: bool = False,
+                    chunk_size: int = None) -> Iterator[bytes]:
+    """
+    Encode prediction requests for export
+
+    Parameters
+    ----------
+    queryset: QuerySet
+        PredictionRequest rows to export, in any order
+    format: str
+        ``jsonl`` or ``csv``
+    compress: bool
+        gzip compress the output
+    chunk_size: int
+        rows read from the database at a time, SCORECARD_EXPORT's
+        CHUNK_SIZE by default
+
+    Returns
+    -------
+    iterator
+        chunks of the encoded output, oldest request first
+    """
+    if format not in FORMATS:
+        raise ValueError(f'Unknown export format {format}')
+    options = export_options()
+    rows = iter_rows(queryset, chunk_size or options['CHUNK_SIZE'])
+    lines = jsonl_lines(rows) if format == JSONL else csv_lines(rows)
+    chunks = buffered(lines)
+    if compress:
+        chunks = gzipped(chunks, options['COMPRESS_LEVEL'])
+    return chunks
@@ -0,0 +1,288 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Prediction feedback and online performance
+
+Clients report the actual outcome of scored loans in bulk with
+``POST api/v1/requests/feedback``. The outcomes are written to the
+PredictionRequest rows with one UPDATE per outcome value and, in the same
+transaction, folded into the AlgorithmPerformance row of each algorithm: the
+confusion matrix and the score histograms of the good and bad outcomes are
+adjusted by the difference the feedback makes. AUC and KS are read from the
+histograms, so they are current without scanning the requests.
+"""
+
+import uuid
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from api.models import Algorithm, AlgorithmPerformance, PredictionRequest
+
+GOOD = 'good'
+BAD = 'bad'
+OUTCOMES = (GOOD, BAD)
+
+# histogram bins of the probability of a good loan; changing it invalidates
+# the stored histograms, run `manage.py rebuild_performance` afterwards
+BINS = 100
+
+# confusion matrix cell of a (prediction, outcome) pair, good is positive
+CELLS = {
+    (GOOD, GOOD): 'true_positives',
+    (GOOD, BAD): 'false_positives',
+    (BAD, BAD): 'true_negatives',
+    (BAD, GOOD): 'false_negatives',
+}
+
+RequestId = Union[int, uuid.UUID]
+
+
+def feedback_options() -> dict:
+    """
+    Return the feedback settings with their defaults
+    """
+    options = getattr(settings, 'SCORECARD_FEEDBACK', {})
+    return {
+        'BATCH_SIZE': options.get('BATCH_SIZE', 1000),
+        'MAX_ITEMS': options.get('MAX_ITEMS', 10000),
+    }
+
+
+def parse_request_id(value: Any) -> RequestId:
+    """
+    Return the primary key or uuid a prediction request is addressed by
+    """
+    if isinstance(value, bool):
+        raise ValueError('request_id must be an integer or a uuid')
+    if isinstance(value, int) or (isinstance(value, str) and value.isdigit()):
+        return int(value)
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        raise ValueError('request_id must be an integer or a uuid')
+
+
+def parse_feedback(
+        items: Any) -> Tuple[List[Tuple[RequestId, str]], Dict[int, str]]:
+    """
+    Validate the body of a bulk feedback call
+
+    Parameters
+    ----------
+    items: list
+        ``{"request_id": ..., "actual_outcome": ...}`` objects
+
+    Returns
+    -------
+    tuple
+        the (request_id, outcome) pairs and the error of every invalid
+        item keyed by its position
+    """
+    pairs = []
+    errors = {}
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[position] = 'Expected an object'
+            continue
+        outcome = item.get('actual_outcome')
+        if outcome not in OUTCOMES:
+            errors[position] = ('actual_outcome must be one of '
+                                f"{', '.join(OUTCOMES)}")
+            continue
+        try:
+            pairs.append((parse_request_id(item.get('request_id')), outcome))
+        except ValueError as e:
+            errors[position] = str(e)
+    return pairs, errors
+
+
+def score_bin(probability: float) -> int:
+    """
+    Return the histogram bin of a probability
+    """
+    return min(max(int(probability * BINS), 0), BINS - 1)
+
+
+def contribution(prediction_request: PredictionRequest,
+                 outcome: str) -> List[Any]:
+    """
+    Return the summary entries an outcome adds for a prediction request
+
+    Only the outcomes of requests scored by a registered algorithm count.
+    The entries are confusion matrix field names and (histogram field, bin)
+    pairs.
+    """
+    if prediction_request.algorithm_id is None or outcome not in OUTCOMES:
+        return []
+
+    entries = []
+    cell = CELLS.get((prediction_request.prediction, outcome))
+    if cell is not None:
+        entries.append(cell)
+    response = prediction_request.response
+    if isinstance(response, dict) and response.get('probability') is not None:
+        entries.append(
+            (f'{outcome}_scores', score_bin(float(response['probability']))))
+    return entries
+
+
+def apply_delta(performance: AlgorithmPerformance, delta: Dict[Any, int]):
+    """
+    Add the change of the summary entries to a performance row
+    """
+    for entry, change in delta.items():
+        if isinstance(entry, tuple):
+            field, position = entry
+            histogram = getattr(performance, field)
+            if len(histogram) < BINS:
+                histogram.extend([0] * (BINS - len(histogram)))
+            histogram[position] += change
+            setattr(performance, field, histogram)
+        else:
+            setattr(performance, entry, getattr(performance, entry) + change)
+
+
+def update_performance(deltas: Dict[int, Counter]):
+    """
+    Apply the change of the summary entries of every algorithm
+
+    The performance rows are locked in algorithm order, so concurrent
+    feedback calls wait for each other instead of deadlocking. Must run in
+    a transaction.
+    """
+    deltas = {
+        algorithm_id: {entry: change
+                       for entry, change in delta.items() if change}
+        for algorithm_id, delta in deltas.items()
+    }
+    # requests can outlive a deleted algorithm
+    existing = set(
+        Algorithm.objects.filter(pk__in=[
+            algorithm_id for algorithm_id, delta in deltas.items() if delta
+        ]).order_by().values_list('pk', flat=True))
+
+    for algorithm_id in sorted(existing):
+        performance, _ = AlgorithmPerformance.objects.select_for_update(
+        ).get_or_create(algorithm_id=algorithm_id)
+        apply_delta(performance, deltas[algorithm_id])
+        performance.save()
+
+
+def _save_feedback(outcomes: Dict[RequestId, Any]) -> List[RequestId]:
+    ids = [key for key in outcomes if isinstance(key, int)]
+    uuids = [key for key in outcomes if not isinstance(key, int)]
+    # locked so that the previous feedback taken back is the stored one
+    rows = list(
+        PredictionRequest.objects.select_for_update().filter(
+            Q(pk__in=ids) | Q(uuid__in=uuids)).only(
+                'id', 'uuid', 'prediction', 'response', 'feedback',
+                'algorithm_id').order_by('pk'))
+
+    found = set()
+    changed = defaultdict(list)
+    deltas = defaultdict(Counter)
+    for row in rows:
+        found.update((row.pk, row.uuid))
+        outcome = outcomes[row.pk] if row.pk in outcomes else outcomes[
+            row.uuid]
+        if row.feedback == outcome:
+            continue
+        deltas[row.algorithm_id].subtract(contribution(row, row.feedback))
+        deltas[row.algorithm_id].update(contribution(row, outcome))
+        changed[outcome].append(row.pk)
+
+    # one update per outcome rather than bulk_update, whose CASE over every
+    # row costs more to build than the rows cost to write
+    for outcome, pks in changed.items():
+        PredictionRequest.objects.filter(pk__in=pks).update(feedback=outcome)
+    update_performance(deltas)
+    return [
+        str(key) if isinstance(key, uuid.UUID) else key for key in outcomes
+        if key not in found
+    ]
+
+
+def record_feedback(pairs: Iterable[Tuple[RequestId, Any]],
+                    batch_size: int = None) -> Dict[str, Any]:
+    """
+    Store the feedback of prediction requests and update the performance
+    of their algorithms
+
+    Every batch is written in its own transaction. Feedback other than
+    good or bad is stored but does not count, replacing a good or bad
+    feedback takes it back out of the summary.
+
+    Parameters
+    ----------
+    pairs: iterable
+        (request_id, feedback) pairs, request_id being the primary key or
+        the uuid of the request. The last feedback of a request wins.
+    batch_size: int
+        requests written per transaction, SCORECARD_FEEDBACK['BATCH_SIZE']
+        by default
+
+    Returns
+    -------
+    dict
+        the number of requests given feedback and the request ids that
+        were not found
+    """
+    batch_size = batch_size or feedback_options()['BATCH_SIZE']
+    pairs = list(pairs)
+    updated = 0
+    missing = []
+    for start in range(0, len(pairs), batch_size):
+        outcomes = dict(pairs[start:start + batch_size])
+        with transaction.atomic():
+            not_found = _save_feedback(outcomes)
+        updated += len(outcomes) - len(not_found)
+        missing.extend(not_found)
+    return {"updated": updated, "missing": missing}
+
+
+def rebuild_performance(chunk_size: int = 2000) -> int:
+    """
+    Recompute the performance of every algorithm from the stored feedback
+
+    Backfills the summaries of feedback given before they existed or after
+    BINS changed. The scan is not isolated from feedback arriving while it
+    runs, stop ingestion first.
+
+    Returns
+    -------
+    int
+        the number of algorithms with feedback
+    """
+    deltas = defaultdict(Counter)
+    rows = PredictionRequest.objects.filter(
+        algorithm__isnull=False, feedback__in=OUTCOMES).only(
+            'id', 'prediction', 'response', 'feedback',
+            'algorithm_id').order_by()
+    for row in rows.iterator(chunk_size=chunk_size):
+        deltas[row.algorithm_id].update(contribution(row, row.feedback))
+
+    with transaction.atomic():
+        AlgorithmPerformance.objects.all().delete()
+        update_performance(deltas)
+    return len(deltas)
@@ -0,0 +1,56 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Filters of the list endpoints
+
+Query parameters of the list endpoints, applied by django-filter. The
+prediction request filters match the (algorithm, created_at) and
+(prediction, created_at) indexes.
+"""
+
+from django_filters import rest_framework as filters
+
+from api.models import Algorithm, Dataset, PredictionRequest
+
+
+class PredictionRequestFilter(filters.FilterSet):
+    algorithm = filters.NumberFilter(field_name='algorithm')
+    classifier = filters.CharFilter(field_name='algorithm__classifier')
+    prediction = filters.CharFilter()
+    created_at = filters.IsoDateTimeFromToRangeFilter()
+
+    class Meta:
+        model = PredictionRequest
+        fields = ['algorithm', 'classifier', 'prediction', 'created_at']
+
+
+class AlgorithmFilter(filters.FilterSet):
+    dataset = filters.CharFilter(field_name='dataset')
+    created_at = filters.IsoDateTimeFromToRangeFilter()
+
+    class Meta:
+        model = Algorithm
+        fields = ['classifier', 'version', 'status', 'dataset', 'created_at']
+
+
+class DatasetFilter(filters.FilterSet):
+    class Meta:
+        model = Dataset
+        fields = ['name', 'region']
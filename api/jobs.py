@@ -0,0 +1,454 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Bulk scoring jobs
+
+A ScoringJob scores an uploaded CSV or JSONL portfolio with one algorithm.
+Jobs are queued in the database and run by ``manage.py run_scoring_jobs``:
+the worker reads the file in chunks, scores the chunks in a pool of
+processes and appends the scores to the result file in input order. After
+every chunk it checkpoints the rows done and the size of the result file,
+so a failed, cancelled or interrupted job resumes from its last checkpoint
+instead of starting over.
+
+A claimed job carries the claim token of its worker. Every write of the
+worker is conditional on that token, so once a job is queued again because
+its worker looked gone, the former worker can no longer overwrite it. Each
+claim also writes its scores to its own result file, which starts as a copy
+of the checkpointed part of the previous one and becomes the job's result
+file at the first checkpoint of the claim; a former worker only ever
+appends to a file the job no longer refers to.
+"""
+
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.utils import timezone
+
+from api.models import ScoringJob
+from ml.dataloader import read_chunks
+from ml.registry import registry
+
+log = logging.getLogger(__name__)
+
+CSV = 'csv'
+JSONL = 'jsonl'
+
+FORMATS = {
+    '.csv': CSV,
+    '.jsonl': JSONL,
+    '.ndjson': JSONL,
+}
+
+RESULT_FIELDS = ['row', 'probability', 'label', 'error']
+
+# storage directory of the result files
+RESULTS_DIR = 'scoring_jobs/results'
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_options() -> dict:
+    """
+    Return the scoring job settings with their defaults
+    """
+    options = getattr(settings, 'SCORECARD_SCORING_JOBS', {})
+    return {
+        'WORKERS': options.get('WORKERS', os.cpu_count() or 1),
+        'CHUNK_SIZE': options.get('CHUNK_SIZE', 10000),
+        'POLL_INTERVAL': options.get('POLL_INTERVAL', 2.0),
+        'HEARTBEAT_INTERVAL': options.get('HEARTBEAT_INTERVAL', 30),
+        'STALE_AFTER': options.get('STALE_AFTER', 300),
+    }
+
+
+def input_format(name: str) -> Optional[str]:
+    """
+    Return the job format of a file name, None if it is not supported
+    """
+    return FORMATS.get(os.path.splitext(name)[1].lower())
+
+
+def _json_lines(handle) -> Iterator[str]:
+    return (line for line in handle if line.strip())
+
+
+def count_records(path: str, format: str) -> int:
+    """
+    Count the rows of an input file without keeping them in memory
+    """
+    if format == CSV:
+        return sum(
+            len(chunk)
+            for chunk in read_chunks(path, CSV, chunksize=100000, usecols=[0]))
+    with open(path) as handle:
+        return sum(1 for _ in _json_lines(handle))
+
+
+def read_records(path: str,
+                 format: str,
+                 chunk_size: int,
+                 start: int = 0) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Read the rows of an input file as lists of applicant dictionaries
+
+    Parameters
+    ----------
+    path: str
+        CSV file with a header line or JSONL file with one object per line
+    format: str
+        csv or jsonl
+    chunk_size: int
+        rows per list
+    start: int
+        number of rows to skip, to resume from a checkpoint
+    """
+    if format == CSV:
+        for chunk in read_chunks(path,
+                                 CSV,
+                                 chunksize=chunk_size,
+                                 skiprows=range(1, start + 1)):
+            # empty cells are missing fields, as null values in JSON
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            yield chunk.to_dict('records')
+        return
+
+    with open(path) as handle:
+        lines = itertools.islice(_json_lines(handle), start, None)
+        while True:
+            records = []
+            for line in itertools.islice(lines, chunk_size):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # scored as an error row by compute_batch
+                    records.append(None)
+            if not records:
+                return
+            yield records
+
+
+def format_results(format: str, start: int,
+                   predictions: List[Dict[str, Any]]) -> str:
+    """
+    Format the predictions of the rows from start on as result file lines
+    """
+    rows = [
+        dict(prediction, row=row)
+        for row, prediction in enumerate(predictions, start)
+    ]
+    if format == CSV:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, RESULT_FIELDS, lineterminator='\n')
+        if start == 0:
+            writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue()
+    return ''.join(json.dumps(row) + '\n' for row in rows)
+
+
+# classifier of the job a pool process scores and its metrics label, set
+# by _init_worker
+_classifier = None
+_label = None
+
+
+def _init_worker(algorithm_id: int, label: str):
+    global _classifier, _label
+    if not apps.ready:
+        # processes started with spawn import Django from scratch
+        django.setup()
+    _classifier = registry.ensure_ready()[algorithm_id]
+    _label = label
+
+
+def _score(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return _classifier.compute_batch(records, label=_label)
+
+
+def claim_job() -> Optional[ScoringJob]:
+    """
+    Take the oldest queued job off the queue
+
+    The job is claimed with a conditional update, so concurrent workers
+    never run the same job, and gets a new claim token.
+    """
+    for job in ScoringJob.objects.filter(status=ScoringJob.QUEUED):
+        now = timezone.now()
+        claimed = ScoringJob.objects.filter(
+            pk=job.pk, status=ScoringJob.QUEUED).update(
+                status=ScoringJob.RUNNING,
+                started_at=now,
+                heartbeat_at=now,
+                claim_token=uuid.uuid4())
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def requeue_stale_jobs(stale_after: float) -> int:
+    """
+    Queue running jobs again whose worker stopped sending heartbeats
+
+    Their claim token is dropped, so the former worker cannot write to
+    them anymore should it still be alive.
+
+    Parameters
+    ----------
+    stale_after: float
+        seconds since the last heartbeat after which a worker is assumed
+        to be gone
+
+    Returns
+    -------
+    int
+        the number of jobs queued again
+    """
+    deadline = timezone.now() - timedelta(seconds=stale_after)
+    return ScoringJob.objects.filter(
+        status=ScoringJob.RUNNING,
+        heartbeat_at__lt=deadline).update(status=ScoringJob.QUEUED,
+                                          claim_token=None)
+
+
+def _claimed(job: ScoringJob):
+    return ScoringJob.objects.filter(pk=job.pk,
+                                     status=ScoringJob.RUNNING,
+                                     claim_token=job.claim_token)
+
+
+def _checkpoint(job: ScoringJob, **fields):
+    # only a job still running under our claim is updated, a cancelled,
+    # deleted or requeued one stops
+    updated = _claimed(job).update(**fields)
+    if not updated:
+        raise JobCancelled()
+    for field, value in fields.items():
+        setattr(job, field, value)
+
+
+class Heartbeat(object):
+    """
+    Refresh the heartbeat of a claimed job from a background thread
+
+    Keeps a job that takes longer than STALE_AFTER per chunk from being
+    queued again while it is still scored.
+
+    Parameters
+    ----------
+    job: ScoringJob
+        a running job, as returned by claim_job
+    interval: float
+        seconds between heartbeats
+    """
+    def __init__(self, job: ScoringJob, interval: float):
+        self.job = job
+        self.interval = interval
+        # set once the job is no longer running under our claim
+        self.lost = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def beat(self) -> bool:
+        """
+        Refresh the heartbeat now, returns whether the claim still holds
+        """
+        if not _claimed(self.job).update(heartbeat_at=timezone.now()):
+            self.lost.set()
+        return not self.lost.is_set()
+
+    def _run(self):
+        try:
+            while not self._stopping.wait(self.interval):
+                try:
+                    if not self.beat():
+                        return
+                except Exception:
+                    log.warning(
+                        f'Could not refresh the heartbeat of scoring job '
+                        f'{self.job.pk}',
+                        exc_info=True)
+                    connection.close_if_unusable_or_obsolete()
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name=f'heartbeat-{self.job.pk}',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopping.set()
+        self._thread.join()
+
+
+def run_job(job: ScoringJob, workers: Optional[int] = None):
+    """
+    Score a claimed job from its last checkpoint to the end of its file
+
+    Parameters
+    ----------
+    job: ScoringJob
+        a running job, as returned by claim_job
+    workers: int
+        number of scoring processes, 0 or 1 to score in this process. At
+        most twice as many chunks are held in memory.
+    """
+    options = job_options()
+    if workers is None:
+        workers = options['WORKERS']
+    chunk_size = job.chunk_size or options['CHUNK_SIZE']
+
+    try:
+        if job.algorithm_id not in registry.ensure_ready():
+            raise ValueError(f'Algorithm {job.algorithm_id} is not registered')
+
+        path = job.input_file.path
+        if job.total_rows is None:
+            _checkpoint(job, total_rows=count_records(path, job.format))
+        name = f'{RESULTS_DIR}/{job.pk}-{job.claim_token.hex}.{job.format}'
+        result_path = default_storage.path(name)
+        os.makedirs(os.path.dirname(result_path), exist_ok=True)
+
+        with open(result_path, 'wb') as result, Heartbeat(
+                job, options['HEARTBEAT_INTERVAL']) as heartbeat:
+            if job.result_size:
+                # carry over the results up to the last checkpoint, those
+                # written after it are dropped
+                with job.result_file.open('rb') as previous:
+                    _copy_prefix(previous, result, job.result_size)
+                result.flush()
+                os.fsync(result.fileno())
+            _checkpoint(job, result_file=name, result_size=result.tell())
+            remove_results(job, keep=name)
+            _score_chunks(job, path, chunk_size, workers, result, heartbeat)
+
+        _checkpoint(job,
+                    status=ScoringJob.COMPLETED,
+                    finished_at=timezone.now())
+        log.info(f'Scoring job {job.pk} completed, '
+                 f'{job.processed_rows} rows scored')
+    except JobCancelled:
+        log.info(f'Scoring job {job.pk} stopped after '
+                 f'{job.processed_rows} rows, it was cancelled or queued '
+                 'again')
+    except Exception as e:
+        log.exception(f'Scoring job {job.pk} failed')
+        _claimed(job).update(status=ScoringJob.FAILED,
+                             error=str(e),
+                             finished_at=timezone.now())
+
+
+def _copy_prefix(source, target, size: int, block_size: int = 1 << 20):
+    while size > 0:
+        block = source.read(min(size, block_size))
+        if not block:
+            raise ValueError('The result file is shorter than its checkpoint')
+        target.write(block)
+        size -= len(block)
+
+
+def remove_results(job: ScoringJob, keep: Optional[str] = None):
+    """
+    Delete the result files of a job, except the one named keep
+
+    Besides the job's result file these are the files of its former claims,
+    whose workers may have been stopped before they were cleaned up.
+    """
+    if not default_storage.exists(RESULTS_DIR):
+        return
+    _, names = default_storage.listdir(RESULTS_DIR)
+    for name in names:
+        path = f'{RESULTS_DIR}/{name}'
+        stem = os.path.splitext(name)[0]
+        if stem.split('-')[0] == str(job.pk) and path != keep:
+            default_storage.delete(path)
+
+
+def _score_chunks(job, path, chunk_size, workers, result, heartbeat):
+    chunks = read_records(path, job.format, chunk_size, job.processed_rows)
+    label = registry.label(job.algorithm_id)
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(workers,
+                                       initializer=_init_worker,
+                                       initargs=(job.algorithm_id,
+                                                 label))
+        submit = executor.submit
+    else:
+        executor = None
+        classifier = registry.classifiers[job.algorithm_id]
+        submit = None
+
+    pending = deque()
+    try:
+        while True:
+            if heartbeat.lost.is_set():
+                raise JobCancelled()
+            if executor is not None:
+                # keep every process busy while the oldest chunk finishes
+                for records in itertools.islice(chunks,
+                                                2 * workers - len(pending)):
+                    pending.append(submit(_score, records))
+                if not pending:
+                    break
+                predictions = pending.popleft().result()
+            else:
+                records = next(chunks, None)
+                if records is None:
+                    break
+                predictions = classifier.compute_batch(records, label=label)
+
+            result.write(
+                format_results(job.format, job.processed_rows,
+                               predictions).encode('utf-8'))
+            result.flush()
+            os.fsync(result.fileno())
+            failed = sum(1 for prediction in predictions
+                         if 'error' in prediction)
+            _checkpoint(job,
+                        processed_rows=job.processed_rows + len(predictions),
+                        failed_rows=job.failed_rows + failed,
+                        result_size=result.tell(),
+                        heartbeat_at=timezone.now())
+    finally:
+        if executor is not None:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
@@ -0,0 +1,81 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Retention of the prediction audit trail
+
+Moves the prediction requests older than the retention period into a gzip
+compressed JSON Lines archive and deletes them from the database. Meant to
+run periodically, e.g. from cron.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import retention
+
+
+class Command(BaseCommand):
+    help = 'Archive and delete prediction requests past their retention'
+
+    def add_arguments(self, parser):
+        options = retention.retention_options()
+        parser.add_argument('--days',
+                            type=int,
+                            default=options['DAYS'],
+                            help='archive requests older than this many '
+                            'days')
+        parser.add_argument('--before',
+                            help='archive requests created before this ISO '
+                            'date instead')
+        parser.add_argument('--directory',
+                            default=options['DIRECTORY'],
+                            help='directory the archive is written to')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=options['BATCH_SIZE'],
+                            help='rows archived and deleted at a time')
+        parser.add_argument('--dry-run',
+                            action='store_true',
+                            help='only count the requests to archive')
+
+    def handle(self, *args, **options):
+        try:
+            before = retention.parse_date(options['before'])
+        except ValueError as e:
+            raise CommandError(f'Invalid --before date: {e}')
+        if before is None:
+            if options['days'] < 0:
+                raise CommandError('--days cannot be negative')
+            before = retention.retention_cutoff(options['days'])
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        result = retention.archive_requests(before,
+                                            options['directory'],
+                                            batch_size=options['batch_size'],
+                                            dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"{result['rows']} prediction requests created "
+                              f"before {before.isoformat()} to archive")
+        elif result['path'] is None:
+            self.stdout.write('No prediction requests to archive')
+        else:
+            self.stdout.write(f"Archived {result['rows']} prediction "
+                              f"requests created before {before.isoformat()} "
+                              f"to {result['path']}")
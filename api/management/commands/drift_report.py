@@ -0,0 +1,102 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Feature drift report
+
+Prints the PSI and KS of every feature of the algorithms against their
+training datasets. The histograms are cumulative, --reset starts a new
+window and --rebuild recounts them from the stored prediction requests.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import drift, retention
+from api.models import AlgorithmDrift
+
+
+def _format(value):
+    return '-' if value is None else f'{value:.4f}'
+
+
+class Command(BaseCommand):
+    help = 'Report the feature drift of the algorithms'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm',
+                            type=int,
+                            action='append',
+                            help='only report this algorithm id, repeatable')
+        parser.add_argument('--reset',
+                            action='store_true',
+                            help='delete the histograms instead, starting '
+                            'a new window')
+        parser.add_argument('--rebuild',
+                            action='store_true',
+                            help='recount the histograms from the stored '
+                            'prediction requests first')
+        parser.add_argument('--since',
+                            help='with --rebuild, only count the requests '
+                            'created since this ISO date')
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            default=2000,
+                            help='prediction requests read at a time by '
+                            '--rebuild')
+
+    def handle(self, *args, **options):
+        try:
+            since = retention.parse_date(options['since'])
+        except ValueError as e:
+            raise CommandError(f'Invalid --since date: {e}')
+        if since is not None and not options['rebuild']:
+            raise CommandError('--since only applies to --rebuild')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        rows = AlgorithmDrift.objects.all()
+        if options['algorithm']:
+            rows = rows.filter(algorithm__in=options['algorithm'])
+
+        if options['reset']:
+            deleted, _ = rows.delete()
+            self.stdout.write(f'Deleted the histograms of {deleted} '
+                              'algorithms')
+            return
+
+        if options['rebuild']:
+            count = drift.rebuild_drift(since, options['chunk_size'])
+            self.stdout.write(f'Counted {count} prediction requests')
+        else:
+            drift.get_drift_monitor().flush()
+
+        algorithm_ids = list(rows.values_list('algorithm', flat=True))
+        if not algorithm_ids:
+            self.stdout.write('No feature drift recorded')
+        for algorithm_id in algorithm_ids:
+            report = drift.drift_report(algorithm_id)
+            self.stdout.write(
+                f"Algorithm {algorithm_id} ({report['dataset']}): "
+                f"{report['observations']} applicants, "
+                f"{report['status'] or 'not enough data'}")
+            for result in report['features']:
+                self.stdout.write(f"  {result['feature']:<24} "
+                                  f"psi {_format(result['psi'])}  "
+                                  f"ks {_format(result['ks'])}  "
+                                  f"{result['status'] or '-'}")
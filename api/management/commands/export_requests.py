@@ -0,0 +1,96 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Export of the prediction audit trail
+
+Writes the prediction requests, oldest first, as JSON Lines or CSV to a
+file or to standard output, reading and encoding them in chunks. Output
+files ending in .gz are gzip compressed.
+"""
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import retention
+from api.export import FORMATS, JSONL, export_options, export_requests
+from api.models import PredictionRequest
+
+
+class Command(BaseCommand):
+    help = 'Export prediction requests as JSON Lines or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output',
+                            help='file to write, standard output by default')
+        parser.add_argument('--format', choices=FORMATS, default=JSONL)
+        parser.add_argument('--gzip',
+                            action='store_true',
+                            help='gzip compress the output, the default for '
+                            'files ending in .gz')
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            default=export_options()['CHUNK_SIZE'],
+                            help='rows read from the database at a time')
+        parser.add_argument('--algorithm',
+                            type=int,
+                            help='only requests of this algorithm id')
+        parser.add_argument('--prediction',
+                            help='only requests with this prediction')
+        parser.add_argument('--after',
+                            help='only requests created at or after this '
+                            'ISO date')
+        parser.add_argument('--before',
+                            help='only requests created before this ISO '
+                            'date')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        queryset = PredictionRequest.objects.all()
+        if options['algorithm'] is not None:
+            queryset = queryset.filter(algorithm_id=options['algorithm'])
+        if options['prediction'] is not None:
+            queryset = queryset.filter(prediction=options['prediction'])
+        try:
+            after = retention.parse_date(options['after'])
+            before = retention.parse_date(options['before'])
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        if after is not None:
+            queryset = queryset.filter(created_at__gte=after)
+        if before is not None:
+            queryset = queryset.filter(created_at__lt=before)
+
+        path = options['output']
+        compress = options['gzip'] or bool(path and path.endswith('.gz'))
+        chunks = export_requests(queryset,
+                                 options['format'],
+                                 compress,
+                                 chunk_size=options['chunk_size'])
+        if path:
+            with open(path, 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,49 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Recompute the algorithm performance summaries from the stored feedback
+
+The summaries are kept up to date as feedback arrives. Rebuilding them is
+only needed for feedback stored before they existed, or after the histogram
+bins changed. Prediction requests that were archived or deleted no longer
+count afterwards.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import feedback
+
+
+class Command(BaseCommand):
+    help = 'Recompute the algorithm performance summaries from the feedback'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            default=2000,
+                            help='prediction requests read at a time')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        algorithms = feedback.rebuild_performance(options['chunk_size'])
+        self.stdout.write(
+            f'Rebuilt the performance of {algorithms} algorithms')
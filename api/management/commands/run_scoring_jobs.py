@@ -0,0 +1,76 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Local worker for bulk scoring jobs
+
+Polls the database for queued ScoringJob rows and runs them one at a time,
+each with its own pool of scoring processes. Running jobs whose worker
+stopped checkpointing are queued again and resume from their checkpoint.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued bulk scoring jobs'
+
+    def add_arguments(self, parser):
+        options = jobs.job_options()
+        parser.add_argument('--workers',
+                            type=int,
+                            default=options['WORKERS'],
+                            help='scoring processes per job, 0 or 1 to '
+                            'score in the worker itself')
+        parser.add_argument('--poll-interval',
+                            type=float,
+                            default=options['POLL_INTERVAL'],
+                            help='seconds between polls of an empty queue')
+        parser.add_argument('--stale-after',
+                            type=float,
+                            default=options['STALE_AFTER'],
+                            help='seconds without checkpoint after which a '
+                            'running job is queued again')
+        parser.add_argument('--once',
+                            action='store_true',
+                            help='exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            requeued = jobs.requeue_stale_jobs(options['stale_after'])
+            if requeued:
+                self.stdout.write(f'Queued {requeued} stale jobs again')
+
+            job = jobs.claim_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f'Running scoring job {job.pk}')
+            jobs.run_job(job, options['workers'])
+            job.refresh_from_db()
+            self.stdout.write(f'Scoring job {job.pk} {job.status}: '
+                              f'{job.processed_rows} rows')
@@ -0,0 +1,63 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+# Generated by Django 3.2.1 on 2026-10-18 08:05
+
+from django.db import migrations, models
+import uuid
+
+
+# rows read and updated per query by the backfill
+BATCH_SIZE = 1000
+
+
+def gen_uuid(apps, schema_editor):
+    PredictionRequest = apps.get_model('api', 'PredictionRequest')
+    requests = PredictionRequest.objects.using(schema_editor.connection.alias)
+    rows = requests.filter(uuid__isnull=True).only('id').order_by('pk')
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        row.uuid = uuid.uuid4()
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            requests.bulk_update(batch, ['uuid'])
+            batch = []
+    if batch:
+        requests.bulk_update(batch, ['uuid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_predictionrequest_algorithm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predictionrequest',
+            name='uuid',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(gen_uuid, reverse_code=migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='predictionrequest',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+# Generated by Django 3.2.1 on 2026-10-18 08:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_predictionrequest_uuid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoringJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('input_file', models.FileField(upload_to='scoring_jobs/input')),
+                ('format', models.CharField(blank=True, choices=[('csv', 'CSV'), ('jsonl', 'JSON Lines')], max_length=8)),
+                ('result_file', models.FileField(blank=True, upload_to='scoring_jobs/results')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], db_index=True, default='queued', max_length=16)),
+                ('chunk_size', models.PositiveIntegerField(blank=True, null=True)),
+                ('total_rows', models.BigIntegerField(blank=True, null=True)),
+                ('processed_rows', models.BigIntegerField(default=0)),
+                ('failed_rows', models.BigIntegerField(default=0)),
+                ('result_size', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.CharField(blank=True, max_length=128)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('algorithm', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.algorithm')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
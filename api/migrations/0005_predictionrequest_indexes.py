@@ -0,0 +1,44 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+# Generated by Django 3.2.1 on 2026-10-18 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_scoringjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='predictionrequest',
+            index=models.Index(fields=['algorithm', 'created_at'], name='api_request_algorithm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='predictionrequest',
+            index=models.Index(fields=['prediction', 'created_at'], name='api_request_prediction_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='predictionrequest',
+            index=models.Index(fields=['created_at'], name='api_request_created_idx'),
+        ),
+    ]
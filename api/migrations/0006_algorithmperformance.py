@@ -0,0 +1,49 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+# Generated by Django 3.2.1 on 2026-10-18 09:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_predictionrequest_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlgorithmPerformance',
+            fields=[
+                ('algorithm', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='performance', serialize=False, to='api.algorithm')),
+                ('true_positives', models.BigIntegerField(default=0)),
+                ('false_positives', models.BigIntegerField(default=0)),
+                ('true_negatives', models.BigIntegerField(default=0)),
+                ('false_negatives', models.BigIntegerField(default=0)),
+                ('good_scores', models.JSONField(default=list)),
+                ('bad_scores', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['algorithm'],
+            },
+        ),
+    ]
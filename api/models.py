@@ -21,6 +21,7 @@
 API Models module
 """
 
+from uuid import uuid4
 from datetime import date
 from django.db import models
 
@@ -83,7 +84,12 @@ class PredictionRequest(models.Model):
         created_by: The name of creator.
         created_at: The date when request was created.
         algorithm: The reference to MLAlgorithm used to compute response.
+        uuid: Client visible identifier, known before the row is saved.
     '''
+    uuid = models.UUIDField(default=uuid4,
+                            editable=False,
+                            unique=True,
+                            null=True)
     input = models.JSONField()
     response = models.JSONField()
     prediction = models.CharField(max_length=128)
@@ -108,3 +114,214 @@ class PredictionRequest(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # recent requests of an algorithm, of a label
+            models.Index(fields=['algorithm', 'created_at'],
+                         name='api_request_algorithm_idx'),
+            models.Index(fields=['prediction', 'created_at'],
+                         name='api_request_prediction_idx'),
+            # default ordering and the retention cutoff
+            models.Index(fields=['created_at'],
+                         name='api_request_created_idx'),
+        ]
+
+
+class ScoringJob(models.Model):
+    '''
+    The ScoringJob scores an uploaded portfolio file with one algorithm.
+
+    Attributes
+    ----------
+        algorithm: The algorithm the rows are scored with.
+        input_file: The uploaded CSV or JSONL file, one applicant per row.
+        format: The format of input_file and result_file, csv or jsonl.
+        result_file: The scores, one row per input row in input order.
+        status: queued, running, completed, failed or cancelled.
+        chunk_size: The number of rows scored at a time, the worker default when empty.
+        total_rows: The number of rows of input_file, counted when the job starts.
+        processed_rows: The number of rows scored at the last checkpoint.
+        failed_rows: The number of processed rows that got an error instead of a score.
+        result_size: The size of result_file in bytes at the last checkpoint.
+        error: The reason a job failed.
+        heartbeat_at: The date of the last sign of life of the worker running the job.
+        claim_token: Identifies the claim of the worker running the job.
+    '''
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'),
+                (COMPLETED, 'Completed'), (FAILED, 'Failed'),
+                (CANCELLED, 'Cancelled')]
+    FORMATS = [('csv', 'CSV'), ('jsonl', 'JSON Lines')]
+
+    algorithm: Algorithm = models.ForeignKey(Algorithm,
+                                             on_delete=models.SET_NULL,
+                                             null=True)
+    input_file = models.FileField(upload_to='scoring_jobs/input')
+    format: str = models.CharField(max_length=8, choices=FORMATS, blank=True)
+    result_file = models.FileField(upload_to='scoring_jobs/results',
+                                   blank=True)
+    status: str = models.CharField(max_length=16,
+                                   choices=STATUSES,
+                                   default=QUEUED,
+                                   db_index=True)
+    chunk_size = models.PositiveIntegerField(blank=True, null=True)
+    total_rows = models.BigIntegerField(blank=True, null=True)
+    processed_rows = models.BigIntegerField(default=0)
+    failed_rows = models.BigIntegerField(default=0)
+    result_size = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    created_at: date = models.DateTimeField(auto_now_add=True, blank=True)
+    created_by = models.CharField(max_length=128, blank=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    claim_token = models.UUIDField(blank=True, null=True, editable=False)
+
+    @property
+    def progress(self):
+        if not self.total_rows:
+            return 1.0 if self.status == self.COMPLETED else 0.0
+        return self.processed_rows / self.total_rows
+
+    def __str__(self):
+        return f"""
+                Scoring Job
+                Algorithm: {self.algorithm}
+                Input File: {self.input_file}
+                Status: {self.status}
+                Processed Rows: {self.processed_rows}/{self.total_rows}
+                Created At: {self.created_at}
+                """
+
+    class Meta:
+        ordering = ['created_at']
+
+
+class AlgorithmPerformance(models.Model):
+    '''
+    The AlgorithmPerformance summarizes the feedback received on the
+    predictions of an algorithm. It is updated as feedback arrives.
+
+    Good is the positive class, the probability returned by the classifiers
+    is the probability of a good loan.
+
+    Attributes
+    ----------
+        algorithm: The algorithm the predictions were made with.
+        true_positives: Predicted good, actually good.
+        false_positives: Predicted good, actually bad.
+        true_negatives: Predicted bad, actually bad.
+        false_negatives: Predicted bad, actually good.
+        good_scores: Histogram of the probabilities of the good outcomes.
+        bad_scores: Histogram of the probabilities of the bad outcomes.
+        updated_at: The date of the last feedback.
+    '''
+    algorithm: Algorithm = models.OneToOneField(Algorithm,
+                                                on_delete=models.CASCADE,
+                                                primary_key=True,
+                                                related_name='performance')
+    true_positives = models.BigIntegerField(default=0)
+    false_positives = models.BigIntegerField(default=0)
+    true_negatives = models.BigIntegerField(default=0)
+    false_negatives = models.BigIntegerField(default=0)
+    good_scores = models.JSONField(default=list)
+    bad_scores = models.JSONField(default=list)
+    updated_at: date = models.DateTimeField(auto_now=True)
+
+    @property
+    def total(self):
+        return (self.true_positives + self.false_positives +
+                self.true_negatives + self.false_negatives)
+
+    @property
+    def accuracy(self):
+        if not self.total:
+            return None
+        return (self.true_positives + self.true_negatives) / self.total
+
+    @property
+    def auc(self):
+        """
+        Probability that a good loan scores above a bad one, to the
+        resolution of the histograms
+        """
+        goods, bads = sum(self.good_scores), sum(self.bad_scores)
+        if not goods or not bads:
+            return None
+        area = 0.0
+        below = 0
+        for good, bad in zip(self.good_scores, self.bad_scores):
+            # ties within a bin count half
+            area += good * (below + bad / 2)
+            below += bad
+        return area / (goods * bads)
+
+    @property
+    def ks(self):
+        """
+        Largest distance between the score distributions of the good and
+        bad loans, at the bin edges of the histograms
+        """
+        goods, bads = sum(self.good_scores), sum(self.bad_scores)
+        if not goods or not bads:
+            return None
+        distance = 0.0
+        good_below = bad_below = 0
+        for good, bad in zip(self.good_scores, self.bad_scores):
+            good_below += good
+            bad_below += bad
+            distance = max(distance, abs(good_below / goods -
+                                         bad_below / bads))
+        return distance
+
+    def __str__(self):
+        return f"""
+                Algorithm Performance
+                Algorithm: {self.algorithm_id}
+                True Positives: {self.true_positives}
+                False Positives: {self.false_positives}
+                True Negatives: {self.true_negatives}
+                False Negatives: {self.false_negatives}
+                Updated At: {self.updated_at}
+                """
+
+    class Meta:
+        ordering = ['algorithm']
+
+
+class AlgorithmDrift(models.Model):
+    '''
+    The AlgorithmDrift keeps the distribution of the features of the
+    applicants scored by an algorithm. It is updated as requests arrive.
+
+    Attributes
+    ----------
+        algorithm: The algorithm the applicants were scored with.
+        dataset: The training dataset the histograms are binned like.
+        observations: The number of applicants counted.
+        histograms: The count of every bin keyed by feature name.
+        updated_at: The date of the last update.
+    '''
+    algorithm: Algorithm = models.OneToOneField(Algorithm,
+                                                on_delete=models.CASCADE,
+                                                primary_key=True,
+                                                related_name='drift')
+    dataset: str = models.CharField(max_length=128)
+    observations = models.BigIntegerField(default=0)
+    histograms = models.JSONField(default=dict)
+    updated_at: date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"""
+                Algorithm Drift
+                Algorithm: {self.algorithm_id}
+                Dataset: {self.dataset}
+                Observations: {self.observations}
+                Updated At: {self.updated_at}
+                """
+
+    class Meta:
+        ordering = ['algorithm']
@@ -0,0 +1,67 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Pagination of the list endpoints
+
+Cursor pagination walks the indexed ordering columns from the position
+encoded in the cursor, so every page costs the same however deep it is and
+rows inserted meanwhile do not shift the pages.
+
+Pagination is opt in: a list is only paginated when the client passes
+``cursor`` or ``page_size``, otherwise the whole list is returned as a plain
+array as before, so existing clients keep working.
+"""
+
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedCursorPagination(CursorPagination):
+    """
+    Cursor pagination in creation order, ties broken by id
+    """
+    ordering = ('created_at', 'id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_description = (
+        'The pagination cursor value. The response is a page of results '
+        'when cursor or page_size is given, a plain array otherwise.')
+    page_size_query_description = (
+        'Number of results to return per page, at most 1000.')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (self.cursor_query_param not in params
+                and self.page_size_query_param not in params):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'oneOf': [schema,
+                      super().get_paginated_response_schema(schema)]
+        }
+
+
+class IdCursorPagination(CreatedCursorPagination):
+    """
+    Cursor pagination in id order, for models without a creation date
+    """
+    ordering = ('id', )
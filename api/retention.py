@@ -0,0 +1,158 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Retention of the prediction audit trail
+
+PredictionRequest grows by a row per score. Rows older than the retention
+period are moved into gzip compressed JSON Lines archives, one JSON object
+per row with every column, and deleted from the table.
+
+Rows are archived oldest first in batches. Each batch is appended to the
+archive as its own gzip member and synced to disk before the batch is
+deleted, so an interrupted run loses nothing: at worst the last batch is
+archived again by the next run, with the same ids.
+"""
+
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from api.export import FIELDS, jsonl_line
+from api.models import PredictionRequest
+
+log = logging.getLogger(__name__)
+
+
+def retention_options() -> Dict[str, Any]:
+    options = getattr(settings, 'SCORECARD_RETENTION', {})
+    return {
+        'DAYS': options.get('DAYS', 365),
+        'DIRECTORY': options.get('DIRECTORY', 'archive'),
+        'BATCH_SIZE': options.get('BATCH_SIZE', 5000),
+    }
+
+
+def retention_cutoff(days: int) -> datetime:
+    """
+    Return the creation date before which requests are archived
+    """
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_path(directory: str, before: datetime) -> str:
+    stamp = timezone.now().strftime('%Y%m%dT%H%M%S%f')
+    return os.path.join(
+        directory,
+        f'prediction_requests-before-{before:%Y%m%d}-{stamp}.jsonl.gz')
+
+
+def archive_requests(before: datetime,
+                     directory: str,
+                     batch_size: int = 5000,
+                     dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Move the requests created before a date into a new archive
+
+    Parameters
+    ----------
+    before: datetime
+        requests created before this date are archived
+    directory: str
+        directory the archive is written to
+    batch_size: int
+        number of rows read, written and deleted at a time
+    dry_run: bool
+        only count the rows that would be archived
+
+    Returns
+    -------
+    dict
+        number of ``rows`` archived and the ``path`` of the archive, None
+        when there was nothing to archive
+    """
+    queryset = PredictionRequest.objects.filter(created_at__lt=before)
+    if dry_run:
+        return {'rows': queryset.count(), 'path': None}
+
+    path = None
+    archive = None
+    rows = 0
+    try:
+        while True:
+            # archived rows are gone, so every batch starts at the front
+            batch = list(
+                queryset.order_by('created_at',
+                                  'id').values(*FIELDS)[:batch_size])
+            if not batch:
+                break
+            if archive is None:
+                os.makedirs(directory, exist_ok=True)
+                path = archive_path(directory, before)
+                archive = open(path, 'xb')
+
+            with gzip.GzipFile(fileobj=archive, mode='wb',
+                               compresslevel=6) as member:
+                for row in batch:
+                    member.write(jsonl_line(row))
+            archive.flush()
+            os.fsync(archive.fileno())
+
+            with transaction.atomic():
+                PredictionRequest.objects.filter(
+                    id__in=[row['id'] for row in batch]).delete()
+            rows += len(batch)
+            log.debug(f'Archived {rows} prediction requests to {path}')
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return {'rows': rows, 'path': path}
+
+
+def read_archive(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the rows of an archive written by archive_requests
+
+    ``created_at`` and ``uuid`` are returned as the strings they were
+    written as.
+    """
+    with gzip.open(path, 'rt') as archive:
+        for line in archive:
+            yield json.loads(line)
+
+
+def parse_date(value: str) -> Optional[datetime]:
+    """
+    Parse an ISO date or date and time, in the current time zone when
+    naive
+    """
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
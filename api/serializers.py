@@ -21,23 +21,81 @@
 Serializer module
 """
 
-from api.models import Algorithm, PredictionRequest, Dataset
+from api.jobs import input_format
+from api.models import Algorithm, AlgorithmPerformance, PredictionRequest, Dataset, ScoringJob
+from ml.registry import registry
 from rest_framework import serializers
 
 
-class DatasetSerializer(serializers.ModelSerializer):
+class FieldsMixin(object):
+    """
+    Serialize only the fields named by the ``fields`` keyword argument, all
+    of them when it is None
+    """
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class DatasetSerializer(FieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Dataset
         fields = '__all__'
 
 
-class AlgorithmSerializer(serializers.ModelSerializer):
+class AlgorithmSerializer(FieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Algorithm
         fields = '__all__'
 
 
-class PredictionRequestSerializer(serializers.ModelSerializer):
+class PredictionRequestSerializer(FieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = PredictionRequest
         fields = '__all__'
+
+
+class AlgorithmPerformanceSerializer(serializers.ModelSerializer):
+    total = serializers.IntegerField(read_only=True)
+    accuracy = serializers.FloatField(read_only=True)
+    auc = serializers.FloatField(read_only=True)
+    ks = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = AlgorithmPerformance
+        exclude = ['good_scores', 'bad_scores']
+
+
+class ScoringJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ScoringJob
+        exclude = ['result_file', 'claim_token']
+        read_only_fields = [
+            'status', 'total_rows', 'processed_rows', 'failed_rows',
+            'result_size', 'error', 'started_at', 'finished_at',
+            'heartbeat_at'
+        ]
+        extra_kwargs = {
+            'algorithm': {
+                'allow_null': False,
+                'required': True
+            },
+            'input_file': {
+                'write_only': True
+            },
+        }
+
+    def validate(self, attrs):
+        if attrs['algorithm'].id not in registry.ensure_ready():
+            raise serializers.ValidationError(
+                {"algorithm": "ML algorithm is not available"})
+        if not attrs.get('format'):
+            attrs['format'] = input_format(attrs['input_file'].name)
+            if attrs['format'] is None:
+                raise serializers.ValidationError(
+                    {"format": "Upload a .csv or .jsonl file or set format"})
+        return attrs
@@ -17,8 +17,40 @@
 # under the License.
 #
 
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APIClient
+from scipy.stats import ks_2samp
+from sklearn.metrics import roc_auc_score
+from statsmodels.multivariate.manova import MANOVA
+
+from api import drift, export, jobs, retention
+from api.audit import AuditWriter
+from api.concurrency import BoundedExecutor
+from ml import metrics
+from ml.cache import LocalPredictionCache
+from api.models import AlgorithmDrift, AlgorithmPerformance, PredictionRequest, ScoringJob
+from ml.classifiers import Classifier
+from ml.datasets import load_dataset
+from ml.registry import registry
+from stats.statistical_scoring import make_regression, reference_model, stat_score
 
 test_data = {
     "age": 22,
@@ -42,3 +74,894 @@ class AlgorithmTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["label"], expected_output)
         self.assertTrue("request_id" in response.data)
+
+    def test_predict_view_resolves_algorithm_in_memory(self):
+        client = APIClient()
+
+        classifier_url = "/api/v1/algorithms/predict?classifier=RandomForestClassifier&version=0.0.1"
+        client.post(classifier_url, test_data, format='json')
+
+        # only the audit row is written, the algorithm comes from the registry
+        with self.assertNumQueries(1):
+            response = client.post(classifier_url, test_data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_predict_batch_view(self):
+        client = APIClient()
+
+        classifier_url = "/api/v1/algorithms/predict_batch?classifier=RandomForestClassifier&version=0.0.1"
+        records = [test_data, dict(test_data, purpose="spaceship")]
+        response = client.post(classifier_url, records, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response.data[0]["label"], expected_output)
+        self.assertTrue("error" in response.data[1])
+
+    def test_compare_view(self):
+        client = APIClient()
+
+        url = ("/api/v1/algorithms/compare?dataset=german&version=0.0.1"
+               "&weights=RandomForestClassifier:3,GradientBoostClassifier:1")
+        response = client.post(url, test_data, format='json')
+        self.assertEqual(response.status_code, 200)
+        scores = response.data["scores"]
+        self.assertEqual(set(scores),
+                         {"RandomForestClassifier", "GradientBoostClassifier"})
+        for name, score in scores.items():
+            _, classifier = registry.lookup_dataset('german', '0.0.1',
+                                                    [name])[name]
+            self.assertAlmostEqual(
+                score["probability"],
+                classifier.compute_prediction(dict(test_data))["probability"])
+        self.assertAlmostEqual(
+            response.data["probability"],
+            (3 * scores["RandomForestClassifier"]["probability"] +
+             scores["GradientBoostClassifier"]["probability"]) / 4)
+        self.assertEqual(response.data["method"], "ensemble")
+
+        # one audit row for the whole comparison
+        self.assertEqual(PredictionRequest.objects.count(), 1)
+        self.assertEqual(
+            PredictionRequest.objects.get().prediction,
+            response.data["label"])
+
+        response = client.post(
+            "/api/v1/algorithms/compare?classifiers=RandomForestClassifier,"
+            "Unknown", test_data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncPredictTests(TestCase):
+    url = ("/api/v1/async/algorithms/predict?classifier="
+           "RandomForestClassifier&version=0.0.1")
+
+    async def test_predict_async_view(self):
+        client = AsyncClient()
+        response = await client.post(self.url,
+                                     test_data,
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        prediction = response.json()
+        self.assertEqual(prediction["label"], expected_output)
+
+        _, classifier = registry.lookup('RandomForestClassifier', '0.0.1',
+                                        'production', 'german')
+        self.assertAlmostEqual(
+            prediction["probability"],
+            classifier.compute_prediction(dict(test_data))["probability"])
+        saved = await sync_to_async(PredictionRequest.objects.get)(
+            id=prediction["request_id"])
+        self.assertEqual(saved.prediction, expected_output)
+
+        response = await client.post(
+            "/api/v1/async/algorithms/predict?classifier=manova", test_data,
+            content_type='application/json')
+        self.assertEqual(response.json()["method"], "manova")
+
+    def test_predict_async_view_errors(self):
+        client = APIClient()
+        response = client.post(self.url, test_data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            PredictionRequest.objects.filter(
+                id=response.json()["request_id"]).exists())
+
+        self.assertEqual(client.get(self.url).status_code, 405)
+        response = client.post(self.url.replace('0.0.1', '9.9.9'),
+                               test_data,
+                               format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # no room for another pending score
+        executor = BoundedExecutor(max_workers=1, max_pending=0)
+        self.addCleanup(executor.shutdown)
+        with mock.patch('api.views.get_inference_executor',
+                        return_value=executor):
+            response = client.post(self.url, test_data, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class MetricsTests(TestCase):
+    url = ("/api/v1/algorithms/predict?classifier=RandomForestClassifier"
+           "&version=0.0.1")
+    label = 'RandomForestClassifier/german/0.0.1'
+
+    def setUp(self):
+        metrics.clear()
+        self.addCleanup(metrics.clear)
+
+    def test_metrics_view(self):
+        client = APIClient()
+        for _ in range(2):
+            response = client.post(self.url, test_data, format='json')
+            self.assertEqual(response.status_code, 200)
+        response = client.post(self.url.replace('0.0.1', '9.9.9'),
+                               test_data,
+                               format='json')
+        self.assertGreaterEqual(response.status_code, 400)
+        response = client.post(
+            "/api/v1/async/algorithms/predict?classifier=manova",
+            test_data,
+            format='json')
+        self.assertEqual(response.status_code, 200)
+
+        labels = ('predict', self.label)
+        self.assertEqual(metrics.REQUESTS.value(*labels), 2)
+        self.assertEqual(metrics.ERRORS.value(*labels), 0)
+        # unresolved algorithms are not used as label values
+        self.assertEqual(metrics.ERRORS.value('predict', metrics.UNKNOWN), 1)
+        self.assertEqual(metrics.REQUESTS.value('predict_async', 'manova'),
+                         1)
+        for stage in ('lookup', 'preprocessing', 'inference',
+                      'postprocessing', 'audit'):
+            self.assertEqual(
+                metrics.STAGE_SECONDS.count(stage, self.label), 2)
+
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        lines = response.content.decode().splitlines()
+        self.assertIn(
+            'scorecard_requests_total{endpoint="predict",'
+            'algorithm="RandomForestClassifier/german/0.0.1"} 2.0', lines)
+        self.assertIn(
+            'scorecard_stage_duration_seconds_count{stage="inference",'
+            'algorithm="RandomForestClassifier/german/0.0.1"} 2', lines)
+        self.assertIn(
+            'scorecard_stage_duration_seconds_bucket{stage="inference",'
+            'algorithm="RandomForestClassifier/german/0.0.1",le="+Inf"} 2',
+            lines)
+
+        with override_settings(SCORECARD_METRICS={'ENABLED': False}):
+            client.post(self.url, test_data, format='json')
+            self.assertEqual(client.get('/metrics').status_code, 404)
+        self.assertEqual(metrics.REQUESTS.value(*labels), 2)
+
+    def test_compare_labels(self):
+        response = APIClient().post(
+            "/api/v1/algorithms/compare?dataset=german&version=0.0.1"
+            "&classifiers=RandomForestClassifier,GradientBoostClassifier",
+            test_data,
+            format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(
+            metrics.REQUESTS.value('compare', 'compare/german/0.0.1'), 1)
+        # the stages of each classifier are labelled by its algorithm
+        for name in ('RandomForestClassifier', 'GradientBoostClassifier'):
+            self.assertEqual(
+                metrics.STAGE_SECONDS.count('inference',
+                                            f'{name}/german/0.0.1'), 1)
+
+
+class PredictionCacheTests(TestCase):
+    def setUp(self):
+        metrics.clear()
+        self.addCleanup(metrics.clear)
+
+    def test_cached_predict_view(self):
+        client = APIClient()
+        cache = LocalPredictionCache()
+        url = "/api/v1/algorithms/predict?classifier=RandomForestClassifier"
+        with mock.patch('ml.cache.get_prediction_cache', return_value=cache):
+            first = client.post(url, test_data, format='json')
+            second = client.post(url, test_data, format='json')
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        lines = client.get('/metrics').content.decode().splitlines()
+        self.assertIn('scorecard_prediction_cache_total{result="hit"} 1.0',
+                      lines)
+        self.assertIn('scorecard_prediction_cache_total{result="miss"} 1.0',
+                      lines)
+        self.assertEqual(first.data['probability'],
+                         second.data['probability'])
+        # every request is still audited
+        self.assertNotEqual(first.data['request_id'],
+                            second.data['request_id'])
+        self.assertEqual(PredictionRequest.objects.count(), 2)
+
+
+class AuditTests(TestCase):
+    def prediction_request(self):
+        return PredictionRequest(input=test_data,
+                                 response={"label": expected_output},
+                                 prediction=expected_output,
+                                 feedback="")
+
+    def test_audit_writer_backpressure(self):
+        writer = AuditWriter(max_queue_size=2, put_timeout=0, autostart=False)
+        for _ in range(3):
+            writer.write(self.prediction_request())
+
+        # the queue holds two rows, the third one was written inline
+        self.assertEqual(PredictionRequest.objects.count(), 1)
+        writer.flush()
+        self.assertEqual(PredictionRequest.objects.count(), 3)
+
+    @override_settings(SCORECARD_AUDIT_MODE='async')
+    def test_predict_view_async_audit(self):
+        client = APIClient()
+        writer = AuditWriter(autostart=False)
+
+        classifier_url = "/api/v1/algorithms/predict?classifier=RandomForestClassifier&version=0.0.1"
+        with mock.patch('api.audit.get_audit_writer', return_value=writer):
+            response = client.post(classifier_url, test_data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data["request_id"])
+        self.assertFalse(PredictionRequest.objects.exists())
+
+        writer.flush()
+        response = client.get(
+            f"/api/v1/requests/{response.data['request_uuid']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["prediction"], expected_output)
+
+    def test_predict_batch_ids(self):
+        client = APIClient()
+        classifier_url = "/api/v1/algorithms/predict_batch?classifier=RandomForestClassifier&version=0.0.1"
+        # primary keys are read back on backends that do not return them
+        # from a bulk insert
+        with mock.patch.object(connection.features,
+                               'can_return_rows_from_bulk_insert', False):
+            response = client.post(classifier_url, [test_data, test_data],
+                                   format='json')
+        self.assertEqual(response.status_code, 200)
+        ids = [prediction["request_id"] for prediction in response.data]
+        self.assertEqual(
+            ids,
+            list(PredictionRequest.objects.order_by('id').values_list(
+                'id', flat=True)))
+
+    def test_audit_writer_retries_rows(self):
+        writer = AuditWriter(autostart=False)
+        existing = PredictionRequest.objects.create(
+            input=test_data, response={}, prediction=expected_output)
+        rows = [self.prediction_request() for _ in range(3)]
+        for row in rows:
+            writer.write(row)
+        # the batch fails on a duplicate uuid, the other rows are written
+        rows[1].uuid = existing.uuid
+        writer.flush()
+        self.assertEqual(PredictionRequest.objects.count(), 3)
+        self.assertTrue(
+            PredictionRequest.objects.filter(uuid=rows[2].uuid).exists())
+
+
+class FeedbackTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.algorithm_id, _ = registry.lookup('RandomForestClassifier',
+                                               '0.0.1', 'production',
+                                               'german')
+        self.probabilities = [0.05, 0.15, 0.3, 0.45, 0.55, 0.62, 0.71, 0.88]
+        self.requests = [
+            PredictionRequest.objects.create(
+                input=json.dumps(test_data),
+                response={"probability": probability},
+                prediction="good" if probability > 0.5 else "bad",
+                feedback="",
+                algorithm_id=self.algorithm_id)
+            for probability in self.probabilities
+        ]
+        self.performance_url = (
+            f'/api/v1/algorithms/{self.algorithm_id}/performance')
+
+    def post_feedback(self, outcomes):
+        return self.client.post('/api/v1/requests/feedback', [{
+            "request_id": request_id,
+            "actual_outcome": outcome
+        } for request_id, outcome in outcomes],
+                                format='json')
+
+    def assertPerformance(self, outcomes):
+        # outcomes of the requests, in the order of self.requests
+        performance = self.client.get(self.performance_url).data
+        scored = [(probability, outcome) for probability, outcome in zip(
+            self.probabilities, outcomes) if outcome]
+        actual = [outcome == "good" for _, outcome in scored]
+        scores = [probability for probability, _ in scored]
+        predicted = [probability > 0.5 for probability in scores]
+        self.assertEqual(performance['total'], len(scored))
+        self.assertEqual(performance['true_positives'],
+                         sum(a and p for a, p in zip(actual, predicted)))
+        self.assertEqual(performance['false_negatives'],
+                         sum(a and not p for a, p in zip(actual, predicted)))
+        # every score has its own bin, the histograms are exact
+        self.assertAlmostEqual(performance['auc'],
+                               roc_auc_score(actual, scores))
+        self.assertAlmostEqual(
+            performance['ks'],
+            ks_2samp([s for s, a in zip(scores, actual) if a],
+                     [s for s, a in zip(scores, actual) if not a]).statistic)
+
+    def test_bulk_feedback(self):
+        self.assertIsNone(self.client.get(self.performance_url).data['auc'])
+
+        outcomes = ["bad", "bad", "good", "bad", "good", "bad", "good", ""]
+        items = [(request.pk if position % 2 else str(request.uuid), outcome)
+                 for position, (request, outcome) in enumerate(
+                     zip(self.requests, outcomes)) if outcome]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_feedback(items + [(999999, "good")])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"updated": 7, "missing": [999999]})
+        # one read and one bulk update of the requests, whatever the count
+        self.assertLess(len(queries), 12)
+        self.assertEqual(
+            PredictionRequest.objects.get(pk=self.requests[2].pk).feedback,
+            "good")
+        self.assertPerformance(outcomes)
+
+        # a changed outcome replaces the previous one in the summary
+        outcomes[1] = "good"
+        outcomes[7] = "bad"
+        response = self.post_feedback([(self.requests[1].pk, "good"),
+                                       (self.requests[7].pk, "bad")])
+        self.assertEqual(response.data["updated"], 2)
+        self.assertPerformance(outcomes)
+
+        # feedback that is not an outcome takes it out of the summary
+        outcomes[0] = ""
+        response = self.client.patch(f'/api/v1/requests/{self.requests[0].pk}',
+                                     {"feedback": "unknown"},
+                                     format='json')
+        self.assertEqual(response.data["feedback"], "unknown")
+        self.assertPerformance(outcomes)
+
+        summary = AlgorithmPerformance.objects.get(pk=self.algorithm_id)
+        call_command('rebuild_performance', stdout=io.StringIO())
+        rebuilt = AlgorithmPerformance.objects.get(pk=self.algorithm_id)
+        self.assertEqual(rebuilt.good_scores, summary.good_scores)
+        self.assertEqual(rebuilt.bad_scores, summary.bad_scores)
+        self.assertEqual(rebuilt.total, summary.total)
+
+    def test_bulk_feedback_validation(self):
+        response = self.post_feedback([(self.requests[0].pk, "good"),
+                                       ("not-an-id", "bad"),
+                                       (self.requests[1].pk, "maybe")])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data["errors"]), {1, 2})
+        # nothing is written when an item is invalid
+        self.assertFalse(
+            PredictionRequest.objects.filter(feedback="good").exists())
+
+        response = self.client.post('/api/v1/requests/feedback', {
+            "request_id": 1,
+            "actual_outcome": "good"
+        },
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class DriftTests(TestCase):
+    def setUp(self):
+        drift.get_drift_monitor().clear()
+        self.client = APIClient()
+        self.algorithm_id, _ = registry.lookup('RandomForestClassifier',
+                                               '0.0.1', 'production',
+                                               'german')
+        frame, _, _ = load_dataset('german')
+        self.records = json.loads(frame.to_json(orient='records'))
+        self.drift_url = f'/api/v1/algorithms/{self.algorithm_id}/drift'
+
+    def predict_batch(self, records):
+        response = self.client.post(
+            "/api/v1/algorithms/predict_batch?classifier="
+            "RandomForestClassifier&version=0.0.1",
+            records,
+            format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_drift_monitor(self):
+        self.assertEqual(self.client.get(self.drift_url).data['observations'],
+                         0)
+
+        # the training data itself does not drift
+        self.predict_batch(self.records)
+        report = self.client.get(self.drift_url).data
+        self.assertEqual(report['dataset'], 'german')
+        self.assertEqual(report['observations'], len(self.records))
+        self.assertEqual(report['status'], drift.STABLE)
+        features = {result['feature']: result for result in report['features']}
+        self.assertEqual(set(features), set(self.records[0]))
+        self.assertAlmostEqual(features['age']['psi'], 0.0)
+        self.assertAlmostEqual(features['age']['ks'], 0.0)
+        self.assertIsNone(features['sex']['ks'])
+
+        # applicants thirty years older
+        self.predict_batch([dict(record, age=record['age'] + 30)
+                            for record in self.records])
+        report = self.client.get(self.drift_url).data
+        self.assertEqual(report['observations'], 2 * len(self.records))
+        self.assertEqual(report['status'], drift.ALERT)
+        self.assertEqual(report['features'][0]['feature'], 'age')
+        self.assertEqual(report['features'][0]['status'], drift.ALERT)
+        features = {result['feature']: result for result in report['features']}
+        self.assertAlmostEqual(features['sex']['psi'], 0.0)
+
+    def test_unseen_values(self):
+        monitor = drift.DriftMonitor()
+        monitor.observe(self.algorithm_id,
+                        dict(self.records[0], purpose='spaceship', age=None))
+        monitor.flush()
+        row = AlgorithmDrift.objects.get(pk=self.algorithm_id)
+        self.assertEqual(row.observations, 1)
+        # unseen categories have their own bin, missing values are skipped
+        self.assertEqual(row.histograms['purpose'][-1], 1)
+        self.assertEqual(sum(row.histograms['age']), 0)
+
+    def test_preload_baselines(self):
+        drift.preload_baselines()
+        # the first scored request only selects the features of the
+        # preloaded dataset baseline
+        with mock.patch('ml.drift.load_dataset') as load:
+            monitor = drift.DriftMonitor()
+            monitor.observe(self.algorithm_id, self.records[0])
+        load.assert_not_called()
+
+    def test_drift_report_command(self):
+        self.predict_batch(self.records[:200])
+        drift.get_drift_monitor().clear()
+
+        output = io.StringIO()
+        call_command('drift_report', rebuild=True, stdout=output)
+        self.assertIn('Counted 200 prediction requests', output.getvalue())
+        self.assertIn(f'Algorithm {self.algorithm_id} (german): 200 '
+                      'applicants', output.getvalue())
+        self.assertIn('credit_amount', output.getvalue())
+
+        output = io.StringIO()
+        call_command('drift_report', reset=True, stdout=output)
+        self.assertIn('Deleted the histograms of 1 algorithms',
+                      output.getvalue())
+        output = io.StringIO()
+        call_command('drift_report', stdout=output)
+        self.assertIn('No feature drift recorded', output.getvalue())
+
+
+class ListEndpointTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.algorithm_id, _ = registry.lookup('RandomForestClassifier',
+                                               '0.0.1', 'production',
+                                               'german')
+        self.now = timezone.now()
+        self.ids = []
+        for day in range(6):
+            request = PredictionRequest.objects.create(
+                input=json.dumps(test_data),
+                response={"label": "bad" if day % 2 else "good"},
+                prediction="bad" if day % 2 else "good",
+                feedback="",
+                algorithm_id=self.algorithm_id if day < 3 else None)
+            PredictionRequest.objects.filter(pk=request.pk).update(
+                created_at=self.now - timedelta(days=6 - day))
+            self.ids.append(request.pk)
+
+    def test_request_cursor_pagination(self):
+        response = self.client.get('/api/v1/requests', {'page_size': 4})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertIsNone(response.data['previous'])
+
+        ids = [row['id'] for row in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [row['id'] for row in response.data['results']]
+        self.assertEqual(ids, self.ids)
+
+        # without cursor or page_size the list is a plain array
+        response = self.client.get('/api/v1/requests')
+        self.assertEqual([row['id'] for row in response.data], self.ids)
+
+    def test_request_filters(self):
+        def listed(**params):
+            response = self.client.get('/api/v1/requests', params)
+            self.assertEqual(response.status_code, 200)
+            return [row['id'] for row in response.data]
+
+        self.assertEqual(listed(prediction='bad'), self.ids[1::2])
+        self.assertEqual(listed(algorithm=self.algorithm_id), self.ids[:3])
+        self.assertEqual(listed(classifier='RandomForestClassifier'),
+                         self.ids[:3])
+        self.assertEqual(
+            listed(created_at_after=(self.now -
+                                     timedelta(days=2, hours=1)).isoformat(),
+                   created_at_before=self.now.isoformat()), self.ids[4:])
+        self.assertEqual(
+            listed(prediction='good',
+                   created_at_after=(self.now -
+                                     timedelta(days=5)).isoformat()),
+            [self.ids[2], self.ids[4]])
+
+    def test_fields_projection(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/requests',
+                                       {'fields': 'id,prediction'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data[0]), {'id', 'prediction'})
+        # the JSON columns are not read
+        select, = [query['sql'] for query in queries.captured_queries]
+        self.assertNotIn('"input"', select)
+        self.assertNotIn('"response"', select)
+
+        response = self.client.get(f'/api/v1/requests/{self.ids[0]}',
+                                   {'fields': 'id,response'})
+        self.assertEqual(response.data, {
+            'id': self.ids[0],
+            'response': {
+                'label': 'good'
+            }
+        })
+
+        response = self.client.get('/api/v1/requests',
+                                   {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/api/v1/algorithms', {
+            'classifier': 'RandomForestClassifier',
+            'fields': 'classifier,version'
+        })
+        self.assertTrue(response.data)
+        for row in response.data:
+            self.assertEqual(row['classifier'], 'RandomForestClassifier')
+            self.assertEqual(set(row), {'classifier', 'version'})
+
+        response = self.client.get('/api/v1/datasets', {'name': 'german'})
+        self.assertEqual([row['name'] for row in response.data], ['german'])
+
+    def test_export(self):
+        response = self.client.get('/api/v1/requests/export')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual([row['id'] for row in rows], self.ids)
+        self.assertEqual(rows[0]['response'], {"label": "good"})
+
+        response = self.client.get('/api/v1/requests/export', {
+            'export_format': 'csv',
+            'gzip': 'true',
+            'prediction': 'bad'
+        })
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('prediction_requests.csv.gz',
+                      response['Content-Disposition'])
+        content = gzip.decompress(b''.join(response.streaming_content))
+        rows = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual([int(row['id']) for row in rows], self.ids[1::2])
+        self.assertEqual(json.loads(rows[0]['response']), {"label": "bad"})
+
+        response = self.client.get('/api/v1/requests/export',
+                                   {'export_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+        # the keyset reads used on MySQL return the same rows
+        queryset = PredictionRequest.objects.all()
+        self.assertEqual(list(export.keyset_rows(queryset, 4)),
+                         list(export.iter_rows(queryset, 4)))
+
+    def test_export_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'requests.jsonl.gz')
+        call_command('export_requests',
+                     output=path,
+                     chunk_size=2,
+                     prediction='good',
+                     after=(self.now - timedelta(days=5)).isoformat())
+        with gzip.open(path, 'rt') as exported:
+            rows = [json.loads(line) for line in exported]
+        self.assertEqual([row['id'] for row in rows],
+                         [self.ids[2], self.ids[4]])
+        self.assertEqual(set(rows[0]), set(export.FIELDS))
+
+
+class ScoringJobTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_root = override_settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        self.client = APIClient()
+        self.algorithm_id, self.classifier = registry.lookup(
+            'RandomForestClassifier', '0.0.1', 'production', 'german')
+
+    def submit(self, name, content, **fields):
+        upload = SimpleUploadedFile(name, content.encode('utf-8'))
+        return self.client.post('/api/v1/jobs',
+                                dict(fields,
+                                     algorithm=self.algorithm_id,
+                                     input_file=upload),
+                                format='multipart')
+
+    def run_worker(self, workers=0):
+        call_command('run_scoring_jobs',
+                     once=True,
+                     workers=workers,
+                     stdout=io.StringIO())
+
+    def test_scoring_job(self):
+        records = [test_data, dict(test_data, purpose="spaceship"), test_data]
+        content = ','.join(test_data) + '\n' + ''.join(
+            ','.join(str(value) for value in record.values()) + '\n'
+            for record in records)
+        response = self.submit('portfolio.csv', content, chunk_size=2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], ScoringJob.QUEUED)
+        self.assertEqual(response.data['format'], 'csv')
+        job_url = f"/api/v1/jobs/{response.data['id']}"
+        self.assertEqual(self.client.get(f'{job_url}/result').status_code,
+                         404)
+
+        self.run_worker(workers=2)
+
+        response = self.client.get(job_url)
+        self.assertEqual(response.data['status'], ScoringJob.COMPLETED)
+        self.assertEqual(response.data['total_rows'], 3)
+        self.assertEqual(response.data['processed_rows'], 3)
+        self.assertEqual(response.data['failed_rows'], 1)
+        self.assertEqual(response.data['progress'], 1.0)
+
+        response = self.client.get(f'{job_url}/result')
+        self.assertEqual(response.status_code, 200)
+        rows = list(
+            csv.DictReader(
+                io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['row'] for row in rows], ['0', '1', '2'])
+        expected = self.classifier.compute_prediction(dict(test_data))
+        self.assertEqual(rows[0]['label'], expected['label'])
+        self.assertAlmostEqual(float(rows[2]['probability']),
+                               expected['probability'])
+        self.assertIn('unknown value', rows[1]['error'])
+
+        self.assertEqual(self.client.post(f'{job_url}/cancel').status_code,
+                         400)
+        self.assertEqual(self.client.delete(job_url).status_code, 204)
+        self.assertFalse(ScoringJob.objects.exists())
+
+    def test_scoring_job_resume_and_cancel(self):
+        content = ''.join(json.dumps(dict(test_data, age=age)) + '\n'
+                          for age in range(20, 25))
+        response = self.submit('portfolio.jsonl', content, chunk_size=2)
+        job_url = f"/api/v1/jobs/{response.data['id']}"
+
+        # the worker dies while scoring the second chunk
+        compute_batch = Classifier.compute_batch
+        with mock.patch.object(Classifier,
+                               'compute_batch',
+                               autospec=True,
+                               side_effect=[
+                                   compute_batch(self.classifier,
+                                                 [dict(test_data)] * 2),
+                                   MemoryError('out of memory')
+                               ]):
+            self.run_worker()
+        response = self.client.get(job_url)
+        self.assertEqual(response.data['status'], ScoringJob.FAILED)
+        self.assertEqual(response.data['processed_rows'], 2)
+        self.assertEqual(response.data['error'], 'out of memory')
+
+        response = self.client.post(f'{job_url}/resume')
+        self.assertEqual(response.data['status'], ScoringJob.QUEUED)
+        self.run_worker()
+        response = self.client.get(f'{job_url}/result')
+        rows = [
+            json.loads(line) for line in b''.join(
+                response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual([row['row'] for row in rows], list(range(5)))
+        # the results of the first claim were carried over and removed
+        self.assertEqual(
+            default_storage.listdir(jobs.RESULTS_DIR)[1],
+            [os.path.basename(ScoringJob.objects.get().result_file.name)])
+
+        response = self.submit('portfolio.jsonl', content)
+        job_url = f"/api/v1/jobs/{response.data['id']}"
+        response = self.client.post(f'{job_url}/cancel')
+        self.assertEqual(response.data['status'], ScoringJob.CANCELLED)
+        self.run_worker()
+        self.assertEqual(
+            self.client.get(job_url).data['status'], ScoringJob.CANCELLED)
+
+    def test_scoring_job_claim(self):
+        content = ''.join(json.dumps(test_data) + '\n' for _ in range(3))
+        response = self.submit('portfolio.jsonl', content, chunk_size=2)
+        job = jobs.claim_job()
+        self.assertIsNotNone(job.claim_token)
+
+        heartbeat = jobs.Heartbeat(job, interval=60)
+        ScoringJob.objects.filter(pk=job.pk).update(
+            heartbeat_at=timezone.now() - timedelta(seconds=600))
+        self.assertTrue(heartbeat.beat())
+        self.assertEqual(jobs.requeue_stale_jobs(300), 0)
+
+        # the job is queued again while its worker is stuck on a chunk
+        ScoringJob.objects.filter(pk=job.pk).update(
+            heartbeat_at=timezone.now() - timedelta(seconds=600))
+        self.assertEqual(jobs.requeue_stale_jobs(300), 1)
+        self.assertFalse(heartbeat.beat())
+
+        claimed = jobs.claim_job()
+        self.assertNotEqual(claimed.claim_token, job.claim_token)
+        # the former worker does not write to the job anymore
+        jobs.run_job(job, workers=0)
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.status, ScoringJob.RUNNING)
+        self.assertEqual(claimed.processed_rows, 0)
+
+        # nor to the result file of the job
+        stale = default_storage.path(
+            f'{jobs.RESULTS_DIR}/{job.pk}-{job.claim_token.hex}.jsonl')
+        os.makedirs(os.path.dirname(stale), exist_ok=True)
+        with open(stale, 'w') as result:
+            result.write('{"row": 0}\n')
+
+        jobs.run_job(claimed, workers=0)
+        response = self.client.get(f"/api/v1/jobs/{response.data['id']}")
+        self.assertEqual(response.data['status'], ScoringJob.COMPLETED)
+        self.assertEqual(response.data['processed_rows'], 3)
+        claimed.refresh_from_db()
+        self.assertIn(claimed.claim_token.hex, claimed.result_file.name)
+        self.assertFalse(os.path.exists(stale))
+        response = self.client.get(f"/api/v1/jobs/{claimed.pk}/result")
+        self.assertEqual(
+            len(b''.join(response.streaming_content).decode().splitlines()),
+            3)
+
+    def test_scoring_job_validation(self):
+        response = self.submit('portfolio.xlsx', 'age\n22\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('format', response.data)
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_archive_requests(self):
+        now = timezone.now()
+        ages = [400, 380, 366, 500, 370, 10, 0]
+        for age in ages:
+            request = PredictionRequest.objects.create(
+                input=json.dumps(test_data),
+                response={"label": "bad"},
+                prediction="bad",
+                feedback="")
+            PredictionRequest.objects.filter(pk=request.pk).update(
+                created_at=now - timedelta(days=age))
+        expired = list(
+            PredictionRequest.objects.filter(
+                created_at__lt=now - timedelta(days=365)).order_by(
+                    'created_at').values_list('id', flat=True))
+        self.assertEqual(len(expired), 5)
+
+        output = io.StringIO()
+        call_command('archive_requests',
+                     days=365,
+                     directory=self.directory,
+                     dry_run=True,
+                     stdout=output)
+        self.assertIn('5 prediction requests', output.getvalue())
+        self.assertEqual(PredictionRequest.objects.count(), len(ages))
+
+        # batches of two rows, each its own gzip member
+        call_command('archive_requests',
+                     days=365,
+                     directory=self.directory,
+                     batch_size=2,
+                     stdout=io.StringIO())
+        self.assertEqual(PredictionRequest.objects.count(), 2)
+        archive, = os.listdir(self.directory)
+        rows = list(
+            retention.read_archive(os.path.join(self.directory, archive)))
+        self.assertEqual([row['id'] for row in rows], expired)
+        self.assertEqual(set(rows[0]), set(retention.FIELDS))
+        self.assertEqual(rows[0]['response'], {"label": "bad"})
+
+        output = io.StringIO()
+        call_command('archive_requests',
+                     days=365,
+                     directory=self.directory,
+                     stdout=output)
+        self.assertIn('No prediction requests', output.getvalue())
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+
+class StatisticalScoringTests(TestCase):
+    def test_cached_regressions_match_refit(self):
+        for method in ['linearRegression', 'polynomialRegression']:
+            cached = stat_score(dict(test_data), method)
+            refit = stat_score(dict(test_data), method, refit=True)
+            self.assertEqual(cached['method'], method)
+            self.assertEqual(cached['color'], refit['color'])
+            # the only difference is the applicant row in the statistics
+            self.assertAlmostEqual(cached['probability'],
+                                   refit['probability'],
+                                   delta=0.05)
+
+        # models are fitted once per dataset and reused
+        self.assertIs(reference_model(), reference_model())
+        self.assertIs(reference_model().model('linearRegression'),
+                      reference_model().model('linearRegression'))
+
+    def test_unknown_method(self):
+        with self.assertRaisesMessage(ValueError,
+                                      'Unknown statistical method anova'):
+            stat_score(dict(test_data), 'anova')
+        with self.assertRaisesMessage(ValueError,
+                                      'Unknown statistical method anova'):
+            make_regression('anova')
+
+    def test_manova_matches_statsmodels(self):
+        output = stat_score(dict(test_data), 'manova')
+        self.assertEqual(output['method'], 'manova')
+
+        ref = reference_model()
+        row = ref.transform(test_data)[0]
+        x = row[[ref.columns.index(col) for col in ref.endog]]
+        purpose = row[ref.columns.index('purpose')]
+        for risk in ['good', 'bad']:
+            code = ref.encoders['risk'].transform([risk])[0]
+            group = ref.data[ref.data['risk'] == code]
+            endog = np.vstack([group[ref.endog].values, x])
+            exog = np.append(group['purpose'].values, purpose)[:, None]
+            stat = MANOVA(endog=endog,
+                          exog=exog).mv_test().results['x0']['stat']
+            self.assertAlmostEqual(output[f'WL_test_{risk}'],
+                                   stat['Value']["Wilks' lambda"])
+
+            if (output['color'] == 'green') == (risk == 'good'):
+                self.assertAlmostEqual(output['wilkis_lambda'],
+                                       stat['Value']["Wilks' lambda"])
+                self.assertAlmostEqual(output['pillais_trace'],
+                                       stat['Value']["Pillai's trace"])
+                self.assertAlmostEqual(
+                    output['hotelling_tawley'],
+                    stat['Value']["Hotelling-Lawley trace"])
+                self.assertAlmostEqual(output['roys_reatest_roots'],
+                                       stat['Value']["Roy's greatest root"])
+
+    def test_stat_predict_view(self):
+        client = APIClient()
+
+        classifier_url = "/api/v1/algorithms/predict?classifier=linearRegression"
+        response = client.post(classifier_url, test_data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["method"], "linearRegression")
+        self.assertTrue("request_id" in response.data)
+
+        classifier_url = "/api/v1/algorithms/predict?classifier=manova"
+        response = client.post(classifier_url, test_data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["method"], "manova")
+        self.assertTrue("wilkis_lambda" in response.data)
@@ -26,7 +26,7 @@ from django.urls import path, include
 from rest_framework import routers
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
-from api.views import AlgorithmViewSet, DatasetViewSet, PredictionRequestViewSet
+from api.views import AlgorithmViewSet, DatasetViewSet, PredictionRequestViewSet, ScoringJobViewSet, predict_async, scoring_metrics
 
 router = routers.DefaultRouter(trailing_slash=False)
 router.register(r"algorithms", AlgorithmViewSet, basename="algorithms")
@@ -34,6 +34,7 @@ router.register(r"datasets", DatasetViewSet, basename="datasets")
 router.register(r"requests",
                 PredictionRequestViewSet,
                 basename="prediction_requests")
+router.register(r"jobs", ScoringJobViewSet, basename="scoring_jobs")
 
 urlpatterns = [
     # API docs
@@ -50,5 +51,11 @@ urlpatterns = [
     # API Views
     path('api-auth/', include('rest_framework.urls',
                               namespace='rest_framework')),
+    path('api/v1/async/algorithms/predict',
+         predict_async,
+         name='algorithms_predict_async'),
     path('api/v1/', include(router.urls)),
+
+    # Prometheus scrape target
+    path('metrics', scoring_metrics, name='metrics'),
 ]
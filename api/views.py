@@ -20,35 +20,121 @@
 import json
 import logging
 from stats.statistical_scoring import stat_score
-from typing import Any, Dict
+from typing import Any, Dict, List
 
-from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample, inline_serializer
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter, OpenApiExample, inline_serializer
 
-from rest_framework import viewsets
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django_filters.rest_framework import DjangoFilterBackend
+
+from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import APIException, bad_request
-from rest_framework.fields import CharField, FloatField, IntegerField
+from rest_framework.exceptions import APIException, NotFound, ValidationError, bad_request
+from rest_framework.fields import CharField, DateTimeField, DictField, FloatField, IntegerField, ListField
 from rest_framework.response import Response
 
-from api.models import Algorithm, Dataset, PredictionRequest
-from api.serializers import AlgorithmSerializer, PredictionRequestSerializer, DatasetSerializer
+from api.audit import record_predictions
+from api.concurrency import Overloaded, get_inference_executor
+from api.drift import drift_report, get_drift_monitor
+from api.export import CONTENT_TYPES, FORMATS, JSONL, export_requests
+from api.feedback import feedback_options, parse_feedback, record_feedback
+from api.filters import AlgorithmFilter, DatasetFilter, PredictionRequestFilter
+from api.jobs import remove_results
+from api.models import Algorithm, AlgorithmPerformance, Dataset, PredictionRequest, ScoringJob
+from api.pagination import CreatedCursorPagination, IdCursorPagination
+from api.serializers import AlgorithmPerformanceSerializer, AlgorithmSerializer, PredictionRequestSerializer, DatasetSerializer, ScoringJobSerializer
 
 from ml.classifiers import RandomForestClassifier
 
-from server.wsgi import registry
+from ml.cache import cached_prediction
+from ml import metrics
+from ml.ensemble import ensemble, get_executor, score_classifiers
+from ml.registry import registry
 
 # Create your views here.
 
 log = logging.getLogger(__name__)
 
+FIELDS_PARAMETER = OpenApiParameter(
+    name='fields',
+    description='Comma separated fields to return, all by default. JSON '
+    'and text columns that are not listed are not read from the database.')
+
+# list and retrieve of the viewsets with fields projection
+PROJECTED = extend_schema_view(
+    list=extend_schema(parameters=[FIELDS_PARAMETER]),
+    retrieve=extend_schema(parameters=[FIELDS_PARAMETER]))
+
+
+class FieldsProjectionMixin(object):
+    """
+    ``?fields=`` projection of the list and retrieve responses
+
+    Only the named fields are serialized, and the JSON and text columns of
+    the model that are not named are deferred, so the large blobs are not
+    read when a client does not ask for them.
+    """
+    projected_actions = ('list', 'retrieve')
+
+    def get_projected_fields(self):
+        if self.action not in self.projected_actions:
+            return None
+        if not hasattr(self, '_projected_fields'):
+            value = self.request.query_params.get('fields')
+            fields = None
+            if value:
+                fields = [name.strip() for name in value.split(',')
+                          if name.strip()]
+                unknown = set(fields) - set(
+                    self.get_serializer_class()().fields)
+                if unknown:
+                    raise ValidationError({
+                        "fields":
+                        f"Unknown fields: {', '.join(sorted(unknown))}"
+                    })
+            self._projected_fields = fields
+        return self._projected_fields
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_projected_fields()
+        if fields is not None:
+            deferred = [
+                field.name for field in queryset.model._meta.concrete_fields
+                if isinstance(field, (models.JSONField, models.TextField))
+                and field.name not in fields
+            ]
+            queryset = queryset.defer(*deferred)
+        return queryset
 
-class AlgorithmViewSet(viewsets.ModelViewSet):
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_projected_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+
+@PROJECTED
+class AlgorithmViewSet(FieldsProjectionMixin, viewsets.ModelViewSet):
+    """
+    Registered algorithms and the predictions made with them
+    """
     # permission_classes = []
     serializer_class = AlgorithmSerializer
     queryset = Algorithm.objects.all()
+    pagination_class = CreatedCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = AlgorithmFilter
 
     @extend_schema(
-        description='Predict credit risk for a loan',
+        description='Predict credit risk for a loan. request_id is null when '
+        'audit records are written asynchronously, the request is then '
+        'identified by request_uuid.',
         parameters=[
             OpenApiParameter(
                 name='classifier',
@@ -87,51 +173,29 @@ class AlgorithmViewSet(viewsets.ModelViewSet):
                                         "pillais_trace": FloatField(),
                                         "hotelling_tawley": FloatField(),
                                         "roys_reatest_roots": FloatField(),
-                                        "request_id": IntegerField()
+                                        "request_id": IntegerField(allow_null=True),
+                                        "request_uuid": CharField()
                                     }))
     @action(detail=False, methods=['post'])
+    @metrics.tracked('predict')
     def predict(self, request, format=None):
 
         try:
             classifier = self.request.query_params.get("classifier")
-            region = self.request.query_params.get("dataset", "german")
-            version = self.request.query_params.get("version", "0.0.1")
-            status = self.request.query_params.get("status", "production")
-
-            print(request)
-
-            if version is None:
-                raise bad_request(
-                    request=request,
-                    data={
-                        "error": "Missing required query parameter: version"
-                    })
-            if classifier is None:
-                raise bad_request(
-                    request=request,
-                    data={
-                        "error": "Missing required query parameter: classifier"
-                    })
 
             if classifier in [
                     'manova', 'linearRegression', 'polynomialRegression'
             ]:
-                prediction = stat_score(request.data, classifier)
-                algorithm = None
+                metrics.set_algorithm(classifier)
+                with metrics.stage('inference'):
+                    prediction = stat_score(request.data, classifier)
+                algorithm_id = None
 
             else:
-                algorithm: Algorithm = Algorithm.objects.filter(
-                    classifier=classifier,
-                    status=status,
-                    version=version,
-                    dataset__name=region)[0]
-
-                if algorithm is None:
-                    raise bad_request(
-                        request=request,
-                        data={"error": "ML algorithm is not available"})
-                classifier = registry.classifiers[algorithm.id]
-                prediction = classifier.compute_prediction(request.data)
+                algorithm_id, classifier = self._get_algorithm(request)
+                prediction = cached_prediction(algorithm_id, classifier,
+                                               request.data,
+                                               registry.label(algorithm_id))
 
             if "label" in prediction:
                 label = prediction["label"]
@@ -143,23 +207,579 @@ class AlgorithmViewSet(viewsets.ModelViewSet):
                                                    response=prediction,
                                                    prediction=label,
                                                    feedback="",
-                                                   algorithm=algorithm)
-            prediction_request.save()
+                                                   algorithm_id=algorithm_id)
+            with metrics.stage('audit'):
+                request_id, = record_predictions([prediction_request])
+
+            prediction["request_id"] = request_id
+            prediction["request_uuid"] = str(prediction_request.uuid)
+
+            return Response(prediction)
+        except Exception as e:
+            raise APIException(str(e))
+
+    @extend_schema(
+        description='Predict credit risk for a batch of loans. Results are '
+        'returned in request order; records that fail validation get an '
+        '"error" entry instead of failing the whole batch.',
+        parameters=[
+            OpenApiParameter(name='classifier',
+                             description='The algorithm/classifier to use',
+                             required=True),
+            OpenApiParameter(name='dataset',
+                             description='The name of the dataset'),
+            OpenApiParameter(name='status',
+                             description='The status of the algorithm',
+                             deprecated=True),
+            OpenApiParameter(name='version',
+                             description='Algorithm version',
+                             required=True,
+                             default='0.0.1'),
+        ],
+        operation_id='algorithms_predict_batch',
+        request=List[Dict[str, Any]],
+        responses=inline_serializer(name="BatchPredictionResponse",
+                                    fields={
+                                        "probability": FloatField(),
+                                        "label": CharField(),
+                                        "error": CharField(),
+                                        "request_id": IntegerField(allow_null=True),
+                                        "request_uuid": CharField()
+                                    },
+                                    many=True))
+    @action(detail=False, methods=['post'], pagination_class=None)
+    @metrics.tracked('predict_batch')
+    def predict_batch(self, request, format=None):
+
+        if not isinstance(request.data, list):
+            raise ValidationError(
+                {"error": "Request body must be a list of records"})
+
+        try:
+            algorithm_id, classifier = self._get_algorithm(request)
+            predictions = classifier.compute_batch(
+                request.data, label=registry.label(algorithm_id))
+
+            prediction_requests = []
+            for record, prediction in zip(request.data, predictions):
+                if "error" in prediction:
+                    continue
+                prediction_requests.append(
+                    PredictionRequest(input=json.dumps(record),
+                                      response=prediction,
+                                      prediction=prediction["label"],
+                                      feedback="",
+                                      algorithm_id=algorithm_id))
+            with metrics.stage('audit'):
+                request_ids = iter(record_predictions(prediction_requests))
+            saved = iter(prediction_requests)
+            for prediction in predictions:
+                if "error" not in prediction:
+                    prediction["request_id"] = next(request_ids)
+                    prediction["request_uuid"] = str(next(saved).uuid)
+
+            return Response(predictions)
+        except Exception as e:
+            raise APIException(str(e))
+
+    @extend_schema(
+        description='Score a loan with several algorithms of one dataset in '
+        'a single call. The applicant is encoded once per input schema and '
+        'the classifiers run concurrently. With weights or ensemble=true the '
+        'response also holds the weighted ensemble probability and label. '
+        'The call is logged as one prediction request.',
+        parameters=[
+            OpenApiParameter(
+                name='classifiers',
+                description='Comma separated classifiers to compare, every '
+                'classifier of the dataset and version by default',
+                examples=[
+                    OpenApiExample(
+                        'Example 1',
+                        value='RandomForestClassifier,GradientBoostClassifier')
+                ]),
+            OpenApiParameter(name='dataset',
+                             description='The name of the dataset',
+                             examples=[OpenApiExample('Example 1',
+                                                      value='german')]),
+            OpenApiParameter(name='version',
+                             description='Algorithm version',
+                             default='0.0.1'),
+            OpenApiParameter(
+                name='status',
+                description='The status of the algorithms, by default the '
+                'production algorithm of each classifier if there is one'),
+            OpenApiParameter(
+                name='weights',
+                description='Ensemble weights as classifier:weight pairs',
+                examples=[
+                    OpenApiExample(
+                        'Example 1',
+                        value='RandomForestClassifier:2,'
+                        'GradientBoostClassifier:1')
+                ]),
+            OpenApiParameter(name='ensemble',
+                             type=bool,
+                             description='Add an equally weighted ensemble'),
+        ],
+        operation_id='algorithms_compare',
+        request=Dict[str, Any],
+        responses=inline_serializer(name="CompareResponse",
+                                    fields={
+                                        "scores": DictField(),
+                                        "algorithms": DictField(),
+                                        "probability": FloatField(),
+                                        "label": CharField(),
+                                        "weights": DictField(),
+                                        "method": CharField(),
+                                        "request_id": IntegerField(allow_null=True),
+                                        "request_uuid": CharField()
+                                    }))
+    @action(detail=False, methods=['post'])
+    @metrics.tracked('compare')
+    def compare(self, request, format=None):
+        params = self.request.query_params
+        dataset = params.get("dataset", "german")
+        version = params.get("version", "0.0.1")
+
+        names = None
+        if params.get("classifiers"):
+            names = [
+                name.strip() for name in params["classifiers"].split(',')
+                if name.strip()
+            ]
+        weights = self._get_weights(request)
+        if names is None and weights is not None:
+            names = list(weights)
 
-            prediction["request_id"] = prediction_request.id
+        with metrics.stage('lookup'):
+            resolved = registry.lookup_dataset(dataset, version, names,
+                                               params.get("status"))
+            if resolved:
+                # several algorithms answer, the request is labelled by
+                # their dataset and version and each stage by its algorithm
+                metrics.set_algorithm(
+                    metrics.algorithm_label('compare', dataset, version))
+        missing = [name for name in names or [] if name not in resolved]
+        if missing or not resolved:
+            raise ValidationError({
+                "error":
+                "ML algorithm is not available: " +
+                (', '.join(missing) or f'{dataset} {version}')
+            })
+        if weights is None and params.get("ensemble", "").lower() in ("1",
+                                                                     "true"):
+            weights = {name: 1.0 for name in resolved}
+        if weights is not None and set(weights) - set(resolved):
+            raise ValidationError(
+                {"error": "Weights must be given for compared classifiers"})
+
+        try:
+            scores = score_classifiers(
+                {name: classifier
+                 for name, (_, classifier) in resolved.items()},
+                request.data, get_executor(), {
+                    name: registry.label(algorithm_id)
+                    for name, (algorithm_id, _) in resolved.items()
+                })
+            prediction = {
+                "method": "compare",
+                "scores": scores,
+                "algorithms": {
+                    name: algorithm_id
+                    for name, (algorithm_id, _) in resolved.items()
+                },
+            }
+            if weights is not None:
+                prediction.update(ensemble(scores, weights))
+                prediction["method"] = "ensemble"
+
+            # several algorithms answered, none is referenced by the row
+            prediction_request = PredictionRequest(
+                input=json.dumps(request.data),
+                response=prediction,
+                prediction=prediction.get("label", prediction["method"]),
+                feedback="")
+            with metrics.stage('audit'):
+                request_id, = record_predictions([prediction_request])
+
+            prediction["request_id"] = request_id
+            prediction["request_uuid"] = str(prediction_request.uuid)
 
             return Response(prediction)
         except Exception as e:
             raise APIException(str(e))
 
+    @extend_schema(
+        description='Confusion matrix, accuracy, AUC and KS of the '
+        'predictions of an algorithm that were given a good or bad outcome '
+        'as feedback. Good is the positive class.',
+        responses=AlgorithmPerformanceSerializer)
+    @action(detail=True, methods=['get'])
+    def performance(self, request, pk=None):
+        algorithm = self.get_object()
+        performance = AlgorithmPerformance.objects.filter(
+            algorithm=algorithm).first()
+        if performance is None:
+            performance = AlgorithmPerformance(algorithm=algorithm)
+        return Response(AlgorithmPerformanceSerializer(performance).data)
+
+    @extend_schema(
+        description='Population stability index (PSI) and, for numeric '
+        'features, Kolmogorov-Smirnov distance (KS) of the applicants scored '
+        'by an algorithm against its training dataset, most drifted feature '
+        'first. status is stable, warning or alert by the PSI thresholds.',
+        responses=inline_serializer(name="DriftResponse",
+                                    fields={
+                                        "algorithm": IntegerField(),
+                                        "dataset": CharField(),
+                                        "observations": IntegerField(),
+                                        "updated_at": DateTimeField(),
+                                        "status": CharField(),
+                                        "features": ListField(
+                                            child=DictField())
+                                    }))
+    @action(detail=True, methods=['get'])
+    def drift(self, request, pk=None):
+        algorithm = self.get_object()
+        # the counts of this process are reported right away
+        get_drift_monitor().flush()
+        return Response(drift_report(algorithm.id))
+
+    def _get_weights(self, request):
+        """
+        Parse the classifier:weight pairs of the weights query parameter
+        """
+        value = self.request.query_params.get("weights")
+        if not value:
+            return None
+
+        weights = {}
+        for pair in value.split(','):
+            name, _, weight = pair.partition(':')
+            try:
+                weights[name.strip()] = float(weight)
+            except ValueError:
+                raise ValidationError(
+                    {"error": f"Invalid weight for {name}: {weight}"})
+            if weights[name.strip()] < 0:
+                raise ValidationError(
+                    {"error": f"Weight of {name} cannot be negative"})
+        return weights
+
+    def _get_algorithm(self, request):
+        """
+        Resolve the registered algorithm id and classifier for a predict
+        call from the request query parameters, without querying the
+        database for known algorithms.
+        """
+        classifier = self.request.query_params.get("classifier")
+        region = self.request.query_params.get("dataset", "german")
+        version = self.request.query_params.get("version", "0.0.1")
+        status = self.request.query_params.get("status", "production")
+
+        if version is None:
+            raise bad_request(
+                request=request,
+                data={"error": "Missing required query parameter: version"})
+        if classifier is None:
+            raise bad_request(
+                request=request,
+                data={"error": "Missing required query parameter: classifier"})
+
+        with metrics.stage('lookup'):
+            resolved = registry.lookup(classifier, version, status, region)
+            if resolved is not None:
+                metrics.set_algorithm(registry.label(resolved[0]))
+
+        if resolved is None:
+            raise bad_request(request=request,
+                              data={"error": "ML algorithm is not available"})
+
+        return resolved
+
+
+STAT_METHODS = ['manova', 'linearRegression', 'polynomialRegression']
+
+
+@metrics.tracked('predict_async')
+async def predict_async(request):
+    """
+    Async equivalent of AlgorithmViewSet.predict for ASGI deployments
+
+    The event loop only parses the request and resolves the algorithm from
+    the in-process registry index. Scoring runs on the bounded inference
+    executor and database access goes through sync_to_async, so a worker
+    keeps many requests in flight without a thread per request. Pair it
+    with SCORECARD_AUDIT_MODE=async to keep audit inserts off the request
+    path.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"detail": f'Method "{request.method}" not '
+                             'allowed.'},
+                            status=405)
+
+    params = request.GET
+    classifier = params.get("classifier")
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "Request body must be JSON"},
+                            status=400)
+
+    try:
+        executor = get_inference_executor()
+        if classifier in STAT_METHODS:
+            metrics.set_algorithm(classifier)
+            with metrics.stage('inference'):
+                prediction = await executor.run(stat_score, data, classifier)
+            algorithm_id = None
+
+        else:
+            if classifier is None:
+                return JsonResponse(
+                    {
+                        "error":
+                        "Missing required query parameter: classifier"
+                    },
+                    status=400)
+            key = (classifier, params.get("version", "0.0.1"),
+                   params.get("status", "production"),
+                   params.get("dataset", "german"))
+            with metrics.stage('lookup'):
+                resolved = registry.lookup_indexed(*key)
+                if resolved is None:
+                    resolved = await sync_to_async(registry.lookup)(*key)
+                if resolved is not None:
+                    metrics.set_algorithm(registry.label(resolved[0]))
+            if resolved is None:
+                return JsonResponse({"error": "ML algorithm is not available"},
+                                    status=400)
+
+            algorithm_id, classifier = resolved
+            prediction = await executor.run(cached_prediction, algorithm_id,
+                                            classifier, data,
+                                            registry.label(algorithm_id))
+
+        label = prediction.get("label", prediction.get("method"))
+        prediction_request = PredictionRequest(input=json.dumps(data),
+                                               response=prediction,
+                                               prediction=label,
+                                               feedback="",
+                                               algorithm_id=algorithm_id)
+        with metrics.stage('audit'):
+            request_id, = await sync_to_async(record_predictions)(
+                [prediction_request])
+
+        prediction["request_id"] = request_id
+        prediction["request_uuid"] = str(prediction_request.uuid)
+
+        return JsonResponse(prediction)
+    except Overloaded:
+        response = JsonResponse(
+            {"detail": "Too many scoring requests in progress"}, status=503)
+        response['Retry-After'] = '1'
+        return response
+    except Exception as e:
+        return JsonResponse({"detail": str(e)}, status=500)
 
-class PredictionRequestViewSet(viewsets.ModelViewSet):
+
+# the JSON API does not use session authentication, like the DRF views
+predict_async.csrf_exempt = True
+
+
+def scoring_metrics(request):
+    """
+    Scoring counters and latency histograms of this process in the
+    Prometheus text format
+    """
+    if not metrics.enabled():
+        raise Http404('Metrics are disabled')
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@PROJECTED
+class PredictionRequestViewSet(FieldsProjectionMixin, viewsets.ModelViewSet):
+    """
+    Audit trail of the predictions
+    """
     # permission_classes = []
     serializer_class = PredictionRequestSerializer
     queryset = PredictionRequest.objects.all()
+    pagination_class = CreatedCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = PredictionRequestFilter
+
+    @extend_schema(
+        description='Stream the prediction requests matching the list '
+        'filters, oldest first, as JSON Lines or CSV. The rows are read in '
+        'chunks and written as they are read, whatever the number of rows.',
+        parameters=[
+            OpenApiParameter(name='export_format',
+                             description='jsonl (default) or csv'),
+            OpenApiParameter(name='gzip',
+                             type=bool,
+                             description='gzip compress the export'),
+        ],
+        operation_id='requests_export',
+        responses={200: OpenApiTypes.BINARY})
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        export_format = request.query_params.get('export_format', JSONL)
+        if export_format not in FORMATS:
+            raise ValidationError({
+                "export_format":
+                f"Export format must be one of {', '.join(FORMATS)}"
+            })
+        compress = request.query_params.get('gzip', '').lower() in ('1',
+                                                                   'true')
+
+        queryset = self.filter_queryset(self.get_queryset())
+        filename = f'prediction_requests.{export_format}'
+        content_type = CONTENT_TYPES[export_format]
+        if compress:
+            filename += '.gz'
+            content_type = 'application/gzip'
+        response = StreamingHttpResponse(export_requests(
+            queryset, export_format, compress),
+                                         content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @extend_schema(
+        description='Record the actual outcome of scored loans in bulk. '
+        'request_id is the request_id or the request_uuid returned by predict. '
+        'The '
+        'performance of the algorithms is updated with the outcomes.',
+        operation_id='requests_feedback',
+        request=inline_serializer(name="FeedbackRequest",
+                                  fields={
+                                      "request_id": CharField(),
+                                      "actual_outcome": CharField()
+                                  },
+                                  many=True),
+        responses=inline_serializer(name="FeedbackResponse",
+                                    fields={
+                                        "updated": IntegerField(),
+                                        "missing": ListField()
+                                    }))
+    @action(detail=False, methods=['post'])
+    @metrics.tracked('feedback')
+    def feedback(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError(
+                {"error": "Request body must be a list of outcomes"})
+        max_items = feedback_options()['MAX_ITEMS']
+        if len(request.data) > max_items:
+            raise ValidationError(
+                {"error": f"At most {max_items} outcomes per request"})
 
+        pairs, errors = parse_feedback(request.data)
+        if errors:
+            raise ValidationError({"errors": errors})
+        return Response(record_feedback(pairs))
 
-class DatasetViewSet(viewsets.ReadOnlyModelViewSet):
+    def perform_create(self, serializer):
+        self._save_with_feedback(serializer)
+
+    def perform_update(self, serializer):
+        self._save_with_feedback(serializer)
+
+    def _save_with_feedback(self, serializer):
+        # feedback goes through record_feedback to keep the performance
+        # summaries in step
+        if 'feedback' not in serializer.validated_data:
+            serializer.save()
+            return
+        with transaction.atomic():
+            feedback = serializer.validated_data.pop('feedback')
+            serializer.save()
+            record_feedback([(serializer.instance.pk, feedback)])
+            serializer.instance.feedback = feedback
+
+    def get_object(self):
+        # requests can be addressed by the uuid returned from predict
+        lookup = self.kwargs.get(self.lookup_field)
+        if lookup is not None and not str(lookup).isdigit():
+            self.lookup_url_kwarg = self.lookup_field
+            self.lookup_field = 'uuid'
+        return super().get_object()
+
+
+@PROJECTED
+class DatasetViewSet(FieldsProjectionMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Datasets the algorithms are trained on
+    """
     # permission_classes = []
     serializer_class = DatasetSerializer
     queryset = Dataset.objects.all()
+    pagination_class = IdCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = DatasetFilter
+
+
+class ScoringJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                        mixins.ListModelMixin, mixins.DestroyModelMixin,
+                        viewsets.GenericViewSet):
+    """
+    Bulk scoring of uploaded CSV or JSONL portfolios
+
+    Created jobs are queued and run by ``manage.py run_scoring_jobs``.
+    """
+    # permission_classes = []
+    serializer_class = ScoringJobSerializer
+    queryset = ScoringJob.objects.all()
+
+    def _transition(self, source, **fields):
+        job = self.get_object()
+        updated = ScoringJob.objects.filter(pk=job.pk,
+                                            status__in=source).update(**fields)
+        if not updated:
+            raise ValidationError({"error": f"Job is {job.status}"})
+        job.refresh_from_db()
+        return Response(self.get_serializer(job).data)
+
+    @extend_schema(description='Cancel a queued or running job. A running '
+                   'job stops after its current chunk and can be resumed.',
+                   request=None)
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        return self._transition([ScoringJob.QUEUED, ScoringJob.RUNNING],
+                                status=ScoringJob.CANCELLED,
+                                finished_at=timezone.now())
+
+    @extend_schema(description='Queue a failed or cancelled job again. It '
+                   'continues from its last checkpoint.',
+                   request=None)
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        return self._transition([ScoringJob.FAILED, ScoringJob.CANCELLED],
+                                status=ScoringJob.QUEUED,
+                                error=None,
+                                finished_at=None)
+
+    @extend_schema(description='Download the scores of a completed job, one '
+                   'row per input row with its row number, probability, '
+                   'label or error.',
+                   responses={(200, 'application/octet-stream'): bytes})
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ScoringJob.COMPLETED:
+            raise NotFound({"error": f"Job is {job.status}"})
+        content_type = ('text/csv' if job.format == 'csv' else
+                        'application/x-ndjson')
+        return FileResponse(job.result_file.open('rb'),
+                            as_attachment=True,
+                            filename=f'scoring-job-{job.pk}.{job.format}',
+                            content_type=content_type)
+
+    def perform_destroy(self, instance):
+        if instance.status == ScoringJob.RUNNING:
+            raise ValidationError({"error": "Cancel the running job first"})
+        if instance.input_file and default_storage.exists(
+                instance.input_file.name):
+            default_storage.delete(instance.input_file.name)
+        remove_results(instance)
+        instance.delete()
@@ -19,5 +19,11 @@
 #
 
 python manage.py migrate
-python manage.py runserver 0:8000
+if [ "${SCORECARD_SERVER}" = "asgi" ]; then
+    # async predict view on api/v1/async/algorithms/predict
+    uvicorn server.asgi:application --host 0.0.0.0 --port 8000 \
+        --workers "${SCORECARD_WORKERS:-1}"
+else
+    python manage.py runserver 0:8000
+fi
 echo Running Django on the local host at http://localhost:8000
\ No newline at end of file
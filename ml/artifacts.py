@@ -0,0 +1,100 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Model artifacts
+
+Process wide store for the joblib artifacts shipped in the model zoo. Every
+artifact is deserialized at most once per process, the first time it is
+requested, and the same object is shared by all classifiers that use it.
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, List
+
+import joblib
+
+log = logging.getLogger(__name__)
+
+ZOO_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'zoo',
+    'models')
+
+_artifacts: Dict[str, Any] = {}
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def artifact_path(zone: str, name: str) -> str:
+    """
+    Return the absolute path of an artifact in the model zoo
+
+    Parameters
+    ----------
+    zone: str
+        zoo region, e.g. german
+    name: str
+        artifact file name, e.g. rf_classifier.joblib
+    """
+    return os.path.join(ZOO_DIR, zone, name)
+
+
+def load(path: str):
+    """
+    Return the deserialized artifact stored at path, loading it on first use
+
+    Concurrent callers asking for the same artifact wait for a single load,
+    while different artifacts can be loaded in parallel.
+
+    Parameters
+    ----------
+    path: str
+        path of the joblib file
+    """
+    path = os.path.abspath(path)
+    try:
+        return _artifacts[path]
+    except KeyError:
+        pass
+
+    with _locks_lock:
+        lock = _locks.setdefault(path, threading.Lock())
+
+    with lock:
+        if path not in _artifacts:
+            log.debug(f"Loading artifact {path}")
+            _artifacts[path] = joblib.load(path)
+
+    return _artifacts[path]
+
+
+def is_loaded(path: str) -> bool:
+    """
+    Return whether the artifact at path has already been deserialized
+    """
+    return os.path.abspath(path) in _artifacts
+
+
+def loaded() -> List[str]:
+    """
+    Return the paths of all artifacts loaded in this process
+    """
+    return list(_artifacts.keys())
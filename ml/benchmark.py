@@ -0,0 +1,177 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Benchmark helpers
+
+Timing and reporting helpers shared by the benchmark management commands.
+"""
+
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+def sample_applicant(classifier):
+    """
+    Build an all-zero applicant, falling back to the first known category of
+    label encoded features.
+
+    Parameters
+    ----------
+    classifier: Classifier
+        classifier with a feature schema
+    """
+    plan = classifier.encoding_plan(tuple(classifier.features))
+    return {
+        column: next(iter(lookup)) if lookup else 0
+        for column, lookup in zip(plan.columns, plan.lookups)
+    }
+
+
+def synthetic_rows(classifier, n_rows: int, ranges=None, seed: int = 0):
+    """
+    Draw random model inputs for a classifier
+
+    Label encoded columns get uniformly drawn valid codes. Numeric columns
+    are drawn uniformly around the given ranges, or from a standard normal
+    distribution where no range is known.
+
+    Parameters
+    ----------
+    classifier: Classifier
+        classifier with a feature schema
+    n_rows: int
+        number of rows to draw
+    ranges: numpy.ndarray
+        (low, high) of each column, of shape (n_features, 2). Rows holding
+        NaN are treated as unknown.
+    seed: int
+        seed of the random generator
+
+    Returns
+    -------
+    numpy.ndarray
+        encoded rows of shape (n_rows, n_features)
+    """
+    rng = np.random.default_rng(seed)
+    plan = classifier.encoding_plan(tuple(classifier.features))
+    rows = rng.standard_normal((n_rows, len(plan.columns)))
+    for position, lookup in enumerate(plan.lookups):
+        if lookup:
+            rows[:, position] = rng.integers(len(lookup), size=n_rows)
+        elif ranges is not None and not np.isnan(ranges[position]).any():
+            low, high = ranges[position]
+            margin = 0.1 * (high - low) or 1.0
+            rows[:, position] = rng.uniform(low - margin, high + margin,
+                                            n_rows)
+    return rows
+
+
+def latency_summary(timings) -> Dict[str, float]:
+    """
+    Return the p50, p95, p99 and mean of timings in seconds, in milliseconds
+    """
+    timings = np.asarray(timings)
+    result = {
+        f'p{percentile}_ms': float(np.percentile(timings, percentile) * 1e3)
+        for percentile in PERCENTILES
+    }
+    result['mean_ms'] = float(timings.mean() * 1e3)
+    return result
+
+
+def measure(func: Callable[[], Any],
+            repeat: int = 200,
+            warmup: int = 10,
+            rows: int = 1) -> Dict[str, float]:
+    """
+    Time repeated calls of a function
+
+    Parameters
+    ----------
+    func: callable
+        function called without arguments
+    repeat: int
+        number of timed calls
+    warmup: int
+        number of untimed calls made first, so lazy loading and caches do
+        not end up in the percentiles
+    rows: int
+        number of rows scored by one call, used for the throughput
+
+    Returns
+    -------
+    dict
+        p50, p95, p99 and mean latency in milliseconds, and the throughput
+        in rows per second
+    """
+    for _ in range(warmup):
+        func()
+
+    timings = np.empty(repeat)
+    for index in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings[index] = time.perf_counter() - start
+
+    result = latency_summary(timings)
+    result['throughput'] = float(rows * repeat / timings.sum())
+    result['repeat'] = repeat
+    result['rows'] = rows
+    return result
+
+
+def result_key(result: Dict[str, Any]):
+    return (result['classifier'], result['dataset'], result['stage'])
+
+
+def compare(previous: List[Dict[str, Any]], current: List[Dict[str, Any]]):
+    """
+    Pair the results of two benchmark runs
+
+    Parameters
+    ----------
+    previous: list
+        results of the baseline run
+    current: list
+        results of the new run
+
+    Returns
+    -------
+    list
+        (classifier, dataset, stage, previous p50, current p50, ratio) for
+        every stage measured in both runs
+    """
+    baseline = {
+        result_key(result): result
+        for result in previous if 'p50_ms' in result
+    }
+    rows = []
+    for result in current:
+        old = baseline.get(result_key(result))
+        if old is None or 'p50_ms' not in result:
+            continue
+        rows.append(result_key(result) +
+                    (old['p50_ms'], result['p50_ms'],
+                     result['p50_ms'] / old['p50_ms']))
+    return rows
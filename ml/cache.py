@@ -0,0 +1,331 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Prediction cache
+
+Caches ``compute_prediction`` results per algorithm and normalized input, so
+that retried or re-opened applications are not scored again. Entries of an
+algorithm are invalidated by bumping its generation, which is part of every
+key, whenever the algorithm is registered again with another model. Hits
+and misses are also counted in the ``/metrics`` output.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from ml import metrics
+
+LOCAL = 'local'
+DJANGO = 'django'
+
+
+def input_digest(data: Dict[str, Any], features=None) -> str:
+    """
+    Return a canonical hash of an applicant
+
+    Only the model features are hashed when they are known, in feature
+    order, and numbers are compared by value, so ``22`` and ``22.0`` or
+    extra fields the model ignores do not produce different keys. Without a
+    feature schema the key order is kept, since it decides the column order
+    of the model input.
+
+    Parameters
+    ----------
+    data: dict
+        applicant data
+    features: list
+        column order of the model, if known
+    """
+    if features is not None:
+        items = [(column, data.get(column)) for column in features]
+    else:
+        items = list(data.items())
+
+    normalized = [(str(key), float(value) if isinstance(value, (int, float))
+                   and not isinstance(value, bool) else value)
+                  for key, value in items]
+    encoded = json.dumps(normalized, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class PredictionCache(object):
+    """
+    Base prediction cache keeping hit and miss counters
+
+    Warning: This class should not be used directly. Use derived classes
+    instead.
+
+    Parameters
+    ----------
+    ttl: float
+        seconds an entry stays valid
+    prefix: str
+        prefix of every cache key
+    """
+    def __init__(self, ttl: float = 300, prefix: str = 'scorecard'):
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def generation(self, algorithm_id: int) -> int:
+        raise NotImplementedError
+
+    def invalidate(self, algorithm_id: int):
+        """
+        Drop every cached prediction of an algorithm
+        """
+        raise NotImplementedError
+
+    def _get(self, key: str):
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Dict[str, Any]):
+        raise NotImplementedError
+
+    def key(self, algorithm_id: int, classifier, data: Dict[str, Any]):
+        return (f'{self.prefix}:prediction:{algorithm_id}:'
+                f'{self.generation(algorithm_id)}:'
+                f'{input_digest(data, classifier.features)}')
+
+    def get_or_compute(self,
+                       algorithm_id: int,
+                       classifier,
+                       data: Dict[str, Any],
+                       label: str = None) -> Dict[str, Any]:
+        """
+        Return the cached prediction of an applicant, scoring it on a miss
+
+        Errors are not cached. A new dictionary is returned on every call,
+        so callers may add fields to it.
+
+        Parameters
+        ----------
+        algorithm_id: int
+            primary key of the algorithm
+        classifier: Classifier
+            the classifier registered for the algorithm
+        data: dict
+            applicant data
+        label: str
+            metrics label of the algorithm
+        """
+        key = self.key(algorithm_id, classifier, data)
+        prediction = self._get(key)
+        if prediction is not None:
+            self._count(hit=True)
+            return dict(prediction)
+
+        self._count(hit=False)
+        prediction = classifier.compute_prediction(data, label)
+        self._set(key, dict(prediction))
+        return prediction
+
+    def _count(self, hit: bool):
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if metrics.enabled():
+            metrics.PREDICTION_CACHE.inc('hit' if hit else 'miss')
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the hit and miss counters of this process
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+class LocalPredictionCache(PredictionCache):
+    """
+    Bounded in-process LRU cache with a time to live
+
+    Parameters
+    ----------
+    max_size: int
+        maximum number of cached predictions, the least recently used are
+        evicted first
+    ttl: float
+        seconds an entry stays valid
+    """
+    def __init__(self, max_size: int = 10000, ttl: float = 300, **kwargs):
+        super().__init__(ttl=ttl, **kwargs)
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def generation(self, algorithm_id: int) -> int:
+        return self._generations.get(algorithm_id, 0)
+
+    def invalidate(self, algorithm_id: int):
+        with self._lock:
+            self._generations[algorithm_id] = \
+                self._generations.get(algorithm_id, 0) + 1
+            marker = f'{self.prefix}:prediction:{algorithm_id}:'
+            for key in [k for k in self._entries if k.startswith(marker)]:
+                del self._entries[key]
+
+    def _get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, prediction = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return prediction
+
+    def _set(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats['size'] = len(self._entries)
+        return stats
+
+
+class DjangoPredictionCache(PredictionCache):
+    """
+    Prediction cache stored in a Django cache
+
+    With a backend shared by the workers of a host, such as FileBasedCache,
+    a prediction computed by one worker is served by all of them. The
+    algorithm generations are stored in the same cache so invalidations are
+    seen by every worker too; this costs one extra cache read per lookup.
+
+    Parameters
+    ----------
+    alias: str
+        name of the cache in the CACHES setting
+    ttl: float
+        seconds an entry stays valid
+    """
+    def __init__(self, alias: str = 'default', ttl: float = 300, **kwargs):
+        super().__init__(ttl=ttl, **kwargs)
+        self.cache = caches[alias]
+
+    def _generation_key(self, algorithm_id: int) -> str:
+        return f'{self.prefix}:generation:{algorithm_id}'
+
+    def generation(self, algorithm_id: int) -> int:
+        return self.cache.get(self._generation_key(algorithm_id), 0)
+
+    def invalidate(self, algorithm_id: int):
+        key = self._generation_key(algorithm_id)
+        # add is atomic, so only one worker initializes the counter
+        self.cache.add(key, 0, timeout=None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # evicted between add and incr
+            self.cache.set(key, 1, timeout=None)
+
+    def _get(self, key: str):
+        return self.cache.get(key)
+
+    def _set(self, key: str, value: Dict[str, Any]):
+        self.cache.set(key, value, timeout=self.ttl)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache() -> PredictionCache:
+    """
+    Return the process wide prediction cache configured by
+    SCORECARD_PREDICTION_CACHE, or None when caching is disabled
+    """
+    global _cache
+    options = getattr(settings, 'SCORECARD_PREDICTION_CACHE', {})
+    if not options.get('ENABLED', False):
+        return None
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                backend = options.get('BACKEND', LOCAL)
+                if backend == LOCAL:
+                    _cache = LocalPredictionCache(
+                        max_size=options.get('MAX_SIZE', 10000),
+                        ttl=options.get('TTL', 300))
+                elif backend == DJANGO:
+                    _cache = DjangoPredictionCache(
+                        alias=options.get('CACHE_ALIAS', 'default'),
+                        ttl=options.get('TTL', 300))
+                else:
+                    raise ValueError(
+                        f'Unknown prediction cache backend {backend}')
+    return _cache
+
+
+def cached_prediction(algorithm_id: int,
+                      classifier,
+                      data: Dict[str, Any],
+                      label: str = None) -> Dict[str, Any]:
+    """
+    Score an applicant through the prediction cache, if enabled
+
+    Parameters
+    ----------
+    algorithm_id: int
+        primary key of the algorithm
+    classifier: Classifier
+        the classifier registered for the algorithm
+    data: dict
+        applicant data
+    label: str
+        metrics label of the algorithm, the one of the tracked request when
+        None
+    """
+    cache = get_prediction_cache()
+    if cache is None:
+        return classifier.compute_prediction(data, label)
+    return cache.get_or_compute(algorithm_id, classifier, data, label)
+
+
+def invalidate(algorithm_id: int):
+    """
+    Drop the cached predictions of an algorithm, if caching is enabled
+    """
+    cache = get_prediction_cache()
+    if cache is not None:
+        cache.invalidate(algorithm_id)
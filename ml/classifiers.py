@@ -24,15 +24,122 @@ The module contains model definitions of various tested models for credit
 assessment
 """
 
+from collections import OrderedDict
 from typing import Any, Dict, List
-import joblib
 import logging
+import os
+import threading
+import numpy as np
 import pandas as pd
+from django.conf import settings
 from django.core.exceptions import BadRequest
 from sklearn.preprocessing import LabelEncoder
 
+from ml import artifacts, backends, metrics
+
 log = logging.getLogger(__name__)
 
+# Number of rows handed to ``predict_proba`` at once when scoring a batch
+BATCH_CHUNK_SIZE = 1024
+
+# Encoding plans kept per classifier. Classifiers without a feature list get
+# one plan per column order sent by clients, the least recently used are
+# dropped.
+MAX_ENCODING_PLANS = 32
+
+
+def _encoder_key(column, categorical):
+    """
+    Return the key of column in categorical, or None if it is not encoded.
+
+    Zoo regions without named columns (australian, japanese) store their
+    encoders under integer positions while JSON payloads use string keys.
+    """
+    if column in categorical:
+        return column
+    if isinstance(column, str) and column.isdigit() and int(
+            column) in categorical:
+        return int(column)
+    return None
+
+
+class EncodingPlan(object):
+    """
+    Precompiled single-row encoder
+
+    Maps an applicant dictionary straight into a preallocated NumPy row,
+    using a fixed column order and plain dict lookups from category to
+    label code instead of building a DataFrame and calling
+    ``LabelEncoder.transform`` per column.
+
+    Parameters
+    ----------
+    columns: list
+        column order expected by the model
+    categorical: list
+        names of the label encoded columns
+    label_encoders: dict
+        fitted label encoders keyed by column name
+    """
+    def __init__(self, columns, categorical, label_encoders):
+        self.columns = list(columns)
+        self.lookups = []
+        for column in self.columns:
+            key = _encoder_key(column, categorical)
+            if key is not None:
+                classes = label_encoders[key].classes_
+                self.lookups.append(
+                    {value: code
+                     for code, value in enumerate(classes)})
+            else:
+                self.lookups.append(None)
+
+        # one row buffer per thread, predict_proba does not keep a reference
+        self._local = threading.local()
+
+    def encode(self, data: Dict[str, Any]):
+        """
+        Encode an applicant into the model input row
+
+        Parameters
+        ----------
+        data: dict
+            dictionary of data to predict
+
+        Returns
+        -------
+        numpy.ndarray
+            array of shape (1, n_columns), reused between calls on the
+            same thread
+        """
+        row = getattr(self._local, 'row', None)
+        if row is None:
+            row = self._local.row = np.empty((1, len(self.columns)))
+
+        for position, (column, lookup) in enumerate(
+                zip(self.columns, self.lookups)):
+            try:
+                value = data[column]
+            except KeyError:
+                raise ValueError(f'missing field: {column}')
+            if value is None:
+                raise ValueError(f'{column} cannot be null')
+
+            if lookup is None:
+                row[0, position] = value
+            else:
+                try:
+                    row[0, position] = lookup[value]
+                except (KeyError, TypeError):
+                    # encoders fitted on raw text files expect strings
+                    code = lookup.get(str(value))
+                    if code is None:
+                        raise ValueError(
+                            f'unknown value for {column}: {value}')
+                    row[0, position] = code
+
+        return row
+
 
 class Classifier(object):
     """
@@ -40,15 +147,147 @@ class Classifier(object):
 
     Warning: This class should not be used directly. Use derived classes
     instead.
+
+    Artifacts that are not passed in explicitly are loaded lazily from
+    ``zoo/models/<zone>`` on first use and shared with every other
+    classifier of the same zone.
+
+    Parameters
+    ----------
+    model: object
+        fitted estimator exposing predict_proba
+    categorical: list
+        names of the label encoded columns
+    label_encoders: dict
+        fitted label encoders keyed by column name
+    zone: str
+        zoo region the default artifacts are loaded from
+    features: list
+        column order the model was trained with. When omitted the column
+        order of each applicant dictionary is used as is.
+    artifact_paths: dict
+        artifact file paths relative to ``zoo/models``, keyed by model,
+        categorical and label_encoders, overriding the zone defaults
+    backend: str
+        inference backend ``predict`` runs on, see ``ml.backends``
     """
+
+    # file name of the fitted model in the zoo, set by derived classes
+    artifact: str = None
+
     def __init__(self,
                  model=None,
-                 categorical=[],
-                 label_encoders: List[LabelEncoder] = {}):
+                 categorical: List[str] = None,
+                 label_encoders: Dict[str, LabelEncoder] = None,
+                 zone: str = 'german',
+                 features: List[str] = None,
+                 artifact_paths: Dict[str, str] = None,
+                 backend: str = 'sklearn'):
+
+        self.zone = zone
+        self.features = features
+        self.artifact_paths = artifact_paths or {}
+        self.backend = backend
+        self._model = model
+        self._model_given = model is not None
+        self._engine = None
+        self._categorical = categorical
+        self._label_encoders = label_encoders
+        self._encoding_plans: Dict[tuple, EncodingPlan] = OrderedDict()
+        self._plans_lock = threading.Lock()
+
+    def _artifact(self, kind, name):
+        if kind in self.artifact_paths:
+            path = os.path.join(artifacts.ZOO_DIR, self.artifact_paths[kind])
+        else:
+            path = artifacts.artifact_path(self.zone, name)
+        return artifacts.load(path)
+
+    @property
+    def model(self):
+        if self._model is None and (self.artifact is not None
+                                    or 'model' in self.artifact_paths):
+            self._model = self._artifact('model', self.artifact)
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+        self._model_given = True
+        self._engine = None
+
+    @property
+    def reloadable(self) -> bool:
+        """
+        Whether the model is read from the zoo, so that another process can
+        load the same one from the artifact paths
+        """
+        return not self._model_given and (self.artifact is not None
+                                          or 'model' in self.artifact_paths)
 
-        self.model = model
-        self.categorical = categorical
-        self.label_encoders = label_encoders
+    @property
+    def engine(self):
+        """
+        Object whose predict_proba ``predict`` calls, built from the model
+        for the configured backend on first use, or handing the rows to the
+        inference process pool when SCORECARD_INFERENCE_EXECUTOR is enabled
+        """
+        if self._engine is None:
+            options = getattr(settings, 'SCORECARD_INFERENCE_EXECUTOR', {})
+            executor = None
+            if options.get('ENABLED', False) and self.reloadable:
+                # the pool needs multiprocessing.shared_memory (Python 3.8),
+                # only import it when it is used
+                from ml import executors
+                executor = executors.get_process_executor()
+            if executor is not None:
+                self._engine = executors.ProcessEngine(executor, self)
+            else:
+                self._engine = backends.compile_model(
+                    self.model, self.backend)
+        return self._engine
+
+    @property
+    def categorical(self) -> List[str]:
+        if self._categorical is None:
+            self._categorical = self._artifact('categorical',
+                                               'categorical.joblib')
+        return self._categorical
+
+    @categorical.setter
+    def categorical(self, categorical):
+        self._categorical = categorical
+        self._encoding_plans = OrderedDict()
+
+    @property
+    def label_encoders(self) -> Dict[str, LabelEncoder]:
+        if self._label_encoders is None:
+            self._label_encoders = self._artifact(
+                'label_encoders', 'label_encoders.joblib')
+        return self._label_encoders
+
+    @label_encoders.setter
+    def label_encoders(self, label_encoders):
+        self._label_encoders = label_encoders
+        self._encoding_plans = OrderedDict()
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Whether the model artifacts have been deserialized
+        """
+        return (self._model is not None and self._categorical is not None
+                and self._label_encoders is not None)
+
+    def load(self):
+        """
+        Deserialize the model artifacts now instead of on first prediction
+        """
+        # reading the properties pulls the artifacts from the shared store
+        self.engine
+        self.categorical
+        self.label_encoders
+        return self
 
     # def __str__(self):
     #     return f"""
@@ -109,6 +348,110 @@ class Classifier(object):
 
         return data
 
+    @property
+    def n_features(self):
+        """
+        Number of columns the model was fitted on, None when the estimator
+        does not record it
+        """
+        return getattr(backends.estimator(self.model), 'n_features_in_', None)
+
+    def record_columns(self, data: Dict[str, Any]) -> tuple:
+        """
+        Return the column order an applicant is encoded in: the features
+        of the classifier, or the keys of the applicant when it has none
+        """
+        if self.features is not None:
+            return tuple(self.features)
+        return tuple(data.keys())
+
+    def schema_errors(self, data: Dict[str, Any]) -> List[str]:
+        """
+        Validate an applicant against the schema of the classifier
+
+        Without a feature list every label encoded column is required, and
+        the applicant must have as many fields as the model has columns.
+
+        Parameters
+        ----------
+        data: dict
+            dictionary of data to predict
+
+        Returns
+        -------
+        list
+            error messages, empty when the applicant is valid
+        """
+        if self.features is not None:
+            missing = [
+                column for column in self.features if column not in data
+            ]
+        else:
+            categorical = [x for x in self.categorical if x != 'risk']
+            present = {_encoder_key(key, categorical) for key in data}
+            missing = [
+                str(column) for column in categorical if column not in present
+            ]
+        empty = [
+            str(column) for column in self.record_columns(data)
+            if column in data and data[column] is None
+        ]
+
+        errors = []
+        if missing:
+            errors.append(f"missing fields: {', '.join(missing)}")
+        if self.features is None and not missing:
+            n_features = self.n_features
+            if n_features is not None and len(data) != n_features:
+                errors.append(
+                    f"expected {n_features} fields, got {len(data)}")
+        if empty:
+            errors.append(f"null fields: {', '.join(empty)}")
+        return errors
+
+    def encoding_plan(self, columns):
+        """
+        Return the encoding plan for the given column order, compiling it on
+        first use. The MAX_ENCODING_PLANS most recently used plans are kept.
+
+        Parameters
+        ----------
+        columns: tuple
+            column names in the order the model expects them
+        """
+        plans = self._encoding_plans
+        with self._plans_lock:
+            plan = plans.get(columns)
+            if plan is not None:
+                plans.move_to_end(columns)
+                return plan
+
+        categorical = self.categorical
+        if self.features is None:
+            categorical = [x for x in categorical if x != 'risk']
+        plan = EncodingPlan(columns, categorical, self.label_encoders)
+        with self._plans_lock:
+            plans[columns] = plan
+            while len(plans) > MAX_ENCODING_PLANS:
+                plans.popitem(last=False)
+        return plan
+
+    def encode(self, data: Dict[str, Any]):
+        """
+        Pandas-free equivalent of ``preprocessing`` for a single applicant
+
+        Parameters
+        ----------
+        data: dict
+            dictionary of data to predict
+        """
+        if self.features is None:
+            # the keys are the column order, only build plans for valid ones
+            errors = self.schema_errors(data)
+            if errors:
+                raise ValueError('; '.join(errors))
+        return self.encoding_plan(self.record_columns(data)).encode(data)
+
     def predict(self, data):
         """
         Predict scorecard model
@@ -117,7 +460,7 @@ class Classifier(object):
             data: array
                 Data to perform prediction on.
         """
-        return self.model.predict_proba(data)
+        return self.engine.predict_proba(data)
 
     def postprocessing(self, prediction):
         label = "bad"
@@ -125,51 +468,153 @@ class Classifier(object):
             label = "good"
         return {"probability": prediction[1], "label": label}
 
-    def compute_prediction(self, data: Dict[str, Any]):
+    def compute_prediction(self, data: Dict[str, Any], label: str = None):
         try:
-            input_data = self.preprocessing(data)
-            prediction = self.predict(input_data)[0]
-            prediction = self.postprocessing(prediction)
+            with metrics.stage('preprocessing', label):
+                input_data = self.encode(data)
+            with metrics.stage('inference', label):
+                prediction = self.predict(input_data)[0]
+            with metrics.stage('postprocessing', label):
+                prediction = self.postprocessing(prediction)
         except Exception as e:
             log.debug(f'An error occured: {str(e)}')
             raise BadRequest(str(e))
 
         return prediction
 
+    def compute_batch(self,
+                      records: List[Dict[str, Any]],
+                      chunk_size: int = BATCH_CHUNK_SIZE,
+                      label: str = None):
+        """
+        Score a batch of applicants in one pass
+
+        All valid records are assembled into a single frame, each categorical
+        column is encoded once and ``predict_proba`` is called once per chunk
+        of ``chunk_size`` rows. Records that fail validation do not fail the
+        batch; an ``{"error": ...}`` entry is returned in their place.
+
+        Parameters
+        ----------
+        records: list
+            list of applicant dictionaries, as accepted by compute_prediction
+        chunk_size: int
+            maximum number of rows passed to the model at once
+        label: str
+            metrics label of the stages, the one of the tracked request when
+            None
+
+        Returns
+        -------
+        list
+            one prediction or error dictionary per record, in input order
+        """
+
+        results: List[Dict[str, Any]] = [None] * len(records)
+        with metrics.stage('preprocessing', label):
+            groups = self._encode_batch(records, results)
+
+        for data, valid in groups:
+            for start in range(0, len(valid), chunk_size):
+                chunk = data.iloc[start:start + chunk_size]
+                try:
+                    with metrics.stage('inference', label):
+                        probabilities = self.predict(chunk)
+                except Exception as e:
+                    log.debug(f'An error occured: {str(e)}')
+                    for i in valid[start:start + chunk_size]:
+                        results[i] = {"error": str(e)}
+                    continue
+                with metrics.stage('postprocessing', label):
+                    for i, prediction in zip(valid[start:start + chunk_size],
+                                             probabilities):
+                        results[i] = self.postprocessing(prediction)
+
+        return results
+
+    def _encode_batch(self, records: List[Dict[str, Any]],
+                      results: List[Dict[str, Any]]):
+        """
+        Validate and encode the records of a batch
+
+        Every record is validated against the schema of the classifier on
+        its own. Sets the error entry in ``results`` of every rejected
+        record and returns the encoded frame of the others with their
+        indices, one frame per column order.
+        """
+        groups: Dict[tuple, List[int]] = {}
+        for index, record in enumerate(records):
+            if not isinstance(record, dict):
+                results[index] = {"error": "Record must be a JSON object"}
+                continue
+            errors = self.schema_errors(record)
+            if errors:
+                results[index] = {"error": "; ".join(errors)}
+                continue
+            # without a feature list records are encoded in their own key
+            # order, as compute_prediction does
+            groups.setdefault(self.record_columns(record), []).append(index)
+
+        encoded = []
+        for columns, valid in groups.items():
+            data, valid = self._encode_frame(records, columns, valid, results)
+            if valid:
+                encoded.append((data, valid))
+        return encoded
+
+    def _encode_frame(self, records: List[Dict[str, Any]], columns: tuple,
+                      valid: List[int], results: List[Dict[str, Any]]):
+        """
+        Encode validated records sharing one column order into a frame
+        """
+        data = pd.DataFrame.from_records([records[i] for i in valid],
+                                         columns=list(columns))
+        keep = np.ones(len(valid), dtype=bool)
+
+        # encode every categorical column once with the plan lookups, and
+        # convert the others to numbers
+        plan = self.encoding_plan(columns)
+        for column, lookup in zip(plan.columns, plan.lookups):
+            if lookup is None:
+                values = pd.to_numeric(data[column], errors='coerce')
+                invalid = (values.isna() & data[column].notna()).values
+                for position in np.flatnonzero(invalid & keep):
+                    value = data[column].iat[position]
+                    results[valid[position]] = {
+                        "error": f"{column} must be a number: {value}"
+                    }
+                keep &= ~invalid
+                data[column] = values
+                continue
+            codes = data[column].map(lookup)
+            unknown = codes.isna().values
+            if unknown.any():
+                codes[unknown] = data[column][unknown].astype(str).map(lookup)
+                unknown = codes.isna().values
+            for position in np.flatnonzero(unknown & keep):
+                value = data[column].iat[position]
+                results[valid[position]] = {
+                    "error": f"unknown value for {column}: {value}"
+                }
+            keep &= ~unknown
+            data[column] = codes
+
+        data = data[keep]
+        valid = [i for i, kept in zip(valid, keep) if kept]
+        return data, valid
+
 
 class RandomForestClassifier(Classifier):
-    def __init__(
-        self,
-        model=joblib.load('zoo/models/german/rf_classifier.joblib'),
-        categorical=joblib.load('zoo/models/german/categorical.joblib'),
-        label_encoders=joblib.load('zoo/models/german/label_encoders.joblib')):
-        super(RandomForestClassifier, self).__init__(model, categorical,
-                                                     label_encoders)
+    artifact = 'rf_classifier.joblib'
 
 
 class SVC(Classifier):
-    def __init__(
-        self,
-        model=joblib.load('zoo/models/german/svc_classifier.joblib'),
-        categorical=joblib.load('zoo/models/german/categorical.joblib'),
-        label_encoders=joblib.load('zoo/models/german/label_encoders.joblib')):
-        super(SVC, self).__init__(model, categorical, label_encoders)
+    artifact = 'svc_classifier.joblib'
 
 
 class MLP(Classifier):
-    def __init__(
-        self,
-        model=joblib.load('zoo/models/german/mlp_classifier.joblib'),
-        categorical=joblib.load('zoo/models/german/categorical.joblib'),
-        label_encoders=joblib.load('zoo/models/german/label_encoders.joblib')):
-        super(MLP, self).__init__(model, categorical, label_encoders)
+    artifact = 'mlp_classifier.joblib'
 
 
 class GradientBoostClassifier(Classifier):
-    def __init__(
-        self,
-        model=joblib.load('zoo/models/german/gb_classifier.joblib'),
-        categorical=joblib.load('zoo/models/german/categorical.joblib'),
-        label_encoders=joblib.load('zoo/models/german/label_encoders.joblib')):
-        super(GradientBoostClassifier, self).__init__(model, categorical,
-                                                      label_encoders)
+    artifact = 'gb_classifier.joblib'
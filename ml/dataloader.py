@@ -0,0 +1,531 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Streaming dataset access
+
+Raw datasets (CSV, ARFF and the whitespace or comma separated ``.dat`` and
+``.data`` files of the UCI credit datasets) are parsed in chunks and written
+once to a columnar cache: one ``.npy`` file per column, numeric columns in
+their own dtype and text columns as integer category codes. Later reads
+memory-map the cached columns, so opening a dataset neither re-parses the
+source files nor loads columns that are not used. When the cache directory
+cannot be written the dataset is read without cache.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from pandas.api.types import is_categorical_dtype
+
+log = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'scorecard', 'datasets')
+
+# bump when the layout of the cached columns changes
+CACHE_FORMAT = 1
+
+CHUNK_SIZE = 50000
+
+FORMATS = {
+    '.arff': 'arff',
+    '.csv': 'csv',
+    '.dat': 'dat',
+    '.data': 'data',
+}
+
+# read_csv options of the formats, callers can override them
+FORMAT_OPTIONS = {
+    'csv': {},
+    # australian.dat: space separated, no header
+    'dat': {
+        'sep': r'\s+',
+        'header': None
+    },
+    # japanese.data: comma separated, no header, ? for missing values
+    'data': {
+        'header': None,
+        'na_values': '?'
+    },
+}
+
+ARFF_ATTRIBUTE = re.compile(r"@attribute\s+('[^']*'|\"[^\"]*\"|\S+)\s+(.+)",
+                            re.IGNORECASE)
+
+
+def cache_options() -> dict:
+    """
+    Return the dataset cache settings with their defaults
+    """
+    options = getattr(settings, 'SCORECARD_DATASET_CACHE', {})
+    return {
+        'ENABLED': options.get('ENABLED', True),
+        'DIRECTORY': options.get('DIRECTORY', CACHE_DIR),
+        'CHUNK_SIZE': options.get('CHUNK_SIZE', CHUNK_SIZE),
+    }
+
+
+def source_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f'Unknown dataset format of {path}')
+    return FORMATS[extension]
+
+
+def _unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in '\'"':
+        return value[1:-1]
+    return value
+
+
+def read_arff_header(handle) -> List[dict]:
+    """
+    Read the header of an ARFF file up to its @data line
+
+    Parameters
+    ----------
+    handle: file
+        text file positioned at the start of the file, left positioned at
+        the first data line
+
+    Returns
+    -------
+    list
+        one dict per attribute with its name and, for nominal attributes,
+        its categories
+    """
+    attributes = []
+    for line in iter(handle.readline, ''):
+        line = line.strip()
+        if not line or line.startswith('%'):
+            continue
+        keyword = line.split(None, 1)[0].lower()
+        if keyword == '@data':
+            return attributes
+        if keyword == '@attribute':
+            match = ARFF_ATTRIBUTE.match(line)
+            if match is None:
+                raise ValueError(f'Invalid ARFF attribute: {line}')
+            name, kind = _unquote(match.group(1)), match.group(2).strip()
+            attribute = {'name': name, 'categories': None, 'numeric': False}
+            if kind.startswith('{'):
+                attribute['categories'] = [
+                    _unquote(value) for value in kind.strip('{}').split(',')
+                ]
+            else:
+                attribute['numeric'] = kind.lower() in ('numeric', 'real',
+                                                        'integer')
+            attributes.append(attribute)
+    raise ValueError('ARFF file without @data section')
+
+
+def _read_arff(path: str, chunksize: int,
+               options: dict) -> Iterator[pd.DataFrame]:
+    with open(path) as handle:
+        attributes = read_arff_header(handle)
+        dtype = {
+            attribute['name']: 'float64' if attribute['numeric'] else str
+            for attribute in attributes
+        }
+        categories = {
+            attribute['name']: attribute['categories']
+            for attribute in attributes if attribute['categories']
+        }
+        reader_options = dict(header=None,
+                              names=list(dtype),
+                              dtype=dtype,
+                              na_values='?',
+                              comment='%',
+                              quotechar="'",
+                              skipinitialspace=True)
+        reader_options.update(options)
+        for chunk in pd.read_csv(handle, chunksize=chunksize,
+                                 **reader_options):
+            for name, values in categories.items():
+                chunk[name] = pd.Categorical(chunk[name], categories=values)
+            yield chunk
+
+
+def read_chunks(path: str,
+                format: Optional[str] = None,
+                chunksize: Optional[int] = None,
+                **options) -> Iterator[pd.DataFrame]:
+    """
+    Parse a raw dataset in chunks of rows
+
+    Parameters
+    ----------
+    path: str
+        CSV, ARFF, .dat or .data file
+    format: str
+        format of the file, by default from its extension
+    chunksize: int
+        rows per chunk, CHUNK_SIZE by default
+    options:
+        extra read_csv options, e.g. index_col or dtype
+
+    Yields
+    ------
+    DataFrame
+        chunks of the dataset with string column names. ARFF nominal
+        attributes are categorical.
+    """
+    format = format or source_format(path)
+    chunksize = chunksize or CHUNK_SIZE
+    if format == 'arff':
+        chunks = _read_arff(path, chunksize, options)
+    else:
+        reader_options = dict(FORMAT_OPTIONS[format])
+        reader_options.update(options)
+        chunks = pd.read_csv(path, chunksize=chunksize, **reader_options)
+
+    for chunk in chunks:
+        yield chunk.rename(columns=str)
+
+
+class ColumnWriter(object):
+    """
+    Append the chunks of one column to a raw file
+
+    Numeric chunks are written in their own dtype and converted to the
+    common dtype of all chunks when the column is finished, so that an
+    integer column that turns out to have missing values becomes float.
+    Text and categorical chunks are written as int32 codes of the
+    categories seen so far, -1 for missing values.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.segments = []
+        self.length = 0
+        self.categories = None
+        self.valid = 0
+
+    @property
+    def categorical(self) -> bool:
+        return self.categories is not None
+
+    def _restart(self, categorical: bool):
+        # a column without any value so far may still change its kind
+        self.file.seek(0)
+        self.file.truncate()
+        if categorical:
+            self.categories = {}
+            filler = np.full(self.length, -1, dtype=np.int32)
+        else:
+            self.categories = None
+            filler = np.full(self.length, np.nan)
+        self.segments = [(filler.dtype, self.length)] if self.length else []
+        self.file.write(filler.tobytes())
+
+    def write(self, values: pd.Series):
+        categorical = (values.dtype == object
+                       or is_categorical_dtype(values.dtype))
+        if self.length and categorical != self.categorical:
+            if self.valid:
+                kind = 'text' if categorical else 'numeric'
+                raise ValueError(f'Column {values.name} changed to {kind}, '
+                                 f'pass its dtype explicitly')
+            self._restart(categorical)
+        elif not self.length and categorical:
+            self.categories = {}
+
+        if categorical:
+            if is_categorical_dtype(values.dtype):
+                seen = values.cat.categories
+            else:
+                seen = pd.unique(values.dropna())
+            for value in seen:
+                self.categories.setdefault(value, len(self.categories))
+            array = pd.Categorical(values,
+                                   categories=list(self.categories)).codes
+            array = array.astype(np.int32)
+        else:
+            array = values.to_numpy()
+
+        self.valid += int(values.notna().sum())
+        self.length += len(array)
+        self.segments.append((array.dtype, len(array)))
+        self.file.write(np.ascontiguousarray(array).tobytes())
+
+    def finish(self, path: str) -> dict:
+        """
+        Write the column to an .npy file and return its metadata
+        """
+        self.file.close()
+        if self.categorical:
+            dtype = np.dtype(np.int32)
+        elif self.segments:
+            dtype = np.result_type(*[dtype for dtype, _ in self.segments])
+        else:
+            dtype = np.dtype(np.float64)
+
+        if self.length:
+            column = np.lib.format.open_memmap(path,
+                                               mode='w+',
+                                               dtype=dtype,
+                                               shape=(self.length, ))
+            offset = 0
+            with open(self.path, 'rb') as raw:
+                for segment_dtype, count in self.segments:
+                    column[offset:offset + count] = np.fromfile(
+                        raw, dtype=segment_dtype, count=count)
+                    offset += count
+            column.flush()
+            del column
+        else:
+            np.save(path, np.empty(0, dtype=dtype))
+        os.remove(self.path)
+
+        return {
+            'dtype': dtype.str,
+            'categories': _json_values(self.categories)
+            if self.categorical else None,
+        }
+
+
+def _json_values(categories: Dict) -> list:
+    return [
+        value.item() if isinstance(value, np.generic) else value
+        for value in categories
+    ]
+
+
+def write_columns(chunks: Iterator[pd.DataFrame], directory: str) -> dict:
+    """
+    Write chunks of rows to a columnar dataset directory
+
+    Returns
+    -------
+    dict
+        the metadata of the dataset, also written to meta.json
+    """
+    writers = None
+    names = None
+    for chunk in chunks:
+        if writers is None:
+            names = list(chunk.columns)
+            writers = [
+                ColumnWriter(os.path.join(directory, f'{index}.raw'))
+                for index in range(len(names))
+            ]
+        elif list(chunk.columns) != names:
+            raise ValueError('Dataset chunks have different columns')
+        for writer, name in zip(writers, names):
+            writer.write(chunk[name])
+
+    columns = []
+    for index, (writer, name) in enumerate(zip(writers or [], names or [])):
+        column = writer.finish(os.path.join(directory, f'{index}.npy'))
+        column.update(name=name, file=f'{index}.npy')
+        columns.append(column)
+
+    meta = {
+        'format': CACHE_FORMAT,
+        'length': writers[0].length if writers else 0,
+        'columns': columns,
+    }
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+    return meta
+
+
+class ColumnarDataset(object):
+    """
+    Dataset stored as one .npy file per column
+
+    Parameters
+    ----------
+    directory: str
+        directory written by write_columns
+    mmap: bool
+        memory-map the columns instead of reading them
+    """
+    def __init__(self, directory: str, mmap: bool = True):
+        with open(os.path.join(directory, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        self.directory = directory
+        self.length = meta['length']
+        self.columns = [column['name'] for column in meta['columns']]
+        self.dtypes = {}
+        self._arrays = {}
+        mmap_mode = 'r' if mmap and self.length else None
+        for column in meta['columns']:
+            name = column['name']
+            if column['categories'] is not None:
+                self.dtypes[name] = pd.CategoricalDtype(column['categories'])
+            else:
+                self.dtypes[name] = np.dtype(column['dtype'])
+            self._arrays[name] = np.load(os.path.join(directory,
+                                                      column['file']),
+                                         mmap_mode=mmap_mode)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Return the stored array of a column, the codes of categorical ones
+        """
+        return self._arrays[name]
+
+    def to_frame(self,
+                 columns: Optional[Sequence[str]] = None,
+                 start: int = 0,
+                 stop: Optional[int] = None) -> pd.DataFrame:
+        """
+        Read rows start to stop of the given columns into a DataFrame
+
+        Text columns are categorical.
+        """
+        frame = {}
+        for name in columns or self.columns:
+            values = np.array(self._arrays[name][start:stop])
+            dtype = self.dtypes[name]
+            if isinstance(dtype, pd.CategoricalDtype):
+                values = pd.Categorical.from_codes(values, dtype=dtype)
+            frame[name] = values
+        index = pd.RangeIndex(self.length)[start:stop]
+        return pd.DataFrame(frame, index=index)
+
+    def iter_frames(
+            self,
+            chunksize: Optional[int] = None,
+            columns: Optional[Sequence[str]] = None
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Iterate over the dataset in DataFrames of chunksize rows
+        """
+        chunksize = chunksize or CHUNK_SIZE
+        for start in range(0, self.length, chunksize):
+            yield self.to_frame(columns, start, start + chunksize)
+
+
+def cache_key(paths: Sequence[str], format: Optional[str],
+              options: dict) -> str:
+    """
+    Return a key of the source files and the options they are parsed with
+
+    The size and modification time of the files are part of the key, so
+    that a modified source is parsed again.
+    """
+    sources = []
+    for path in paths:
+        stat = os.stat(path)
+        sources.append(
+            [os.path.realpath(path), stat.st_size, stat.st_mtime_ns])
+    content = json.dumps(
+        {
+            'cache': CACHE_FORMAT,
+            'sources': sources,
+            'format': format,
+            'options': options,
+        },
+        sort_keys=True,
+        default=repr)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+
+def open_dataset(paths: Union[str, Sequence[str]],
+                 format: Optional[str] = None,
+                 cache: Optional[bool] = None,
+                 chunksize: Optional[int] = None,
+                 **options) -> ColumnarDataset:
+    """
+    Open a raw dataset through the columnar cache
+
+    The first call parses the source files in chunks and writes the cached
+    columns, later calls memory-map them as long as the files are
+    unchanged. Several paths are concatenated, e.g. the years of the Polish
+    dataset. The index of the source is not kept.
+
+    Parameters
+    ----------
+    paths: str or list
+        source file or files with the same columns
+    format: str
+        format of the files, by default from their extension
+    cache: bool
+        write and reuse the on-disk copy, by default the ENABLED setting of
+        SCORECARD_DATASET_CACHE. Without cache the columns are parsed to a
+        temporary directory and read in memory.
+    chunksize: int
+        rows parsed at a time
+    options:
+        extra read_csv options
+
+    Returns
+    -------
+    ColumnarDataset
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    config = cache_options()
+    if cache is None:
+        cache = config['ENABLED']
+    chunksize = chunksize or config['CHUNK_SIZE']
+
+    def chunks():
+        for path in paths:
+            yield from read_chunks(path, format, chunksize, **options)
+
+    def uncached():
+        with tempfile.TemporaryDirectory() as directory:
+            write_columns(chunks(), directory)
+            return ColumnarDataset(directory, mmap=False)
+
+    if not cache:
+        return uncached()
+
+    stem = os.path.splitext(os.path.basename(paths[0]))[0]
+    directory = os.path.join(config['DIRECTORY'],
+                             f'{stem}-{cache_key(paths, format, options)}')
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        try:
+            os.makedirs(config['DIRECTORY'], exist_ok=True)
+            staging = tempfile.mkdtemp(prefix=f'.{stem}-',
+                                       dir=config['DIRECTORY'])
+        except OSError as e:
+            log.warning(f"Could not cache {paths[0]}, reading it without "
+                        f"cache; {str(e)}")
+            return uncached()
+        try:
+            meta = write_columns(chunks(), staging)
+            os.rename(staging, directory)
+            log.info(f"Cached {meta['length']} rows of {paths[0]} in "
+                     f"{directory}")
+        except OSError as e:
+            # another process may have cached the same files first
+            if not os.path.exists(os.path.join(directory, 'meta.json')):
+                log.warning(f"Could not cache {paths[0]}, reading it "
+                            f"without cache; {str(e)}")
+                return uncached()
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    return ColumnarDataset(directory)
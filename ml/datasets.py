@@ -0,0 +1,178 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Training datasets
+
+Readers for the raw credit datasets shipped in ``zoo/data``. Every reader
+returns a DataFrame with typed columns named the way the model manifest
+names the features, plus the target column. The files are parsed through
+the columnar cache of ml.dataloader, text columns are categorical.
+"""
+
+import glob
+import os
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_categorical_dtype
+
+from ml.dataloader import open_dataset
+
+DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'zoo',
+    'data')
+
+
+def snake_case(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rename columns to lowercase snake case
+    """
+    return frame.rename(columns=lambda column: column.lower().replace(
+        ' ', '_') if isinstance(column, str) else column)
+
+
+def read_german() -> pd.DataFrame:
+    frame = open_dataset(os.path.join(DATA_DIR, 'german.csv'),
+                         index_col=0).to_frame()
+    # savings and checking accounts are mostly missing and often not
+    # available for an applicant
+    frame = frame.drop(columns=['Saving accounts', 'Checking account'])
+    return snake_case(frame)
+
+
+def read_australian() -> pd.DataFrame:
+    return open_dataset(os.path.join(DATA_DIR, 'australian.dat')).to_frame()
+
+
+def read_japanese() -> pd.DataFrame:
+    return open_dataset(os.path.join(DATA_DIR, 'japanese',
+                                     'japanese.data')).to_frame()
+
+
+def read_polish() -> pd.DataFrame:
+    paths = sorted(glob.glob(os.path.join(DATA_DIR, 'polish', '*year.arff')))
+    return open_dataset(paths).to_frame().rename(columns=str.lower)
+
+
+def read_taiwan() -> pd.DataFrame:
+    path = os.path.join(DATA_DIR, 'taiwan.xls')
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'{path} is not available')
+    frame = pd.read_excel(path, index_col=0, header=1)
+    return snake_case(frame)
+
+
+def read_tanzania() -> pd.DataFrame:
+    directory = os.path.join(DATA_DIR, 'tanzania_data')
+    performance = open_dataset(os.path.join(directory,
+                                            'final_performance.csv'),
+                               index_col=0).to_frame()
+    demographics = open_dataset(os.path.join(directory,
+                                             'final_demographics.csv'),
+                                index_col=0).to_frame()
+    frame = performance.merge(
+        demographics.drop_duplicates('customerid'), on='customerid')
+
+    frame['birth_year'] = pd.to_datetime(frame['birthdate']).dt.year
+    frame['employment_status_clients'] = \
+        frame['employment_status_clients'].astype(object).fillna('Unknown')
+    return frame[DATASETS['tanzania']['features'] + ['good_bad_flag']]
+
+
+# Raw datasets by name. ``target`` is the label column and ``good`` the label
+# value of a good credit risk, which becomes class 1 so that postprocessing
+# reads the probability of class 1 as the probability of a good risk.
+DATASETS = {
+    'german': {
+        'reader': read_german,
+        'region': 'Germany',
+        'target': 'risk',
+        'good': 'good',
+    },
+    'australian': {
+        'reader': read_australian,
+        'region': 'Australia',
+        'target': '14',
+        'good': 1,
+    },
+    'japanese': {
+        'reader': read_japanese,
+        'region': 'Japan',
+        'target': '15',
+        'good': '+',
+    },
+    'polish': {
+        'reader': read_polish,
+        'region': 'Poland',
+        'target': 'class',
+        # class 1 marks companies that went bankrupt
+        'good': '0',
+    },
+    'taiwan': {
+        'reader': read_taiwan,
+        'region': 'Taiwan',
+        'target': 'default_payment_next_month',
+        'good': 0,
+    },
+    'tanzania': {
+        'reader': read_tanzania,
+        'region': 'Tanzania',
+        'target': 'good_bad_flag',
+        'good': 'Good',
+        'features': [
+            'loannumber', 'loanamount', 'totaldue', 'termdays', 'birth_year',
+            'bank_account_type', 'longitude_gps', 'latitude_gps',
+            'bank_name_clients', 'employment_status_clients'
+        ],
+    },
+}
+
+
+def load_dataset(name: str) -> Tuple[pd.DataFrame, np.ndarray, List[str]]:
+    """
+    Read a raw dataset for training
+
+    Rows with missing values are dropped, since every feature is required
+    at prediction time.
+
+    Parameters
+    ----------
+    name: str
+        dataset name, a key of DATASETS
+
+    Returns
+    -------
+    tuple
+        (features, target, categorical): the feature columns, the target
+        with 1 for a good risk, and the names of the text columns to label
+        encode
+    """
+    spec = DATASETS[name]
+    frame = spec['reader']().dropna()
+
+    target = (frame[spec['target']] == spec['good']).astype(int).values
+    features = frame.drop(columns=[spec['target']])
+    categorical = [
+        column for column in features.columns
+        if features[column].dtype == object
+        or is_categorical_dtype(features[column].dtype)
+    ]
+    return features, target, categorical
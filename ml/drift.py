@@ -0,0 +1,293 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Feature drift statistics
+
+Baselines of the training datasets in ``zoo/data`` and the population
+stability index (PSI) and Kolmogorov-Smirnov distance (KS) of incoming
+applicants against them.
+
+Every feature of a dataset is cut into bins: the quantiles of the training
+values for numeric features, one bin per training value plus one for unseen
+values for categorical features. Binning a value is a bisection over a few
+edges or a dictionary lookup, so the histograms of incoming applicants are
+updated in constant time per applicant. PSI and KS are computed on the
+binned distributions, KS only for numeric features, whose bins are ordered.
+"""
+
+import bisect
+import math
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from ml.datasets import load_dataset
+
+# quantile bins of the numeric features, deciles as usual for PSI
+BINS = 10
+
+# proportion given to empty bins, so that PSI stays finite
+EPSILON = 1e-4
+
+
+class FeatureBins(object):
+    """
+    Bins of one feature of a dataset
+
+    Parameters
+    ----------
+    name: str
+        feature name, as in the applicant data
+    edges: list
+        sorted inner bin edges of a numeric feature, bin i holds the values
+        from edges[i - 1] (included) to edges[i] (excluded)
+    categories: list
+        training values of a categorical feature, the last bin holds the
+        values not seen in training
+    """
+    def __init__(self,
+                 name: str,
+                 edges: Sequence[float] = None,
+                 categories: Sequence[str] = None):
+        self.name = name
+        self.edges = list(edges) if edges is not None else None
+        self.categories = list(categories) if categories is not None else None
+        self.codes = None
+        if self.categories is not None:
+            self.codes = {
+                category: code
+                for code, category in enumerate(self.categories)
+            }
+
+    @property
+    def numeric(self) -> bool:
+        return self.categories is None
+
+    @property
+    def size(self) -> int:
+        if self.numeric:
+            return len(self.edges) + 1
+        return len(self.categories) + 1
+
+    def index(self, value: Any) -> Optional[int]:
+        """
+        Return the bin of a value, None when it is missing or a numeric
+        feature is not given a number
+        """
+        if value is None:
+            return None
+        if not self.numeric:
+            return self.codes.get(str(value), len(self.categories))
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        if math.isnan(value):
+            return None
+        return bisect.bisect_right(self.edges, value)
+
+    def counts(self, values: pd.Series) -> np.ndarray:
+        """
+        Return the number of values in each bin
+        """
+        values = values.dropna()
+        if self.numeric:
+            positions = np.searchsorted(self.edges,
+                                        values.astype(float).values,
+                                        side='right')
+        else:
+            positions = values.astype(str).map(self.codes).fillna(
+                len(self.categories)).astype(int).values
+        return np.bincount(positions, minlength=self.size)
+
+    @classmethod
+    def fit(cls,
+            name: str,
+            values: pd.Series,
+            categorical: bool,
+            bins: int = BINS) -> 'FeatureBins':
+        """
+        Bin a feature on its training values
+        """
+        values = values.dropna()
+        if categorical:
+            return cls(name,
+                       categories=sorted(set(values.astype(str).unique())))
+        quantiles = np.quantile(values.astype(float).values,
+                                np.linspace(0, 1, bins + 1)[1:-1])
+        return cls(name, edges=np.unique(quantiles).tolist())
+
+
+class Baseline(object):
+    """
+    Bins and training distribution of the features of a dataset
+
+    Parameters
+    ----------
+    dataset: str
+        dataset name, a key of ml.datasets.DATASETS
+    features: list
+        FeatureBins of every feature
+    expected: dict
+        training counts of every bin keyed by feature name
+    """
+    def __init__(self, dataset: str, features: List[FeatureBins],
+                 expected: Dict[str, np.ndarray]):
+        self.dataset = dataset
+        self.features = features
+        self.expected = expected
+        self.by_name = {feature.name: feature for feature in features}
+
+    def select(self, names: Optional[Sequence[str]]) -> 'Baseline':
+        """
+        Return the baseline of the named features only, all when None
+        """
+        if names is None:
+            return self
+        features = [
+            self.by_name[str(name)] for name in names
+            if str(name) in self.by_name
+        ]
+        return Baseline(self.dataset, features, {
+            feature.name: self.expected[feature.name]
+            for feature in features
+        })
+
+    def histograms(self) -> 'FeatureHistograms':
+        return FeatureHistograms(self)
+
+    def compare(self, name: str, counts: Sequence[int]) -> Dict[str, Any]:
+        """
+        Compare observed counts of a feature with its training distribution
+
+        Parameters
+        ----------
+        name: str
+            feature name
+        counts: list
+            number of observed values in each bin of the feature
+
+        Returns
+        -------
+        dict
+            the number of observations, PSI and, for numeric features, KS.
+            The statistics are None without observations.
+        """
+        feature = self.by_name[name]
+        observations = int(sum(counts))
+        result = {
+            "feature": name,
+            "type": "numeric" if feature.numeric else "categorical",
+            "observations": observations,
+            "psi": None,
+            "ks": None,
+        }
+        if observations:
+            expected = self.expected[name]
+            result["psi"] = psi(expected, counts)
+            if feature.numeric:
+                result["ks"] = ks_distance(expected, counts)
+        return result
+
+
+class FeatureHistograms(object):
+    """
+    Counts of incoming values in the bins of a baseline
+    """
+    def __init__(self, baseline: Baseline):
+        self.baseline = baseline
+        self.counts = {
+            feature.name: [0] * feature.size
+            for feature in baseline.features
+        }
+        self.observations = 0
+
+    def add(self, data: Dict[str, Any]):
+        """
+        Count the features of an applicant
+        """
+        for feature in self.baseline.features:
+            position = feature.index(data.get(feature.name))
+            if position is not None:
+                self.counts[feature.name][position] += 1
+        self.observations += 1
+
+
+def _proportions(counts: Sequence[int]) -> np.ndarray:
+    counts = np.asarray(counts, dtype=float)
+    return counts / counts.sum()
+
+
+def psi(expected: Sequence[int], actual: Sequence[int]) -> float:
+    """
+    Population stability index of binned counts
+    """
+    expected = np.clip(_proportions(expected), EPSILON, None)
+    actual = np.clip(_proportions(actual), EPSILON, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def ks_distance(expected: Sequence[int], actual: Sequence[int]) -> float:
+    """
+    Largest distance between the cumulative distributions of ordered binned
+    counts
+    """
+    return float(
+        np.max(
+            np.abs(
+                np.cumsum(_proportions(expected)) -
+                np.cumsum(_proportions(actual)))))
+
+
+_baseline_lock = threading.Lock()
+
+
+def baseline(dataset: str, bins: int = BINS) -> Baseline:
+    """
+    Return the baseline of a training dataset, built once per process
+
+    Threads asking for a baseline being built wait for it instead of
+    building it again.
+
+    Parameters
+    ----------
+    dataset: str
+        dataset name, a key of ml.datasets.DATASETS
+    bins: int
+        number of quantile bins of the numeric features
+    """
+    with _baseline_lock:
+        return _baseline(dataset, bins)
+
+
+@lru_cache(maxsize=None)
+def _baseline(dataset: str, bins: int) -> Baseline:
+    frame, _, categorical = load_dataset(dataset)
+    features = []
+    expected = {}
+    for column in frame.columns:
+        feature = FeatureBins.fit(str(column), frame[column],
+                                  column in categorical, bins)
+        features.append(feature)
+        expected[feature.name] = feature.counts(frame[column])
+    return Baseline(dataset, features, expected)
@@ -0,0 +1,187 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Multi-model scoring
+
+Scores one applicant with several classifiers in a single call. The
+applicant is encoded once per input schema, i.e. per column order and set
+of label encoders, which the classifiers of a zoo region share. The
+classifiers then run concurrently on a shared thread pool; the NumPy and
+scikit-learn code they spend their time in mostly releases the GIL.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+from ml import metrics
+from ml.classifiers import Classifier
+
+log = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> Optional[ThreadPoolExecutor]:
+    """
+    Return the process wide scoring thread pool configured by
+    SCORECARD_ENSEMBLE, or None to score in the calling thread
+    """
+    global _executor
+    threads = getattr(settings, 'SCORECARD_ENSEMBLE', {}).get('THREADS', 4)
+    if threads <= 1:
+        return None
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=threads, thread_name_prefix='scorecard')
+    return _executor
+
+
+def schema_key(classifier: Classifier, data: Dict[str, Any]):
+    """
+    Return the column order a classifier encodes an applicant in and a key
+    shared by the classifiers that encode it the same way
+    """
+    if classifier.features is not None:
+        columns = tuple(classifier.features)
+    else:
+        columns = tuple(data.keys())
+    # classifiers of a region share their encoder artifacts
+    key = (columns, classifier.features is None,
+           id(classifier.label_encoders), tuple(classifier.categorical))
+    return key, columns
+
+
+def _score(classifier: Classifier, row, label: str) -> Dict[str, Any]:
+    try:
+        with metrics.stage('inference', label):
+            prediction = classifier.predict(row)[0]
+        with metrics.stage('postprocessing', label):
+            return classifier.postprocessing(prediction)
+    except Exception as e:
+        log.debug(f'An error occured: {str(e)}')
+        return {"error": str(e)}
+
+
+def score_classifiers(
+        classifiers: Dict[str, Classifier],
+        data: Dict[str, Any],
+        executor: Optional[ThreadPoolExecutor] = None,
+        labels: Optional[Dict[str, str]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Score an applicant with every classifier
+
+    Parameters
+    ----------
+    classifiers: dict
+        classifiers keyed by name
+    data: dict
+        applicant data
+    executor: ThreadPoolExecutor
+        pool the classifiers run on, in the calling thread when None
+    labels: dict
+        metrics label of each classifier, the one of the tracked request for
+        those missing
+
+    Returns
+    -------
+    dict
+        the postprocessed prediction of each classifier, or an
+        ``{"error": ...}`` entry for those that failed
+    """
+    labels = labels or {}
+    rows = {}
+    results = {}
+    for name, classifier in classifiers.items():
+        try:
+            key, columns = schema_key(classifier, data)
+            if key not in rows:
+                # the encoded row buffer is reused by the next encode on
+                # this thread, the pool threads get their own copy
+                with metrics.stage('preprocessing', labels.get(name)):
+                    rows[key] = classifier.encoding_plan(columns).encode(
+                        data).copy()
+            results[name] = rows[key]
+        except Exception as e:
+            log.debug(f'An error occured: {str(e)}')
+            results[name] = {"error": str(e)}
+
+    scored = [(name, classifiers[name], row) for name, row in results.items()
+              if not isinstance(row, dict)]
+    if executor is None or len(scored) < 2:
+        predictions = [
+            _score(classifier, row, labels.get(name))
+            for name, classifier, row in scored
+        ]
+    else:
+        futures = [
+            executor.submit(_score, classifier, row, labels.get(name))
+            for name, classifier, row in scored
+        ]
+        predictions = [future.result() for future in futures]
+
+    for (name, _, _), prediction in zip(scored, predictions):
+        results[name] = prediction
+    return results
+
+
+def ensemble(predictions: Dict[str, Dict[str, Any]],
+             weights: Dict[str, float]) -> Dict[str, Any]:
+    """
+    Weighted average of the probabilities of the classifiers that scored
+
+    Parameters
+    ----------
+    predictions: dict
+        predictions keyed by classifier name, as returned by
+        score_classifiers
+    weights: dict
+        non-negative weight of each classifier. The weights of the
+        classifiers that failed are left out and the others renormalized.
+
+    Returns
+    -------
+    dict
+        probability and label of the ensemble and the weights used
+    """
+    used = {
+        name: weight
+        for name, weight in weights.items()
+        if 'probability' in predictions.get(name, {})
+    }
+    total = sum(used.values())
+    if not total:
+        raise ValueError('No weighted classifier returned a probability')
+
+    used = {name: weight / total for name, weight in used.items()}
+    probability = sum(weight * float(predictions[name]['probability'])
+                      for name, weight in used.items())
+    return {
+        "probability": probability,
+        "label": "good" if probability > 0.5 else "bad",
+        "weights": used,
+    }
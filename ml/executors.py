@@ -0,0 +1,512 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Process pool inference
+
+Scoring threads of one process share a single GIL, so a batch or a
+multi-model request only uses one core. The ProcessInferenceExecutor keeps
+a pool of long-lived worker processes, each with the models it serves
+loaded, and hands them ``predict_proba`` calls: the encoded rows are copied
+into a shared memory block owned by the worker and the probabilities are
+read back from a second one. Only the classifier spec and the array shape
+go through the pipe, never a pickled frame.
+
+Rows are encoded in the calling process, which is vectorized already for
+batches; the workers run the models. A batch is split so that every idle
+worker gets a share of the rows.
+
+With SCORECARD_INFERENCE_EXECUTOR enabled, ``Classifier.engine`` returns a
+ProcessEngine, so compute_prediction, compute_batch and multi-model
+scoring all go through the pool.
+"""
+
+import atexit
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from collections import deque
+from multiprocessing import shared_memory
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from ml import backends
+
+log = logging.getLogger(__name__)
+
+# element type of the shared input and output blocks
+DTYPE = np.float64
+
+# widest probability row the output block of a batch is sized for
+MAX_CLASSES = 2
+
+
+def classifier_spec(classifier) -> Optional[Tuple[Any, ...]]:
+    """
+    Return what a worker process needs to load the model of a classifier
+    from the zoo, or None when the model was not read from the zoo
+
+    Parameters
+    ----------
+    classifier: Classifier
+        classifier the spec is built for
+
+    Returns
+    -------
+    tuple
+        module and name of the classifier class, zone, artifact paths and
+        backend. Hashable, it keys the engines of a worker.
+    """
+    if not classifier.reloadable:
+        return None
+    cls = type(classifier)
+    return (cls.__module__, cls.__qualname__, classifier.zone,
+            tuple(sorted(classifier.artifact_paths.items())),
+            classifier.backend)
+
+
+def _build_engine(spec):
+    module, name, zone, artifact_paths, backend = spec
+    cls = getattr(importlib.import_module(module), name)
+    classifier = cls(zone=zone,
+                     artifact_paths=dict(artifact_paths),
+                     backend=backend)
+    # compile here, Classifier.engine would hand the model to a pool again
+    return backends.compile_model(classifier.model, backend)
+
+
+def _reply(conn, status: str, value):
+    try:
+        conn.send((status, value))
+    except Exception as e:
+        # exceptions that cannot be pickled are sent as their message
+        conn.send(('error', RuntimeError(f'{type(e).__name__}: {e}')))
+
+
+def _predict(engine, input_block, output_block, shape):
+    data = np.ndarray(shape, dtype=DTYPE, buffer=input_block.buf)
+    probabilities = np.asarray(engine.predict_proba(data), dtype=DTYPE)
+    if probabilities.nbytes > output_block.size:
+        raise ValueError(f'{probabilities.shape[1]} class probabilities do '
+                         'not fit the output buffer')
+    output = np.ndarray(probabilities.shape,
+                        dtype=DTYPE,
+                        buffer=output_block.buf)
+    output[...] = probabilities
+    return probabilities.shape
+
+
+def _worker_main(conn, input_name: str, output_name: str, specs: List):
+    input_block = shared_memory.SharedMemory(name=input_name)
+    output_block = shared_memory.SharedMemory(name=output_name)
+    engines = {}
+    try:
+        try:
+            for spec in specs:
+                engines[spec] = _build_engine(spec)
+        except Exception as e:
+            _reply(conn, 'error', e)
+            return
+        _reply(conn, 'ready', None)
+
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message is None:
+                break
+            command, spec, shape = message
+            try:
+                engine = engines.get(spec)
+                if engine is None:
+                    engine = engines[spec] = _build_engine(spec)
+                if command == 'load':
+                    _reply(conn, 'ok', None)
+                else:
+                    _reply(conn, 'ok',
+                           _predict(engine, input_block, output_block, shape))
+            except Exception as e:
+                _reply(conn, 'error', e)
+    finally:
+        input_block.close()
+        output_block.close()
+
+
+class WorkerError(RuntimeError):
+    """
+    Raised when an inference worker process exits unexpectedly
+    """
+
+
+class _Worker(object):
+    """
+    One worker process with its input and output shared memory blocks
+    """
+    def __init__(self, context, buffer_size: int, specs: List):
+        self.input = shared_memory.SharedMemory(create=True, size=buffer_size)
+        self.output = shared_memory.SharedMemory(create=True,
+                                                 size=buffer_size)
+        self.broken = False
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main,
+                                       args=(child, self.input.name,
+                                             self.output.name, list(specs)),
+                                       name='scorecard-inference',
+                                       daemon=True)
+        self.process.start()
+        child.close()
+
+    def send(self, command: str, spec, shape=None):
+        try:
+            self.conn.send((command, spec, shape))
+        except (OSError, ValueError) as e:
+            self.broken = True
+            raise WorkerError(f'inference worker exited: {e}') from e
+
+    def receive(self):
+        try:
+            status, value = self.conn.recv()
+        except (EOFError, OSError) as e:
+            self.broken = True
+            raise WorkerError('inference worker exited') from e
+        if status == 'error':
+            raise value
+        return value
+
+    def submit(self, spec, data: np.ndarray):
+        block = np.ndarray(data.shape, dtype=DTYPE, buffer=self.input.buf)
+        block[...] = data
+        del block
+        self.send('predict', spec, data.shape)
+
+    def result(self) -> np.ndarray:
+        shape = self.receive()
+        return np.ndarray(shape, dtype=DTYPE, buffer=self.output.buf).copy()
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.conn.close()
+        for block in (self.input, self.output):
+            block.close()
+            block.unlink()
+
+
+class ProcessInferenceExecutor(object):
+    """
+    Pool of long-lived processes running ``predict_proba``
+
+    Every worker owns an input and an output shared memory block of
+    ``buffer_size`` bytes and serves one call at a time. A call takes idle
+    workers off the pool, so calls from several threads run side by side
+    and a batch bigger than one block, or than its share of the pool, is
+    scored by several workers at once. Workers that die are replaced.
+
+    Parameters
+    ----------
+    workers: int
+        number of worker processes, the number of CPUs when None
+    buffer_size: int
+        size in bytes of each shared memory block, which bounds the rows
+        sent to a worker at once
+    min_rows: int
+        inputs of fewer rows are scored in the calling process by
+        ProcessEngine, where the round trip would cost more than the model
+    start_method: str
+        multiprocessing start method of the workers
+    specs: list
+        classifier specs every worker loads before it takes work
+    """
+    def __init__(self,
+                 workers: int = None,
+                 buffer_size: int = 4 * 2**20,
+                 min_rows: int = 1,
+                 start_method: str = 'spawn',
+                 specs: List = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.buffer_size = buffer_size
+        self.min_rows = min_rows
+        self._context = multiprocessing.get_context(start_method)
+        self._specs = list(specs or [])
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        # workers that died and could not be replaced yet
+        self._missing = 0
+        self._start_lock = threading.Lock()
+
+        started = []
+        try:
+            for _ in range(self.workers):
+                started.append(
+                    _Worker(self._context, buffer_size, self._specs))
+            for worker in started:
+                worker.receive()
+        except Exception:
+            for worker in started:
+                worker.close()
+            raise
+        for worker in started:
+            self._idle.put(worker)
+
+    def _start_worker(self) -> Optional[_Worker]:
+        """
+        Start a worker, None when it cannot be started
+        """
+        worker = None
+        try:
+            worker = _Worker(self._context, self.buffer_size, self._specs)
+            worker.receive()
+            return worker
+        except Exception:
+            log.exception('Could not start an inference worker')
+            if worker is not None:
+                worker.close()
+            return None
+
+    def _replace_missing(self):
+        """
+        Start the workers that could not be replaced when they died, so
+        that the pool keeps its size
+        """
+        with self._start_lock:
+            while self._missing and not self._closed:
+                worker = self._start_worker()
+                if worker is None:
+                    break
+                self._missing -= 1
+                self._idle.put(worker)
+            if self._missing == self.workers:
+                raise RuntimeError('No inference worker could be started')
+
+    def _acquire(self, block: bool = True) -> Optional[_Worker]:
+        if self._closed:
+            raise RuntimeError('The inference executor is shut down')
+        if self._missing:
+            self._replace_missing()
+        try:
+            return self._idle.get(block=block)
+        except queue.Empty:
+            return None
+
+    def _release(self, worker: _Worker):
+        if worker.broken:
+            log.warning('Replacing inference worker '
+                        f'{worker.process.pid}, exit code '
+                        f'{worker.process.exitcode}')
+            worker.close()
+            worker = self._start_worker()
+            if worker is None:
+                # started again by the next call
+                with self._start_lock:
+                    self._missing += 1
+                return
+        if self._closed:
+            worker.close()
+        else:
+            self._idle.put(worker)
+
+    def preload(self, spec):
+        """
+        Load a classifier in every worker, and in the workers started later
+
+        Waits for every worker to be idle.
+        """
+        with self._lock:
+            if spec in self._specs:
+                return
+            self._specs.append(spec)
+            first = self._acquire()
+            # workers that could not be replaced load the spec when started
+            workers = [first] + [
+                self._acquire()
+                for _ in range(self.workers - self._missing - 1)
+            ]
+        try:
+            errors = []
+            sent = []
+            for worker in workers:
+                try:
+                    worker.send('load', spec)
+                    sent.append(worker)
+                except WorkerError as e:
+                    errors.append(e)
+            for worker in sent:
+                try:
+                    worker.receive()
+                except Exception as e:
+                    errors.append(e)
+            if errors:
+                # replacement workers would fail to start on it
+                self._specs.remove(spec)
+                raise errors[0]
+        finally:
+            for worker in workers:
+                self._release(worker)
+
+    def predict_proba(self, spec, data) -> np.ndarray:
+        """
+        Score rows with the model of a classifier spec in the pool
+
+        Parameters
+        ----------
+        spec: tuple
+            classifier spec as returned by classifier_spec
+        data: array-like
+            encoded rows of shape (n_rows, n_features)
+
+        Returns
+        -------
+        numpy.ndarray
+            class probabilities of shape (n_rows, n_classes)
+        """
+        data = np.ascontiguousarray(data, dtype=DTYPE)
+        if data.ndim != 2:
+            raise ValueError(f'Expected a 2D array, got {data.ndim}D')
+        n_rows, n_features = data.shape
+        capacity = self.buffer_size // (DTYPE().itemsize *
+                                        max(n_features, MAX_CLASSES))
+        if capacity < 1:
+            raise ValueError(f'A row of {n_features} features does not fit '
+                             'the inference buffers')
+        # share the rows between the workers, in blocks that fit
+        rows = max(1, min(capacity, -(-n_rows // self.workers)))
+
+        results = []
+        errors = []
+        pending = deque()
+
+        def collect():
+            index, worker = pending.popleft()
+            try:
+                results[index] = worker.result()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                self._release(worker)
+
+        try:
+            for start in range(0, n_rows, rows):
+                if errors:
+                    break
+                worker = self._acquire(block=not pending)
+                while worker is None:
+                    # all workers are busy, wait for our oldest block
+                    collect()
+                    worker = self._acquire(block=not pending)
+                try:
+                    worker.submit(spec, data[start:start + rows])
+                except Exception as e:
+                    errors.append(e)
+                    self._release(worker)
+                    break
+                results.append(None)
+                pending.append((len(results) - 1, worker))
+        finally:
+            while pending:
+                collect()
+
+        if errors:
+            raise errors[0]
+        if not results:
+            return np.empty((0, MAX_CLASSES), dtype=DTYPE)
+        if len(results) == 1:
+            return results[0]
+        return np.concatenate(results)
+
+    def shutdown(self):
+        """
+        Stop the idle workers; busy ones stop when their call returns
+        """
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class ProcessEngine(object):
+    """
+    Engine of a classifier running ``predict_proba`` in a
+    ProcessInferenceExecutor
+
+    Inputs of fewer than ``executor.min_rows`` rows are scored with the
+    local engine of the classifier, compiled on first use.
+
+    Parameters
+    ----------
+    executor: ProcessInferenceExecutor
+        pool the rows are scored in
+    classifier: Classifier
+        classifier whose model the workers load, see classifier_spec
+    """
+    def __init__(self, executor: ProcessInferenceExecutor, classifier):
+        self.executor = executor
+        self.classifier = classifier
+        self.spec = classifier_spec(classifier)
+        self._local = None
+        executor.preload(self.spec)
+
+    def predict_proba(self, data):
+        if len(data) < self.executor.min_rows:
+            if self._local is None:
+                self._local = backends.compile_model(self.classifier.model,
+                                                     self.classifier.backend)
+            return self._local.predict_proba(data)
+        return self.executor.predict_proba(self.spec, data)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_process_executor() -> Optional[ProcessInferenceExecutor]:
+    """
+    Return the process wide inference pool configured by
+    SCORECARD_INFERENCE_EXECUTOR, or None when it is disabled
+    """
+    global _executor
+    options = getattr(settings, 'SCORECARD_INFERENCE_EXECUTOR', {})
+    if not options.get('ENABLED', False):
+        return None
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessInferenceExecutor(
+                    workers=options.get('WORKERS'),
+                    buffer_size=options.get('BUFFER_SIZE', 4 * 2**20),
+                    min_rows=options.get('MIN_ROWS', 1),
+                    start_method=options.get('START_METHOD', 'spawn'))
+                atexit.register(_executor.shutdown)
+    return _executor
@@ -0,0 +1,156 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Inference backend benchmark
+
+Compares the predict_proba latency of the sklearn estimators with their
+compiled backend (see ml.backends) on single rows and large batches, and
+checks that both give the same probabilities. Models fitted without
+probability estimates are compared on their decision function.
+"""
+
+import json
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ml.backends import compile_model
+from ml.benchmark import measure, synthetic_rows
+from ml.registry import MLRegistry
+
+
+class Command(BaseCommand):
+    help = ('Compare predict_proba latency of the sklearn and compiled '
+            'inference backends for every classifier of the manifest')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manifest',
+                            default=settings.SCORECARD_MODEL_MANIFEST)
+        parser.add_argument('--datasets',
+                            nargs='*',
+                            help='only benchmark these datasets')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--repeat',
+                            type=int,
+                            default=200,
+                            help='timed calls per single-row measurement')
+        parser.add_argument('--batch-repeat',
+                            type=int,
+                            default=5,
+                            help='timed calls per batch measurement')
+        parser.add_argument('--no-fallback',
+                            action='store_true',
+                            help='evaluate large batches on the compiled '
+                            'arrays too, instead of handing them back to '
+                            'sklearn')
+        parser.add_argument('--output',
+                            help='write the JSON results to this file')
+        parser.add_argument('--json',
+                            action='store_true',
+                            help='print machine readable results')
+
+    def handle(self, *args, **options):
+        self.options = options
+        registry = MLRegistry()
+        registry.load_manifest(options['manifest'],
+                               datasets=options['datasets'],
+                               sync=False)
+
+        results = []
+        for attrs in registry.pending:
+            classifier = attrs['classifier']
+            try:
+                engine = compile_model(classifier.model, 'compiled')
+            except ValueError as e:
+                self.stderr.write(f"{classifier.__class__.__name__} "
+                                  f"{classifier.zone}: {str(e)}")
+                continue
+            if options['no_fallback']:
+                engine.max_rows = None
+
+            ranges = None
+            if hasattr(engine, 'feature_ranges'):
+                ranges = engine.feature_ranges(len(classifier.features))
+            rows = synthetic_rows(classifier, options['batch_size'], ranges)
+            results += self.compare(classifier, engine, rows)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'results': results}, output, indent=2)
+
+        if options['json']:
+            self.stdout.write(json.dumps({'results': results}, indent=2))
+        else:
+            self.print_table(results)
+
+    def compare(self, classifier, engine, rows):
+        engines = {'sklearn': classifier.model, 'compiled': engine}
+        results = []
+        method = 'predict_proba'
+        try:
+            expected = classifier.model.predict_proba(rows)
+        except AttributeError:
+            method = 'decision_function'
+            expected = classifier.model.decision_function(rows)
+
+        for size, repeat in ((1, self.options['repeat']),
+                             (len(rows), self.options['batch_repeat'])):
+            batch = rows[:size]
+            for backend, model in engines.items():
+                result = {
+                    'classifier': classifier.__class__.__name__,
+                    'dataset': classifier.zone,
+                    'stage': f'{backend}/{size}',
+                    'method': method,
+                }
+                try:
+                    result.update(
+                        measure(lambda: getattr(model, method)(batch),
+                                repeat, 1, size))
+                except Exception as e:
+                    result['error'] = str(e)
+                results.append(result)
+
+        # compare in chunks the compiled arrays evaluate themselves
+        limit = getattr(engine, 'max_rows', None) or len(rows)
+        output = np.concatenate([
+            getattr(engine, method)(rows[start:start + limit])
+            for start in range(0, len(rows), limit)
+        ])
+        error = float(np.abs(output - expected).max())
+        for result in results:
+            result['max_abs_error'] = error
+        return results
+
+    def print_table(self, results):
+        self.stdout.write(f"{'classifier':<26}{'dataset':<12}"
+                          f"{'backend/rows':<18}{'p50 (ms)':>10}{'p99 (ms)':>10}{'rows/s':>12}"
+                          f"{'max error':>12}")
+        for result in results:
+            prefix = (f"{result['classifier']:<26}{result['dataset']:<12}"
+                      f"{result['stage']:<18}")
+            if 'error' in result:
+                self.stdout.write(f"{prefix}error: {result['error'][:60]}")
+                continue
+            self.stdout.write(f"{prefix}{result['p50_ms']:>10.3f}"
+                              f"{result['p99_ms']:>10.3f}"
+                              f"{result['throughput']:>12.0f}"
+                              f"{result.get('max_abs_error', np.nan):>12.1e}")
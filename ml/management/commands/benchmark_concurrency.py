@@ -0,0 +1,266 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Load test of the WSGI and ASGI predict paths
+
+Keeps a number of concurrent clients sending predict requests and reports
+throughput and client side latency for each concurrency level:
+
+- ``wsgi``: the DRF predict view through Django's WSGI handler, served by a
+  pool of --wsgi-threads threads like a threaded WSGI server. Requests
+  beyond the thread count wait in the accept queue.
+- ``asgi``: the async predict view through Django's ASGI handler, all
+  clients served by one event loop.
+
+Requests are made in-process, without sockets. --db-latency adds a delay to
+every SQL statement to stand in for the round-trip to a database server,
+which is what a blocked WSGI thread spends most of its time waiting for.
+The benchmark runs against a throwaway test database. Use
+``--settings=server.benchmark_settings`` to run it on SQLite.
+"""
+
+import asyncio
+import json
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends import utils
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from api import audit
+from ml.benchmark import latency_summary, sample_applicant
+from ml.registry import registry
+
+PATHS = {
+    'wsgi': '/api/v1/algorithms/predict',
+    'asgi': '/api/v1/async/algorithms/predict',
+}
+
+
+def delayed(execute, latency, lock):
+    """
+    Wrap a cursor method to wait latency seconds before running it
+
+    The wait overlaps between threads like a network round-trip does. The
+    statements themselves run one at a time when lock is given, since
+    concurrent writers make SQLite fail with locking errors.
+    """
+    def wrapper(self, *args, **kwargs):
+        time.sleep(latency)
+        if lock is None:
+            return execute(self, *args, **kwargs)
+        with lock:
+            return execute(self, *args, **kwargs)
+
+    return wrapper
+
+
+class Command(BaseCommand):
+    help = ('Compare throughput and latency of the WSGI and ASGI predict '
+            'paths under concurrent load')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--classifier', default='RandomForestClassifier')
+        parser.add_argument('--dataset', default='german')
+        parser.add_argument('--model-version', default='0.0.1')
+        parser.add_argument('--status', default='production')
+        parser.add_argument('--concurrency',
+                            type=int,
+                            nargs='+',
+                            default=[1, 8, 32, 128],
+                            help='numbers of concurrent clients')
+        parser.add_argument('--requests',
+                            type=int,
+                            default=500,
+                            help='requests per concurrency level')
+        parser.add_argument('--wsgi-threads',
+                            type=int,
+                            default=8,
+                            help='threads of the simulated WSGI server')
+        parser.add_argument('--db-latency',
+                            type=float,
+                            default=2.0,
+                            help='milliseconds added to every SQL statement')
+        parser.add_argument('--audit-modes',
+                            nargs='+',
+                            default=[audit.SYNC, audit.ASYNC],
+                            choices=[audit.SYNC, audit.ASYNC])
+        parser.add_argument('--paths',
+                            nargs='+',
+                            default=list(PATHS),
+                            choices=list(PATHS))
+        parser.add_argument('--output',
+                            help='write the JSON results to this file')
+        parser.add_argument('--json',
+                            action='store_true',
+                            help='print machine readable results')
+
+    def handle(self, *args, **options):
+        self.options = options
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0,
+                                           autoclobber=True,
+                                           serialize=False)
+        try:
+            registry.load_manifest()
+            found = registry.lookup(options['classifier'],
+                                    options['model_version'], options['status'],
+                                    options['dataset'])
+            if found is None:
+                raise CommandError('The algorithm is not registered')
+            _, classifier = found
+            classifier.load()
+            self.data = json.dumps(sample_applicant(classifier))
+            self.query = urlencode({
+                'classifier': options['classifier'],
+                'dataset': options['dataset'],
+                'version': options['model_version'],
+                'status': options['status'],
+            })
+
+            lock = threading.Lock() if connection.vendor == 'sqlite' \
+                else None
+            latency = options['db_latency'] / 1e3
+            patches = [
+                mock.patch.object(utils.CursorWrapper, name,
+                                  delayed(getattr(utils.CursorWrapper, name),
+                                          latency, lock))
+                for name in ('execute', 'executemany')
+            ]
+            for patch in patches:
+                patch.start()
+            try:
+                results = self.benchmark()
+            finally:
+                for patch in patches:
+                    patch.stop()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            },
+            'options': {
+                key: options[key]
+                for key in ('classifier', 'dataset', 'requests',
+                            'wsgi_threads', 'db_latency')
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_table(results)
+
+    def benchmark(self):
+        results = []
+        for audit_mode in self.options['audit_modes']:
+            with override_settings(SCORECARD_AUDIT_MODE=audit_mode):
+                for path in self.options['paths']:
+                    # untimed round to load lazy state on every thread
+                    asyncio.run(self.load(path, 8, 16))
+                    for concurrency in self.options['concurrency']:
+                        result = asyncio.run(
+                            self.load(path, concurrency,
+                                      self.options['requests']))
+                        result.update(path=path,
+                                      audit_mode=audit_mode,
+                                      concurrency=concurrency)
+                        results.append(result)
+                if audit_mode == audit.ASYNC:
+                    audit.get_audit_writer().flush()
+        return results
+
+    async def load(self, path, concurrency, requests):
+        """
+        Send requests from concurrency clients and time them
+        """
+        url = f'{PATHS[path]}?{self.query}'
+        if path == 'wsgi':
+            server = ThreadPoolExecutor(self.options['wsgi_threads'])
+            local = threading.local()
+
+            def call():
+                client = getattr(local, 'client', None)
+                if client is None:
+                    client = local.client = Client()
+                return client.post(url,
+                                   self.data,
+                                   content_type='application/json')
+
+            loop = asyncio.get_running_loop()
+            send = lambda: loop.run_in_executor(server, call)
+        else:
+            client = AsyncClient()
+            send = lambda: client.post(
+                url, self.data, content_type='application/json')
+
+        remaining = iter(range(requests))
+        timings = []
+        statuses = {}
+
+        async def run_client():
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await send()
+                timings.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(
+                    response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[run_client() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        if path == 'wsgi':
+            server.shutdown()
+
+        result = latency_summary(timings)
+        result['throughput'] = statuses.get(200, 0) / elapsed
+        result['errors'] = requests - statuses.get(200, 0)
+        result['statuses'] = statuses
+        return result
+
+    def print_table(self, results):
+        self.stdout.write(f"{'path':<6}{'audit':<7}{'clients':>8}"
+                          f"{'req/s':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}"
+                          f"{'p99 (ms)':>10}{'errors':>8}")
+        for result in results:
+            self.stdout.write(f"{result['path']:<6}{result['audit_mode']:<7}"
+                              f"{result['concurrency']:>8}"
+                              f"{result['throughput']:>10.0f}"
+                              f"{result['p50_ms']:>10.2f}"
+                              f"{result['p95_ms']:>10.2f}"
+                              f"{result['p99_ms']:>10.2f}"
+                              f"{result['errors']:>8}")
@@ -0,0 +1,176 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Memory benchmark for model preloading
+
+Forks a set of workers the way a pre-forking WSGI server does and reports the
+memory of each worker once every registered model has scored a request, with
+and without loading the models in the master process before the fork.
+"""
+
+import gc
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ml.benchmark import sample_applicant
+from ml.registry import MLRegistry
+
+MEMORY_FIELDS = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty')
+
+
+def memory_usage():
+    """
+    Return the memory of the current process in kB
+
+    Reads /proc/self/smaps_rollup, so this is only available on Linux.
+    ``uss`` is the memory only this process uses, ``pss`` splits shared
+    pages between the processes sharing them.
+    """
+    usage = {}
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            field, _, value = line.partition(':')
+            if field in MEMORY_FIELDS:
+                usage[field] = int(value.split()[0])
+
+    return {
+        'rss': usage['Rss'],
+        'pss': usage['Pss'],
+        'uss': usage['Private_Clean'] + usage['Private_Dirty'],
+    }
+
+
+def score_all(classifiers):
+    for classifier in classifiers:
+        try:
+            classifier.compute_prediction(sample_applicant(classifier))
+        except Exception:
+            # estimators without predict_proba (SVC) still count as loaded
+            pass
+
+
+def run_master(manifest, workers, preload):
+    """
+    Play the part of the server master process and return the memory
+    measured in each worker.
+    """
+    registry = MLRegistry()
+    registry.load_manifest(manifest, sync=False)
+    classifiers = [attr['classifier'] for attr in registry.pending]
+
+    if preload:
+        registry.preload()
+        gc.freeze()
+
+    reports, releases, children = [], [], []
+    for _ in range(workers):
+        report_read, report_write = os.pipe()
+        release_read, release_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(report_read)
+            os.close(release_write)
+            score_all(classifiers)
+            with os.fdopen(report_write, 'w') as report:
+                report.write(json.dumps(memory_usage()))
+            # stay alive until every worker is measured, shared pages are
+            # only accounted for while the processes sharing them exist
+            os.read(release_read, 1)
+            os._exit(0)
+
+        os.close(report_write)
+        os.close(release_read)
+        reports.append(report_read)
+        releases.append(release_write)
+        children.append(pid)
+
+    usage = []
+    for report_read in reports:
+        with os.fdopen(report_read) as report:
+            usage.append(json.loads(report.read()))
+    for release_write in releases:
+        os.close(release_write)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+    return usage
+
+
+class Command(BaseCommand):
+    help = ('Measure per-worker memory of forked workers with and without '
+            'preloading the models in the master process (Linux only)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--manifest',
+                            default=settings.SCORECARD_MODEL_MANIFEST)
+        parser.add_argument('--json',
+                            action='store_true',
+                            help='print machine readable results')
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/smaps_rollup'):
+            raise CommandError('This benchmark requires Linux 4.14 or newer')
+
+        results = {}
+        for preload in (False, True):
+            # every mode starts from a fresh master so nothing is inherited
+            # from the previous run or from this process
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                usage = run_master(options['manifest'], options['workers'],
+                                   preload)
+                with os.fdopen(write_fd, 'w') as output:
+                    output.write(json.dumps(usage))
+                os._exit(0)
+
+            os.close(write_fd)
+            with os.fdopen(read_fd) as output:
+                usage = json.loads(output.read() or 'null')
+            os.waitpid(pid, 0)
+            if usage is None:
+                raise CommandError('Benchmark master process failed')
+
+            mode = 'preload' if preload else 'lazy'
+            results[mode] = {
+                'workers': usage,
+                'mean_rss_kb': sum(u['rss'] for u in usage) / len(usage),
+                'mean_pss_kb': sum(u['pss'] for u in usage) / len(usage),
+                'mean_uss_kb': sum(u['uss'] for u in usage) / len(usage),
+                'total_pss_kb': sum(u['pss'] for u in usage),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'mode':<10}{'rss (MB)':>12}{'pss (MB)':>12}"
+                          f"{'uss (MB)':>12}{'total pss (MB)':>18}")
+        for mode, result in results.items():
+            self.stdout.write(f"{mode:<10}"
+                              f"{result['mean_rss_kb'] / 1024:>12.1f}"
+                              f"{result['mean_pss_kb'] / 1024:>12.1f}"
+                              f"{result['mean_uss_kb'] / 1024:>12.1f}"
+                              f"{result['total_pss_kb'] / 1024:>18.1f}")
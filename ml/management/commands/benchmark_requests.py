@@ -0,0 +1,253 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Query benchmark of the prediction audit trail
+
+Fills a throwaway test database with a synthetic PredictionRequest table of
+``--rows`` rows, created in order over ``--days`` days by ``--algorithms``
+algorithms, and times the queries the API and the retention command run on
+it, first with only the primary key and foreign key indexes and then with
+the PredictionRequest indexes:
+
+``algorithm_recent``
+    latest 50 requests of one algorithm
+``label_window``
+    number of bad predictions in a 30 day window
+``recent``
+    latest 50 requests
+``retention_batch``
+    ids of the first archive batch past a 365 day cutoff
+
+Use ``--settings=server.benchmark_settings`` to run it on SQLite.
+"""
+
+import json
+import platform
+import time
+import uuid
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+
+from api.models import Algorithm, PredictionRequest
+from ml.benchmark import measure
+
+INPUT = json.dumps(
+    json.dumps({
+        "age": 22,
+        "sex": "female",
+        "job": 2,
+        "housing": "own",
+        "credit_amount": 5951,
+        "duration": 48,
+        "purpose": "radio/TV"
+    }))
+
+
+def fill_requests(n_rows: int, algorithm_ids, days: int, batch_size: int,
+                  seed: int = 0):
+    """
+    Insert synthetic prediction requests with raw SQL
+
+    Rows are created in chronological order, as the audit trail is, with a
+    random algorithm and label each.
+    """
+    rng = np.random.default_rng(seed)
+    table = connection.ops.quote_name(PredictionRequest._meta.db_table)
+    columns = ('uuid', 'input', 'response', 'prediction', 'feedback',
+               'algorithm_id', 'created_at', 'created_by')
+    sql = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+           f"({', '.join(['%s'] * len(columns))})")
+    start = timezone.now() - timedelta(days=days)
+    step = timedelta(days=days) / n_rows
+
+    for offset in range(0, n_rows, batch_size):
+        size = min(batch_size, n_rows - offset)
+        algorithms = rng.choice(algorithm_ids, size)
+        probabilities = rng.random(size)
+        rows = []
+        for index in range(size):
+            probability = float(probabilities[index])
+            label = 'good' if probability > 0.5 else 'bad'
+            created_at = start + step * (offset + index)
+            rows.append((
+                uuid.uuid4().hex,
+                INPUT,
+                json.dumps({
+                    "probability": probability,
+                    "label": label
+                }),
+                label,
+                '',
+                int(algorithms[index]),
+                connection.ops.adapt_datetimefield_value(created_at),
+                '',
+            ))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+
+class Command(BaseCommand):
+    help = ('Measure the audit trail queries on a synthetic table, without '
+            'and with the PredictionRequest indexes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000000)
+        parser.add_argument('--algorithms', type=int, default=8)
+        parser.add_argument('--days',
+                            type=int,
+                            default=730,
+                            help='days the requests are spread over')
+        parser.add_argument('--insert-batch-size', type=int, default=50000)
+        parser.add_argument('--repeat',
+                            type=int,
+                            default=20,
+                            help='timed calls per query')
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--output',
+                            help='write the JSON results to this file')
+        parser.add_argument('--json',
+                            action='store_true',
+                            help='print machine readable results')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['algorithms'] < 1:
+            raise CommandError('--rows and --algorithms must be positive')
+        self.options = options
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0,
+                                           autoclobber=True,
+                                           serialize=False)
+        try:
+            algorithm_ids = [
+                Algorithm.objects.create(classifier=f'Synthetic{index}',
+                                         version='0.0.1',
+                                         status='production',
+                                         created_by='benchmark').pk
+                for index in range(options['algorithms'])
+            ]
+            start = time.perf_counter()
+            fill_requests(options['rows'], algorithm_ids, options['days'],
+                          options['insert_batch_size'])
+            fill_seconds = time.perf_counter() - start
+            self.stderr.write(f"Inserted {options['rows']} rows in "
+                              f"{fill_seconds:.1f} s")
+
+            indexes = PredictionRequest._meta.indexes
+            with connection.schema_editor() as editor:
+                for index in indexes:
+                    editor.remove_index(PredictionRequest, index)
+            results = self.benchmark_queries(algorithm_ids, 'pk_fk_only')
+
+            start = time.perf_counter()
+            with connection.schema_editor() as editor:
+                for index in indexes:
+                    editor.add_index(PredictionRequest, index)
+            index_seconds = time.perf_counter() - start
+            results += self.benchmark_queries(algorithm_ids, 'indexed')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            },
+            'options': {
+                key: options[key]
+                for key in ('rows', 'algorithms', 'days', 'repeat', 'warmup')
+            },
+            'fill_seconds': fill_seconds,
+            'index_seconds': index_seconds,
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f'Indexes built in {index_seconds:.1f} s')
+            self.print_table(results)
+
+    def queries(self, algorithm_ids):
+        now = timezone.now()
+        start = now - timedelta(days=self.options['days'] // 2)
+        window = (start, start + timedelta(days=30))
+        cutoff = now - timedelta(days=365)
+        requests = PredictionRequest.objects
+        return {
+            'algorithm_recent':
+            requests.filter(
+                algorithm_id=algorithm_ids[0]).order_by('-created_at')[:50],
+            'label_window':
+            requests.order_by().filter(prediction='bad',
+                                       created_at__range=window),
+            'recent':
+            requests.order_by('-created_at')[:50],
+            'retention_batch':
+            requests.filter(created_at__lt=cutoff).order_by(
+                'created_at', 'id').values_list('id', flat=True)[:5000],
+        }
+
+    def benchmark_queries(self, algorithm_ids, variant):
+        results = []
+        for name, queryset in self.queries(algorithm_ids).items():
+            if name == 'label_window':
+                run = queryset.count
+            else:
+
+                def run(queryset=queryset):
+                    return list(queryset.all())
+
+            result = measure(run,
+                             repeat=self.options['repeat'],
+                             warmup=self.options['warmup'])
+            result.update(query=name,
+                          indexes=variant,
+                          plan=queryset.explain())
+            results.append(result)
+        return results
+
+    def print_table(self, results):
+        timings = {(r['query'], r['indexes']): r for r in results}
+        self.stdout.write(f"{'query':<18}{'pk/fk p50 (ms)':>16}"
+                          f"{'indexed p50 (ms)':>18}{'speedup':>10}")
+        for name in dict.fromkeys(r['query'] for r in results):
+            before = timings[(name, 'pk_fk_only')]['p50_ms']
+            after = timings[(name, 'indexed')]['p50_ms']
+            self.stdout.write(f"{name:<18}{before:>16.3f}{after:>18.3f}"
+                              f"{before / after:>10.1f}")
+        self.stdout.write('')
+        for result in results:
+            plan = ' | '.join(result['plan'].splitlines())
+            self.stdout.write(f"{result['query']:<18}{result['indexes']:<12}"
+                              f"{plan}")
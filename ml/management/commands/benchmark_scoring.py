@@ -0,0 +1,300 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Latency benchmark of the predict path
+
+Scores a sample applicant with every classifier of the model manifest and
+with the statistical methods, and reports p50/p95/p99 latency and throughput
+of each stage of a prediction: registry and ORM lookup, preprocessing,
+predict_proba, postprocessing, audit save, and the full HTTP round-trip
+through the Django test client. Batched scoring is measured as well.
+
+The benchmark runs against a throwaway test database. Use
+``--settings=server.benchmark_settings`` to run it on SQLite.
+"""
+
+import json
+import platform
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+import sklearn
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from api.audit import record_predictions
+from api.models import Algorithm, PredictionRequest
+from ml.benchmark import compare, measure, sample_applicant
+from ml.registry import read_manifest, registry
+from stats.statistical_scoring import reference_model, stat_score
+
+STAT_METHODS = ('linearRegression', 'polynomialRegression', 'manova')
+
+STAT_SAMPLE = {
+    "age": 22,
+    "sex": "female",
+    "job": 2,
+    "housing": "own",
+    "credit_amount": 5951,
+    "duration": 48,
+    "purpose": "radio/TV"
+}
+
+
+def audit(data, prediction, algorithm_id):
+    """
+    Save the audit trail of a prediction the way the predict view does
+    """
+    label = prediction.get('label', prediction.get('method'))
+    return record_predictions([
+        PredictionRequest(input=json.dumps(data),
+                          response=prediction,
+                          prediction=label,
+                          feedback="",
+                          algorithm_id=algorithm_id)
+    ])
+
+
+def post(client, url, data):
+    response = client.post(url,
+                           json.dumps(data),
+                           content_type='application/json')
+    if response.status_code != 200:
+        raise ValueError(f'{url} returned {response.status_code}: '
+                         f'{response.content[:200]}')
+    return response
+
+
+class Command(BaseCommand):
+    help = ('Measure latency and throughput of each stage of the predict '
+            'path for every classifier and statistical method')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manifest',
+                            default=settings.SCORECARD_MODEL_MANIFEST)
+        parser.add_argument('--datasets',
+                            nargs='*',
+                            help='only benchmark these datasets')
+        parser.add_argument('--classifiers',
+                            nargs='*',
+                            help='only benchmark these classifiers')
+        parser.add_argument('--repeat',
+                            type=int,
+                            default=200,
+                            help='timed calls per single-row stage')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--batch-repeat',
+                            type=int,
+                            default=10,
+                            help='timed calls per batch stage')
+        parser.add_argument('--no-stats',
+                            action='store_true',
+                            help='skip the statistical methods')
+        parser.add_argument('--output',
+                            help='write the JSON results to this file')
+        parser.add_argument('--compare',
+                            help='JSON results of a previous run to compare '
+                            'the p50 latencies with')
+        parser.add_argument('--json',
+                            action='store_true',
+                            help='print machine readable results')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.client = Client()
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0,
+                                           autoclobber=True,
+                                           serialize=False)
+        try:
+            registry.load_manifest(options['manifest'])
+            results = self.benchmark_classifiers()
+            if not options['no_stats']:
+                results += self.benchmark_stats()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'sklearn': sklearn.__version__,
+                'database': connection.vendor,
+                'audit_mode': settings.SCORECARD_AUDIT_MODE,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            },
+            'options': {
+                key: options[key]
+                for key in ('repeat', 'warmup', 'batch_size', 'batch_repeat')
+            },
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_table(results)
+
+        if options['compare']:
+            with open(options['compare']) as previous:
+                baseline = json.load(previous)['results']
+            self.print_comparison(compare(baseline, results))
+
+    def selected(self, entry):
+        datasets = self.options['datasets']
+        classifiers = self.options['classifiers']
+        return ((not datasets or entry['dataset'] in datasets)
+                and (not classifiers or entry['classifier'] in classifiers))
+
+    def run(self, results, name, dataset, stage, func, rows=1):
+        """
+        Measure one stage and append its result, recording the error
+        instead when the stage cannot run
+        """
+        batch = rows > 1
+        repeat = self.options['batch_repeat' if batch else 'repeat']
+        warmup = min(self.options['warmup'], 1) if batch else \
+            self.options['warmup']
+        result = {'classifier': name, 'dataset': dataset, 'stage': stage}
+        try:
+            result.update(measure(func, repeat, warmup, rows))
+        except Exception as e:
+            result['error'] = str(e)
+        results.append(result)
+        return 'error' not in result
+
+    def benchmark_classifiers(self):
+        results = []
+        batch_size = self.options['batch_size']
+        manifest = read_manifest(self.options['manifest'])
+        for entry in manifest['algorithms']:
+            if not self.selected(entry):
+                continue
+
+            name, dataset = entry['classifier'], entry['dataset']
+            version, status = str(entry['version']), entry['status']
+            found = registry.lookup(name, version, status, dataset)
+            if found is None:
+                raise CommandError(f'{name} {version} {status} {dataset} '
+                                   'is not registered')
+            algorithm_id, classifier = found
+            classifier.load()
+
+            data = sample_applicant(classifier)
+            row = classifier.encode(data)
+            run = lambda stage, func, rows=1: self.run(
+                results, name, dataset, stage, func, rows)
+
+            run('registry_lookup',
+                lambda: registry.lookup(name, version, status, dataset))
+            run(
+                'orm_lookup', lambda: Algorithm.objects.filter(
+                    classifier=name,
+                    version=version,
+                    status=status,
+                    dataset__name=dataset).first())
+            run('preprocessing', lambda: classifier.encode(data))
+            if not run('predict_proba', lambda: classifier.predict(row)):
+                # the remaining stages need probabilities
+                continue
+
+            probabilities = classifier.predict(row)[0]
+            prediction = classifier.postprocessing(probabilities)
+            run('postprocessing',
+                lambda: classifier.postprocessing(probabilities))
+            run('audit_save', lambda: audit(data, prediction, algorithm_id))
+
+            query = urlencode({
+                'classifier': name,
+                'dataset': dataset,
+                'version': version,
+                'status': status
+            })
+            run(
+                'http',
+                lambda: post(self.client, f'/api/v1/algorithms/predict?'
+                             f'{query}', data))
+
+            records = [dict(data) for _ in range(batch_size)]
+            run('batch', lambda: classifier.compute_batch(records),
+                batch_size)
+            run(
+                'http_batch',
+                lambda: post(self.client, f'/api/v1/algorithms/predict_batch'
+                             f'?{query}', records), batch_size)
+
+        return results
+
+    def benchmark_stats(self):
+        results = []
+        reference = reference_model()
+        for method in STAT_METHODS:
+            if self.options['classifiers'] and \
+                    method not in self.options['classifiers']:
+                continue
+
+            run = lambda stage, func: self.run(results, method, 'german',
+                                               stage, func)
+            run('preprocessing', lambda: reference.transform(STAT_SAMPLE))
+            run('score', lambda: stat_score(STAT_SAMPLE, method))
+            prediction = stat_score(STAT_SAMPLE, method)
+            run('audit_save', lambda: audit(STAT_SAMPLE, prediction, None))
+            run(
+                'http', lambda: post(
+                    self.client, f'/api/v1/algorithms/predict?classifier='
+                    f'{method}', STAT_SAMPLE))
+
+        return results
+
+    def print_table(self, results):
+        self.stdout.write(f"{'classifier':<26}{'dataset':<12}{'stage':<17}"
+                          f"{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}"
+                          f"{'rows/s':>12}")
+        for result in results:
+            prefix = (f"{result['classifier']:<26}{result['dataset']:<12}"
+                      f"{result['stage']:<17}")
+            if 'error' in result:
+                self.stdout.write(f"{prefix}error: {result['error'][:60]}")
+                continue
+            self.stdout.write(f"{prefix}{result['p50_ms']:>10.3f}"
+                              f"{result['p95_ms']:>10.3f}"
+                              f"{result['p99_ms']:>10.3f}"
+                              f"{result['throughput']:>12.0f}")
+
+    def print_comparison(self, rows):
+        self.stdout.write('')
+        self.stdout.write(f"{'classifier':<26}{'dataset':<12}{'stage':<17}"
+                          f"{'before p50':>12}{'after p50':>12}{'ratio':>8}")
+        for name, dataset, stage, before, after, ratio in rows:
+            self.stdout.write(f"{name:<26}{dataset:<12}{stage:<17}"
+                              f"{before:>12.3f}{after:>12.3f}{ratio:>8.2f}")
@@ -0,0 +1,323 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Offline training of the model zoo
+
+Builds the label encoders, the categorical column list and every classifier
+of a region from the raw datasets in ``zoo/data``, and writes them as a new
+version under ``zoo/models/<dataset>/<version>`` together with a metrics
+file and a manifest of the version. The version manifest is included in the
+model manifest and its algorithms are registered.
+"""
+
+import json
+import os
+import re
+import time
+
+import joblib
+import yaml
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sklearn.ensemble import (GradientBoostingClassifier,
+                              RandomForestClassifier)
+from sklearn.metrics import (accuracy_score, f1_score, precision_score,
+                             recall_score, roc_auc_score)
+from sklearn.model_selection import (GridSearchCV, StratifiedKFold,
+                                     train_test_split)
+from sklearn.neural_network import MLPClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+from sklearn.svm import SVC
+
+from ml import artifacts
+from ml.datasets import DATASETS, load_dataset
+from ml.registry import read_manifest, registry
+
+
+def classifiers():
+    """
+    Return the estimator and parameter grid of every zoo classifier, keyed
+    by the ml.classifiers class serving it. The grids are the ones the zoo
+    models were originally searched with.
+
+    The serving path feeds label encoded but otherwise raw features to the
+    models, so scale sensitive models get their scaler as a pipeline step.
+    SVC fits Platt scaling so that it can serve probabilities.
+    """
+    return {
+        'RandomForestClassifier': ('rf_classifier.joblib',
+                                   RandomForestClassifier(), {
+                                       'n_estimators': [20, 30, 40],
+                                       'random_state': [0]
+                                   }),
+        'SVC': ('svc_classifier.joblib',
+                Pipeline([('scaler', StandardScaler()),
+                          ('svc', SVC(probability=True, random_state=0))]),
+                {
+                    'svc__kernel': ['poly'],
+                    'svc__degree': [2, 3, 4]
+                }),
+        'MLP': ('mlp_classifier.joblib',
+                Pipeline([('scaler', StandardScaler()),
+                          ('mlp', MLPClassifier())]), {
+                              'mlp__hidden_layer_sizes': [(100, 50, 10)],
+                              'mlp__max_iter': [500],
+                              'mlp__activation': ['relu'],
+                              'mlp__solver': ['adam'],
+                              'mlp__random_state': [1]
+                          }),
+        'GradientBoostClassifier': ('gb_classifier.joblib',
+                                    GradientBoostingClassifier(), {
+                                        'n_estimators': [100, 200, 50],
+                                        'random_state': [0],
+                                        'learning_rate': [1.0],
+                                        'max_depth': [1, 2, 3]
+                                    }),
+    }
+
+
+def test_metrics(model, x_test, y_test):
+    predicted = model.predict(x_test)
+    metrics = {
+        'accuracy': accuracy_score(y_test, predicted),
+        'f1_score': f1_score(y_test, predicted, average='macro'),
+        'recall_score': recall_score(y_test, predicted, average='macro'),
+        'precision_score': precision_score(y_test,
+                                           predicted,
+                                           average='macro'),
+    }
+    metrics['roc_auc'] = roc_auc_score(y_test,
+                                       model.predict_proba(x_test)[:, 1])
+    return {key: float(value) for key, value in metrics.items()}
+
+
+def include_manifest(manifest_path, included):
+    """
+    Append a manifest to the include list of another one
+
+    The file is edited as text so its comments and layout are kept, which
+    requires ``include`` to be the last section when it already exists.
+    """
+    with open(manifest_path, newline='') as manifest_file:
+        text = manifest_file.read()
+    newline = '\r\n' if '\r\n' in text else '\n'
+
+    sections = re.findall(r'^(\w+):', text, flags=re.MULTILINE)
+    if 'include' in sections and sections[-1] != 'include':
+        raise CommandError(f'Add {included} to the include section of '
+                           f'{manifest_path}, it is not the last section')
+
+    if not text.endswith(newline):
+        text += newline
+    if 'include' not in sections:
+        text += (f'{newline}# Versions trained by manage.py train_scorecards'
+                 f'{newline}include:{newline}')
+    text += f'  - {included}{newline}'
+
+    with open(manifest_path, 'w', newline='') as manifest_file:
+        manifest_file.write(text)
+
+
+class Command(BaseCommand):
+    help = ('Train every classifier of the given regions from the raw '
+            'datasets and register the result as a new algorithm version')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--datasets',
+                            nargs='*',
+                            default=[
+                                'german', 'australian', 'japanese', 'polish',
+                                'tanzania'
+                            ],
+                            choices=list(DATASETS))
+        parser.add_argument('--classifiers',
+                            nargs='*',
+                            help='only train these classifiers')
+        parser.add_argument('--model-version',
+                            default=time.strftime('%Y.%m.%d'),
+                            help='version of the trained algorithms')
+        parser.add_argument('--status', default='testing')
+        parser.add_argument('--n-jobs',
+                            type=int,
+                            default=-1,
+                            help='cores used by the hyper-parameter search, '
+                            '-1 for all of them')
+        parser.add_argument('--folds',
+                            type=int,
+                            default=5,
+                            help='cross-validation folds')
+        parser.add_argument('--test-size', type=float, default=0.2)
+        parser.add_argument('--output-dir', default=artifacts.ZOO_DIR)
+        parser.add_argument('--manifest',
+                            default=settings.SCORECARD_MODEL_MANIFEST)
+        parser.add_argument('--no-register',
+                            action='store_true',
+                            help='only write the artifacts and metrics')
+
+    def handle(self, *args, **options):
+        selected = classifiers()
+        if options['classifiers']:
+            unknown = set(options['classifiers']) - set(selected)
+            if unknown:
+                raise CommandError(f'Unknown classifiers {sorted(unknown)}')
+            selected = {
+                name: value
+                for name, value in selected.items()
+                if name in options['classifiers']
+            }
+
+        for dataset in options['datasets']:
+            try:
+                features, target, categorical = load_dataset(dataset)
+            except (FileNotFoundError, ImportError) as e:
+                self.stderr.write(f'Skipping {dataset}: {str(e)}')
+                continue
+
+            version_manifest = self.train(dataset, features, target,
+                                          categorical, selected, options)
+            if not options['no_register']:
+                self.register(version_manifest, options['manifest'])
+
+    def train(self, dataset, features, target, categorical, selected,
+              options):
+        """
+        Train the selected classifiers of a dataset and write the version
+        directory, returning the path of its manifest
+        """
+        version = options['model_version']
+        directory = os.path.join(options['output_dir'], dataset, version)
+        if os.path.exists(os.path.join(directory, 'manifest.yml')):
+            raise CommandError(f'{directory} already holds a trained version')
+        os.makedirs(directory, exist_ok=True)
+
+        label_encoders = {}
+        encoded = features.copy()
+        for column in categorical:
+            label_encoders[column] = LabelEncoder().fit(features[column])
+            encoded[column] = label_encoders[column].transform(
+                features[column])
+
+        x_train, x_test, y_train, y_test = train_test_split(
+            encoded.values,
+            target,
+            test_size=options['test_size'],
+            stratify=target,
+            random_state=0)
+
+        paths = {
+            'categorical': os.path.join(directory, 'categorical.joblib'),
+            'label_encoders': os.path.join(directory,
+                                           'label_encoders.joblib'),
+        }
+        joblib.dump(categorical, paths['categorical'], compress=True)
+        joblib.dump(label_encoders, paths['label_encoders'], compress=True)
+
+        metrics = {
+            'dataset': dataset,
+            'version': version,
+            'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'n_train': len(y_train),
+            'n_test': len(y_test),
+            'folds': options['folds'],
+            'n_jobs': options['n_jobs'],
+            'classifiers': {},
+        }
+        algorithms = []
+        for name, (artifact, estimator, grid) in selected.items():
+            self.stdout.write(f'Training {name} on {dataset}')
+            search = GridSearchCV(estimator,
+                                  grid,
+                                  scoring='roc_auc',
+                                  n_jobs=options['n_jobs'],
+                                  cv=StratifiedKFold(options['folds'],
+                                                     shuffle=True,
+                                                     random_state=0))
+            start = time.perf_counter()
+            search.fit(x_train, y_train)
+            elapsed = time.perf_counter() - start
+
+            path = os.path.join(directory, artifact)
+            joblib.dump(search, path, compress=True)
+
+            metrics['classifiers'][name] = {
+                'best_params': {
+                    key: str(value)
+                    for key, value in search.best_params_.items()
+                },
+                'cv_roc_auc': float(search.best_score_),
+                'test': test_metrics(search, x_test, y_test),
+                'fit_seconds': elapsed,
+            }
+            algorithms.append({
+                'classifier': name,
+                'dataset': dataset,
+                'version': version,
+                'status': options['status'],
+                'description': f'{name} trained by train_scorecards',
+                'created_by': 'train_scorecards',
+                'backend': 'compiled',
+                'artifacts': {
+                    'model': os.path.relpath(path, artifacts.ZOO_DIR),
+                    **{
+                        kind: os.path.relpath(value, artifacts.ZOO_DIR)
+                        for kind, value in paths.items()
+                    },
+                },
+            })
+
+        with open(os.path.join(directory, 'metrics.json'), 'w') as output:
+            json.dump(metrics, output, indent=2)
+
+        manifest_path = os.path.join(directory, 'manifest.yml')
+        with open(manifest_path, 'w') as output:
+            output.write('# Written by manage.py train_scorecards\n')
+            yaml.safe_dump(
+                {
+                    'datasets': {
+                        dataset: {
+                            'region': DATASETS[dataset]['region'],
+                            'features': list(features.columns),
+                        }
+                    },
+                    'algorithms': algorithms,
+                },
+                output,
+                sort_keys=False)
+
+        for name, result in metrics['classifiers'].items():
+            self.stdout.write(f"{dataset:<12}{name:<26}"
+                              f"cv auc {result['cv_roc_auc']:.3f}  "
+                              f"test auc {result['test']['roc_auc']:.3f}  "
+                              f"{result['fit_seconds']:.1f}s")
+        return manifest_path
+
+    def register(self, version_manifest, manifest_path):
+        """
+        Include a version manifest in the model manifest and register its
+        algorithms
+        """
+        included = os.path.relpath(version_manifest,
+                                   os.path.dirname(manifest_path))
+        include_manifest(manifest_path, included)
+        read_manifest(manifest_path)
+
+        registry.load_manifest(version_manifest)
+        self.stdout.write(f'Registered {included}')
@@ -0,0 +1,386 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Scoring metrics
+
+Request and error counters and latency histograms kept in process memory
+and rendered in the Prometheus text exposition format by the ``/metrics``
+view. Each stage of a prediction is timed separately:
+
+``lookup``
+    resolving the algorithm of a request
+``preprocessing``
+    validating and encoding the applicant data
+``inference``
+    the model's predict_proba, or the statistical method
+``postprocessing``
+    turning probabilities into the response
+``audit``
+    recording the prediction requests
+
+Views decorated with ``tracked`` count and time their requests; stages
+timed while a tracked request runs are labelled with its algorithm unless
+given one. Registered algorithms are labelled ``classifier/dataset/version``
+and the statistical methods by their name. Every server process keeps its
+own values, so the scraper sees one series per worker.
+SCORECARD_METRICS['ENABLED'] turns the timers into no-ops and the endpoint
+off.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+# upper bounds in seconds of the latency buckets, as prometheus_client
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNKNOWN = 'unknown'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def enabled() -> bool:
+    return getattr(settings, 'SCORECARD_METRICS', {}).get('ENABLED', True)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(str(value))}"'
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    Labelled metric values of one process
+
+    Warning: This class should not be used directly. Use derived classes
+    instead.
+
+    Parameters
+    ----------
+    name: str
+        metric name
+    documentation: str
+        help text
+    labelnames: tuple
+        names of the labels every value is keyed by, in order
+    """
+    kind: str = None
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def render(self) -> List[str]:
+        """
+        Return the exposition lines of the metric
+        """
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.extend(self._samples(labels, value))
+        return lines
+
+    def _samples(self, labels, value) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Monotonic count per label values
+    """
+    kind = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def _samples(self, labels, value):
+        return [
+            f'{self.name}{_format_labels(self.labelnames, labels)} '
+            f'{_format_value(value)}'
+        ]
+
+
+class Histogram(Metric):
+    """
+    Distribution of observations per label values
+
+    Only the bucket an observation falls in is incremented, the cumulative
+    counts of the exposition format are summed when rendering.
+
+    Parameters
+    ----------
+    buckets: tuple
+        increasing upper bounds of the buckets, +Inf is implied
+    """
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # bucket counts, then the sum of the observations
+                state = self._values[labels] = [0] * (len(self.buckets) +
+                                                      1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def count(self, *labels: str) -> int:
+        state = self._values.get(labels)
+        return sum(state[:-1]) if state is not None else 0
+
+    def _samples(self, labels, state):
+        names = self.labelnames + ('le', )
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'), ), state):
+            total += count
+            bucket = _format_labels(names, labels + (_format_value(bound), ))
+            lines.append(f'{self.name}_bucket{bucket} {total}')
+        labels = _format_labels(self.labelnames, labels)
+        lines.append(f'{self.name}_sum{labels} {_format_value(state[-1])}')
+        lines.append(f'{self.name}_count{labels} {total}')
+        return lines
+
+
+REQUESTS = Counter('scorecard_requests_total',
+                   'Scoring requests handled, by endpoint and algorithm',
+                   ('endpoint', 'algorithm'))
+ERRORS = Counter('scorecard_errors_total',
+                 'Scoring requests that failed, by endpoint and algorithm',
+                 ('endpoint', 'algorithm'))
+REQUEST_SECONDS = Histogram(
+    'scorecard_request_duration_seconds',
+    'Time spent handling scoring requests, by endpoint and algorithm',
+    ('endpoint', 'algorithm'))
+STAGE_SECONDS = Histogram(
+    'scorecard_stage_duration_seconds',
+    'Time spent in each scoring stage, by stage and algorithm',
+    ('stage', 'algorithm'))
+
+PREDICTION_CACHE = Counter(
+    'scorecard_prediction_cache_total',
+    'Prediction cache lookups, by result: hit or miss', ('result', ))
+
+METRICS = [
+    REQUESTS, ERRORS, REQUEST_SECONDS, STAGE_SECONDS, PREDICTION_CACHE
+]
+
+
+# the request being tracked in the current thread or task
+_current = contextvars.ContextVar('scorecard_request', default=None)
+
+
+class _Disabled(object):
+    """
+    Stand-in for a stage timer when metrics are disabled
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_DISABLED = _Disabled()
+
+
+class _Request(object):
+    __slots__ = ('endpoint', 'algorithm')
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.algorithm = UNKNOWN
+
+
+class _Stage(object):
+    __slots__ = ('stage', 'algorithm', 'start')
+
+    def __init__(self, stage: str, algorithm: Optional[str]):
+        self.stage = stage
+        self.algorithm = algorithm
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.stage,
+                              self.algorithm or current_algorithm())
+        return False
+
+
+def stage(name: str, algorithm: str = None):
+    """
+    Time a scoring stage into STAGE_SECONDS
+
+    Used as a context manager. Without an algorithm the label is the one of
+    the tracked request when the block exits.
+    """
+    if not enabled():
+        return _DISABLED
+    return _Stage(name, algorithm)
+
+
+def algorithm_label(classifier: str, dataset: str, version: str) -> str:
+    """
+    Return the label of a registered algorithm
+
+    Built from the registry key rather than the query parameters, so the
+    label values stay as few as the registered algorithms.
+    """
+    return f'{classifier}/{dataset}/{version}'
+
+
+def current_algorithm() -> str:
+    request = _current.get()
+    return request.algorithm if request is not None else UNKNOWN
+
+
+def set_algorithm(algorithm: str):
+    """
+    Label the tracked request with its algorithm
+
+    Call it once the algorithm is resolved, so that arbitrary query
+    parameters never become label values.
+    """
+    request = _current.get()
+    if request is not None:
+        request.algorithm = algorithm
+
+
+def _finish(request: _Request, start: float, failed: bool):
+    labels = (request.endpoint, request.algorithm)
+    REQUEST_SECONDS.observe(time.perf_counter() - start, *labels)
+    REQUESTS.inc(*labels)
+    if failed:
+        ERRORS.inc(*labels)
+
+
+def tracked(endpoint: str):
+    """
+    Decorate a view to count and time its requests
+
+    Requests that raise or return an error status count as errors. Works
+    for plain and async views and for viewset actions.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+
+            @functools.wraps(view)
+            async def wrapper(*args, **kwargs):
+                if not enabled():
+                    return await view(*args, **kwargs)
+                request = _Request(endpoint)
+                token = _current.set(request)
+                start = time.perf_counter()
+                failed = True
+                try:
+                    response = await view(*args, **kwargs)
+                    failed = getattr(response, 'status_code', 200) >= 400
+                    return response
+                finally:
+                    _current.reset(token)
+                    _finish(request, start, failed)
+        else:
+
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not enabled():
+                    return view(*args, **kwargs)
+                request = _Request(endpoint)
+                token = _current.set(request)
+                start = time.perf_counter()
+                failed = True
+                try:
+                    response = view(*args, **kwargs)
+                    failed = getattr(response, 'status_code', 200) >= 400
+                    return response
+                finally:
+                    _current.reset(token)
+                    _finish(request, start, failed)
+
+        return wrapper
+
+    return decorator
+
+
+def render() -> str:
+    """
+    Return every metric in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def clear():
+    """
+    Reset every metric of this process
+    """
+    for metric in METRICS:
+        metric.clear()
@@ -23,10 +23,32 @@ ML registry
 Registry object that will keep information about available algorithms and corresponding endpoints.
 """
 
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import yaml
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+
+from ml import artifacts, cache, classifiers, metrics
 from ml.classifiers import Classifier
-from typing import Dict
 from api.models import Algorithm, Dataset
 
+log = logging.getLogger(__name__)
+
+MANIFEST_PATH = os.path.join(artifacts.ZOO_DIR, 'manifest.yml')
+
+# preferred status when an algorithm is registered under several of them
+STATUS_PRIORITY = ('production', 'ab_testing', 'staging', 'testing')
+
+# bumped in the SCORECARD_REGISTRY cache whenever an algorithm row changes
+GENERATION_KEY = 'scorecard:registry:generation'
+
 
 def has_empty_values(data: dict):
 
@@ -37,10 +59,59 @@ def has_empty_values(data: dict):
     return False
 
 
+def registry_options() -> Dict[str, Any]:
+    options = {'CACHE_ALIAS': 'default', 'CHECK_INTERVAL': 1.0, 'MAX_AGE': 60}
+    options.update(getattr(settings, 'SCORECARD_REGISTRY', {}))
+    return options
+
+
+def same_model(previous: Classifier, classifier: Classifier) -> bool:
+    """
+    Whether two registrations of an algorithm serve the same model, i.e.
+    the same classifier or one loading the same zoo artifacts
+    """
+    if previous is classifier:
+        return True
+    return (classifier.reloadable and previous.reloadable
+            and type(previous) is type(classifier)
+            and previous.zone == classifier.zone
+            and previous.artifact_paths == classifier.artifact_paths
+            and previous.backend == classifier.backend)
+
+
 class MLRegistry:
+    """
+    Algorithms served by the API, resolved without database queries
+
+    The index is kept in line with the algorithm rows saved or deleted by
+    this process. Other processes bump a generation counter in the
+    SCORECARD_REGISTRY cache; the counter is read at most every
+    CHECK_INTERVAL seconds and the index is synced with the database when
+    it changed, or at the latest every MAX_AGE seconds when the cache is not
+    shared between the processes.
+    """
+    # negative lookups kept until the next invalidation
+    max_misses = 10000
+
     def __init__(self):
         self.classifiers: Dict[int, Classifier] = {}
 
+        # algorithm ids keyed by (classifier, version, status, dataset), so
+        # that resolving a model does not need a database query
+        self.index: Dict[Tuple[str, str, str, str], int] = {}
+        # metrics labels keyed by algorithm id
+        self.labels: Dict[int, str] = {}
+        # keys that matched no registered algorithm
+        self.misses: Set[Tuple[str, str, str, str]] = set()
+
+        self.generation = None
+        self._checked_at = None
+        self._synced_at = None
+
+        # manifest algorithms not yet matched with their database rows
+        self.pending: List[Dict[str, Any]] = []
+        self._lock = threading.RLock()
+
     def add_algorithms(self,
                        attrs=[{
                            "classifier": None,
@@ -67,6 +138,424 @@ class MLRegistry:
                     status=attr['status'],
                     dataset=dataset,
                     created_by=attr['created_by'])
+                previous = self.classifiers.get(algorithm.id)
                 self.classifiers[algorithm.id] = attr['classifier']
+                self.index_algorithm(algorithm)
+                if previous is not None and not same_model(
+                        previous, attr['classifier']):
+                    # predictions of the previously registered model are
+                    # stale
+                    cache.invalidate(algorithm.id)
+
+        return self.classifiers
+
+    def index_algorithm(self, algorithm: Algorithm):
+        """
+        (Re)index a registered algorithm under its current attributes
+
+        Parameters
+        ----------
+        algorithm: Algorithm
+            the algorithm row, its dataset_id holds the dataset name
+        """
+        with self._lock:
+            self.index = {
+                key: value
+                for key, value in self.index.items() if value != algorithm.id
+            }
+            self.misses = set()
+            if algorithm.id in self.classifiers:
+                key = (algorithm.classifier, algorithm.version,
+                       algorithm.status, algorithm.dataset_id)
+                self.index[key] = algorithm.id
+                self.labels[algorithm.id] = metrics.algorithm_label(
+                    algorithm.classifier, algorithm.dataset_id,
+                    algorithm.version)
+
+    def forget_algorithm(self, algorithm_id: int):
+        """
+        Drop the index entries of an algorithm
+
+        Parameters
+        ----------
+        algorithm_id: int
+            primary key of the algorithm
+        """
+        with self._lock:
+            self.index = {
+                key: value
+                for key, value in self.index.items() if value != algorithm_id
+            }
+            self.labels.pop(algorithm_id, None)
+            self.misses = set()
+
+    def invalidate(self):
+        """
+        Tell the other processes that the algorithm rows changed
+
+        They sync their index with the database the next time they check
+        the generation counter.
+        """
+        cache = caches[registry_options()['CACHE_ALIAS']]
+        # add is atomic, so only one worker initializes the counter
+        cache.add(GENERATION_KEY, 0, timeout=None)
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            # evicted between add and incr
+            cache.set(GENERATION_KEY, 1, timeout=None)
+
+    def refresh_due(self) -> bool:
+        """
+        Whether the generation counter is due to be checked
+        """
+        if self._checked_at is None:
+            return True
+        return (time.monotonic() - self._checked_at >=
+                registry_options()['CHECK_INTERVAL'])
+
+    def refresh(self):
+        """
+        Sync the index with the database when another process changed the
+        algorithm rows, or when it is older than MAX_AGE seconds
+        """
+        if not self.refresh_due():
+            return
+        options = registry_options()
+        now = time.monotonic()
+        self._checked_at = now
+        generation = caches[options['CACHE_ALIAS']].get(GENERATION_KEY, 0)
+        if (generation == self.generation
+                and now - self._synced_at < options['MAX_AGE']):
+            return
+
+        algorithms = Algorithm.objects.filter(id__in=list(self.classifiers))
+        index = {}
+        labels = {}
+        for algorithm in algorithms:
+            index[(algorithm.classifier, algorithm.version, algorithm.status,
+                   algorithm.dataset_id)] = algorithm.id
+            labels[algorithm.id] = metrics.algorithm_label(
+                algorithm.classifier, algorithm.dataset_id, algorithm.version)
+        with self._lock:
+            self.index = index
+            self.labels = labels
+            self.misses = set()
+            self.generation = generation
+            self._synced_at = now
+
+    def lookup(self, classifier: str, version: str, status: str,
+               dataset: str) -> Optional[Tuple[int, Classifier]]:
+        """
+        Resolve a registered algorithm
+
+        Served from the in-process index; the database is only queried when
+        the index has no entry, e.g. for an algorithm created by another
+        process. Keys that match no algorithm are remembered until the next
+        invalidation, so unknown algorithms do not query the database on
+        every request either.
+
+        Parameters
+        ----------
+        classifier: str
+            classifier class name
+        version: str
+            algorithm version
+        status: str
+            algorithm status
+        dataset: str
+            dataset name
+
+        Returns
+        -------
+        tuple
+            (algorithm id, classifier), or None if no registered algorithm
+            matches
+        """
+        self.ensure_ready()
+        self.refresh()
+
+        key = (classifier, version, status, dataset)
+        algorithm_id = self.index.get(key)
+        if algorithm_id is None:
+            if key in self.misses:
+                return None
+            algorithm = Algorithm.objects.filter(classifier=classifier,
+                                                 version=version,
+                                                 status=status,
+                                                 dataset__name=dataset,
+                                                 id__in=list(
+                                                     self.classifiers)).first()
+            if algorithm is None:
+                with self._lock:
+                    if len(self.misses) >= self.max_misses:
+                        self.misses = set()
+                    self.misses.add(key)
+                return None
+            self.index_algorithm(algorithm)
+            algorithm_id = algorithm.id
+
+        return algorithm_id, self.classifiers[algorithm_id]
+
+    def lookup_indexed(self, classifier: str, version: str, status: str,
+                       dataset: str) -> Optional[Tuple[int, Classifier]]:
+        """
+        Resolve a registered algorithm from the in-process index only
+
+        Returns None whenever lookup would need the database, so that async
+        callers only have to leave the event loop in that case.
+        """
+        if self.pending or self.refresh_due():
+            return None
+        algorithm_id = self.index.get((classifier, version, status, dataset))
+        if algorithm_id is None:
+            return None
+        return algorithm_id, self.classifiers[algorithm_id]
+
+    def label(self, algorithm_id: int) -> str:
+        """
+        Return the metrics label of a registered algorithm
+
+        Parameters
+        ----------
+        algorithm_id: int
+            primary key of the algorithm
+        """
+        return self.labels.get(algorithm_id, metrics.UNKNOWN)
+
+    def lookup_dataset(
+            self,
+            dataset: str,
+            version: str,
+            classifiers: List[str] = None,
+            status: str = None) -> Dict[str, Tuple[int, Classifier]]:
+        """
+        Resolve the registered algorithms of a dataset and version
+
+        Parameters
+        ----------
+        dataset: str
+            dataset name
+        version: str
+            algorithm version
+        classifiers: list
+            classifier class names, all registered ones when None
+        status: str
+            algorithm status. When None the algorithm with the first status
+            in STATUS_PRIORITY is taken, then any other status.
+
+        Returns
+        -------
+        dict
+            (algorithm id, classifier) keyed by classifier name, without the
+            classifiers that are not registered
+        """
+        self.ensure_ready()
+        self.refresh()
+
+        def priority(key):
+            if key[2] in STATUS_PRIORITY:
+                return STATUS_PRIORITY.index(key[2])
+            return len(STATUS_PRIORITY)
+
+        resolved = {}
+        for key in sorted(self.index, key=priority):
+            name, key_version, key_status, key_dataset = key
+            if (key_dataset != dataset or key_version != version
+                    or (status is not None and key_status != status)
+                    or (classifiers is not None and name not in classifiers)
+                    or name in resolved):
+                continue
+            algorithm_id = self.index[key]
+            resolved[name] = (algorithm_id, self.classifiers[algorithm_id])
+        return resolved
+
+    def load_manifest(self,
+                      path: str = MANIFEST_PATH,
+                      datasets: List[str] = None,
+                      preload: bool = False,
+                      n_jobs: int = None,
+                      sync: bool = True):
+        """
+        Register every algorithm listed in a model manifest
+
+        Classifiers are registered without touching their artifacts, so
+        startup cost does not grow with the size of the zoo.
+
+        Parameters
+        ----------
+        path: str
+            path of the manifest file
+        datasets: list
+            only register algorithms of these datasets, all when None
+        preload: bool
+            deserialize the artifacts right away instead of on first use
+        n_jobs: int
+            number of threads used to preload artifacts
+        sync: bool
+            match the algorithms with their database rows now. When False
+            they are kept pending until ensure_ready is called, so the
+            manifest can be read before the database is available.
+        """
+        manifest = read_manifest(path)
+
+        attrs = []
+        for entry in manifest['algorithms']:
+            if datasets is not None and entry['dataset'] not in datasets:
+                continue
+            attrs.append(manifest_algorithm(manifest, entry))
+
+        if sync:
+            self.add_algorithms(attrs)
+        else:
+            with self._lock:
+                self.pending.extend(attrs)
+
+        if preload:
+            self.preload([attr['classifier'] for attr in attrs], n_jobs)
+
+        return self.classifiers
+
+    def ensure_ready(self):
+        """
+        Register pending manifest algorithms on first use
+
+        Safe to call on every request: once the pending algorithms are
+        registered this is a single attribute check.
+        """
+        if not self.pending:
+            return self.classifiers
+
+        with self._lock:
+            if self.pending:
+                self.add_algorithms(self.pending)
+                self.pending = []
+
+        return self.classifiers
+
+    def preload(self, selected: List[Classifier] = None, n_jobs: int = None):
+        """
+        Deserialize the artifacts of registered classifiers
+
+        Classifiers load their artifacts on first prediction by default;
+        call this to pay the cost up front instead. Artifacts are shared
+        between classifiers, so each file is still only loaded once.
+
+        Parameters
+        ----------
+        selected: list
+            classifiers to load, all registered and pending classifiers
+            when None
+        n_jobs: int
+            number of loader threads, sequential when None or 1
+        """
+        if selected is None:
+            selected = list(self.classifiers.values())
+            selected += [attr['classifier'] for attr in self.pending]
+
+        if n_jobs is None or n_jobs == 1:
+            for classifier in selected:
+                classifier.load()
+        else:
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                list(executor.map(lambda c: c.load(), selected))
 
         return self.classifiers
+
+
+def sync_manifest(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate receiver creating the Dataset and Algorithm rows of the
+    configured manifest, so that workers only need to read them.
+    """
+    path = getattr(settings, 'SCORECARD_MODEL_MANIFEST', None)
+    if not path or using != DEFAULT_DB_ALIAS:
+        return
+
+    try:
+        MLRegistry().load_manifest(path)
+    except DatabaseError as e:
+        log.warning(f"Could not register the model manifest; {str(e)}")
+
+
+def algorithm_saved(sender, instance, **kwargs):
+    """
+    post_save receiver keeping the registry index in line with the database
+    """
+    registry.index_algorithm(instance)
+    registry.invalidate()
+
+
+def algorithm_deleted(sender, instance, **kwargs):
+    """
+    post_delete receiver dropping deleted algorithms from the registry index
+    """
+    registry.forget_algorithm(instance.id)
+    registry.invalidate()
+    cache.invalidate(instance.id)
+
+
+# Registry shared by the API views, filled from SCORECARD_MODEL_MANIFEST when
+# the api application is ready
+registry = MLRegistry()
+
+
+def read_manifest(path: str = MANIFEST_PATH) -> Dict[str, Any]:
+    """
+    Read a model manifest
+
+    Manifests listed under ``include``, relative to the manifest, are read as
+    well: their algorithms are added and their datasets are added unless
+    already defined.
+
+    Parameters
+    ----------
+    path: str
+        path of the manifest YAML file
+    """
+    with open(path) as manifest_file:
+        manifest = yaml.safe_load(manifest_file)
+    manifest.setdefault('datasets', {})
+    manifest.setdefault('algorithms', [])
+
+    for include in manifest.get('include') or []:
+        included = read_manifest(os.path.join(os.path.dirname(path), include))
+        for name, dataset in included['datasets'].items():
+            manifest['datasets'].setdefault(name, dataset)
+        manifest['algorithms'].extend(included['algorithms'])
+
+    return manifest
+
+
+def manifest_algorithm(manifest: Dict[str, Any], entry: Dict[str, Any]):
+    """
+    Build the add_algorithms attributes of a manifest algorithm entry
+
+    Parameters
+    ----------
+    manifest: dict
+        the parsed manifest
+    entry: dict
+        one item of the manifest algorithms list
+    """
+    dataset = manifest['datasets'][entry['dataset']]
+    classifier_class = getattr(classifiers, entry['classifier'])
+    if not (isinstance(classifier_class, type)
+            and issubclass(classifier_class, Classifier)):
+        raise ValueError(f"{entry['classifier']} is not a classifier")
+
+    classifier = classifier_class(zone=entry['dataset'],
+                                  features=entry.get('features',
+                                                     dataset['features']),
+                                  artifact_paths=entry.get('artifacts'),
+                                  backend=entry.get('backend', 'sklearn'))
+
+    return {
+        'classifier': classifier,
+        'description': entry.get('description', ''),
+        'status': entry['status'],
+        'version': str(entry['version']),
+        'dataset': entry['dataset'],
+        'region': dataset['region'],
+        'created_by': entry.get('created_by', ''),
+    }
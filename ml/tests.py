@@ -17,11 +17,28 @@
 # under the License.
 #
 
-from ml.classifiers import GradientBoostClassifier, MLP, RandomForestClassifier, SVC
-from ml.registry import MLRegistry
-from django.test import TestCase
+from ml import artifacts, backends, benchmark, dataloader, ensemble
+from ml.cache import (DjangoPredictionCache, LocalPredictionCache,
+                      input_digest)
+from ml.classifiers import EncodingPlan, GradientBoostClassifier, MLP, RandomForestClassifier, SVC
+from ml.registry import MLRegistry, read_manifest, registry
+from api.models import Algorithm
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 
 import inspect
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from sklearn import svm
+from sklearn.datasets import make_classification
+from sklearn.ensemble import GradientBoostingClassifier
 
 test_data = {
     "age": 22,
@@ -65,6 +82,504 @@ class MLTests(TestCase):
         self.assertTrue('label' in response)
         self.assertEqual(expected_output, response['label'])
 
+    def test_batch_prediction(self):
+        my_alg = RandomForestClassifier()
+        records = [
+            test_data,
+            dict(test_data, housing="castle"),
+            dict(test_data, age=None),
+            dict(test_data, sex="male", purpose="car"),
+        ]
+        response = my_alg.compute_batch(records, chunk_size=2)
+        self.assertEqual(len(response), len(records))
+        self.assertEqual(expected_output, response[0]['label'])
+        self.assertTrue('error' in response[1])
+        self.assertTrue('error' in response[2])
+
+        # every record is checked against the classifier, not the first one
+        extra, missing = my_alg.compute_batch([
+            dict(test_data, income=1000),
+            {key: value
+             for key, value in test_data.items() if key != 'housing'},
+        ])
+        self.assertEqual(extra['error'], 'expected 7 fields, got 8')
+        self.assertEqual(missing['error'], 'missing fields: housing')
+        # a bad number only fails its own record
+        for batch_alg in [my_alg, MLP()]:
+            scores = batch_alg.compute_batch(
+                [test_data, dict(test_data, age='abc'), test_data])
+            self.assertEqual(scores[1]['error'], 'age must be a number: abc')
+            self.assertEqual(scores[0], scores[2])
+            self.assertIn('probability', scores[0])
+        shuffled = dict(reversed(list(test_data.items())))
+        self.assertEqual(
+            my_alg.compute_batch([shuffled, test_data])[0]['probability'],
+            my_alg.compute_prediction(dict(shuffled))['probability'])
+
+        # batch scores must match the single row path
+        for record, prediction in zip(records, response):
+            if 'error' in prediction:
+                continue
+            single = my_alg.compute_prediction(dict(record))
+            self.assertAlmostEqual(single['probability'],
+                                   prediction['probability'])
+
+    def test_encoding_plan_parity(self):
+        records = [
+            test_data,
+            dict(test_data, sex="male", housing="free", purpose="car"),
+            dict(test_data, age=67, job=0, purpose="vacation/others"),
+        ]
+        for my_alg in [RandomForestClassifier(), MLP(),
+                       GradientBoostClassifier()]:
+            for record in records:
+                frame = my_alg.preprocessing(dict(record))
+                row = my_alg.encode(dict(record))
+                self.assertTrue(np.array_equal(frame.values, row))
+                self.assertTrue(
+                    np.array_equal(my_alg.predict(frame),
+                                   my_alg.predict(row)))
+
+    def test_encoding_plan_cache(self):
+        my_alg = RandomForestClassifier()
+        my_alg.encode(dict(test_data))
+        # keys that do not fit the model are rejected before a plan is built
+        for record in [dict(test_data, income=1000), {'sex': 'male'}]:
+            with self.assertRaises(ValueError):
+                my_alg.encode(record)
+        self.assertEqual(len(my_alg._encoding_plans), 1)
+
+        # one plan per column order, the least recently used are dropped
+        keys = list(test_data)
+        with mock.patch('ml.classifiers.MAX_ENCODING_PLANS', 3):
+            for shift in range(1, len(keys)):
+                order = keys[shift:] + keys[:shift]
+                my_alg.encode({key: test_data[key] for key in order})
+                my_alg.encode(dict(test_data))
+        self.assertEqual(len(my_alg._encoding_plans), 3)
+        self.assertEqual(list(my_alg._encoding_plans)[-1], tuple(keys))
+
+        features = RandomForestClassifier(features=keys)
+        features.encode(dict(reversed(list(test_data.items()))))
+        self.assertEqual(list(features._encoding_plans), [tuple(keys)])
+
+    def test_lazy_artifacts(self):
+        # start from an empty artifact store, whatever the other tests loaded
+        store = mock.patch.dict(artifacts._artifacts, clear=True)
+        store.start()
+        self.addCleanup(store.stop)
+
+        my_alg = RandomForestClassifier(zone='australian')
+        path = artifacts.artifact_path('australian', 'rf_classifier.joblib')
+        self.assertFalse(my_alg.loaded)
+        self.assertFalse(artifacts.is_loaded(path))
+
+        my_alg.load()
+        self.assertTrue(my_alg.loaded)
+        self.assertTrue(artifacts.is_loaded(path))
+
+        # encoders are deserialized once and shared between classifiers
+        other = MLP(zone='australian')
+        self.assertIs(my_alg.label_encoders, other.label_encoders)
+        self.assertIs(my_alg.model, RandomForestClassifier(zone='australian').model)
+
+    def test_benchmark_helpers(self):
+        classifier = RandomForestClassifier(features=list(test_data))
+        sample = benchmark.sample_applicant(classifier)
+        self.assertEqual(list(sample), list(test_data))
+        classifier.compute_prediction(sample)
+
+        result = benchmark.measure(lambda: classifier.encode(sample),
+                                   repeat=20,
+                                   warmup=1,
+                                   rows=2)
+        self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+        self.assertEqual(result['rows'], 2)
+        self.assertGreater(result['throughput'], 0)
+
+        before = dict(result, classifier='rf', dataset='german', stage='x')
+        after = dict(before, p50_ms=before['p50_ms'] * 2)
+        errored = dict(before, stage='y', error='failed')
+        del errored['p50_ms']
+        rows = benchmark.compare([before, errored], [after, errored])
+        self.assertEqual(len(rows), 1)
+        self.assertAlmostEqual(rows[0][-1], 2)
+
+    # keep the artifacts loaded here out of the process wide store, so other
+    # tests still see them unloaded
+    @mock.patch.dict(artifacts._artifacts)
+    def test_compiled_tree_backend(self):
+        registry = MLRegistry()
+        registry.load_manifest(sync=False)
+        trees = [
+            attrs['classifier'] for attrs in registry.pending
+            if isinstance(attrs['classifier'], (RandomForestClassifier,
+                                                GradientBoostClassifier))
+        ]
+        self.assertEqual(len(trees), 10)
+        # manifest entries opt in one by one
+        self.assertEqual(
+            [c.zone for c in trees if c.backend == 'compiled'], ['german'])
+
+        for classifier in trees:
+            engine = backends.compile_model(classifier.model, 'compiled')
+            self.assertIsInstance(engine, backends.TreeEnsemble)
+            rows = benchmark.synthetic_rows(
+                classifier, engine.max_rows,
+                engine.feature_ranges(len(classifier.features)))
+            np.testing.assert_allclose(engine.predict_proba(rows),
+                                       classifier.model.predict_proba(rows),
+                                       rtol=0,
+                                       atol=1e-12)
+            np.testing.assert_allclose(engine.predict_proba(rows[:1]),
+                                       classifier.model.predict_proba(
+                                           rows[:1]),
+                                       rtol=0,
+                                       atol=1e-12)
+
+        with self.assertRaises(ValueError):
+            backends.compile_model(object(), 'compiled')
+
+        X, y = make_classification(200, 6, random_state=0)
+        for loss in ['deviance', 'exponential']:
+            boosting = GradientBoostingClassifier(loss=loss, n_estimators=20,
+                                                  random_state=0).fit(X, y)
+            engine = backends.compile_model(boosting, 'compiled')
+            np.testing.assert_allclose(engine.predict_proba(X[:50]),
+                                       boosting.predict_proba(X[:50]),
+                                       rtol=0,
+                                       atol=1e-12)
+        boosting.loss = 'hinge'
+        with self.assertRaises(ValueError):
+            backends.compile_model(boosting, 'compiled')
+
+    @mock.patch.dict(artifacts._artifacts)
+    def test_compiled_kernel_backends(self):
+        registry = MLRegistry()
+        registry.load_manifest(datasets=['german', 'polish'], sync=False)
+        for attrs in registry.pending:
+            classifier = attrs['classifier']
+            if not isinstance(classifier, (MLP, SVC)):
+                continue
+
+            # operators opt in to the compiled backend
+            self.assertEqual(classifier.backend, 'sklearn')
+            fitted = backends.estimator(classifier.model)
+            engine = backends.compile_model(classifier.model, 'compiled')
+            rows = benchmark.synthetic_rows(classifier, 500)
+            if isinstance(classifier, MLP):
+                self.assertIsInstance(engine, backends.NeuralNetwork)
+                for batch in (rows[:1], rows):
+                    np.testing.assert_allclose(
+                        engine.predict_proba(batch),
+                        fitted.predict_proba(batch),
+                        rtol=0,
+                        atol=1e-12)
+            else:
+                # the zoo SVCs were fitted without probability estimates
+                self.assertIsInstance(engine, backends.KernelMachine)
+                np.testing.assert_allclose(
+                    engine.decision_function(rows),
+                    fitted.decision_function(rows),
+                    rtol=1e-9)
+                with self.assertRaises(AttributeError):
+                    engine.predict_proba(rows)
+
+        X, y = make_classification(200, 6, random_state=0)
+        for kernel in ['linear', 'poly', 'rbf', 'sigmoid']:
+            svc = svm.SVC(kernel=kernel, probability=True,
+                          random_state=0).fit(X, y)
+            engine = backends.compile_model(svc, 'compiled')
+            np.testing.assert_allclose(engine.predict_proba(X),
+                                       svc.predict_proba(X),
+                                       rtol=0,
+                                       atol=1e-9)
+
+    def test_score_classifiers(self):
+        names = ['RandomForestClassifier', 'GradientBoostClassifier', 'SVC']
+        selected = {
+            name: classifier
+            for name, (_, classifier) in registry.lookup_dataset(
+                'german', '0.0.1', names).items()
+        }
+        self.assertEqual(set(selected), set(names))
+
+        encode = EncodingPlan.encode
+        with mock.patch.object(EncodingPlan,
+                               'encode',
+                               autospec=True,
+                               side_effect=encode) as encode_mock:
+            with ThreadPoolExecutor(2) as executor:
+                scores = ensemble.score_classifiers(selected, test_data,
+                                                    executor)
+        # the german classifiers share one input schema
+        self.assertEqual(encode_mock.call_count, 1)
+
+        for name in ['RandomForestClassifier', 'GradientBoostClassifier']:
+            self.assertEqual(
+                scores[name],
+                selected[name].compute_prediction(dict(test_data)))
+        # the zoo SVC was fitted without probability estimates
+        self.assertIn('error', scores['SVC'])
+
+        result = ensemble.ensemble(scores, {
+            'SVC': 1.0,
+            'GradientBoostClassifier': 2.0
+        })
+        self.assertEqual(result['weights'], {'GradientBoostClassifier': 1.0})
+        self.assertEqual(result['probability'],
+                         scores['GradientBoostClassifier']['probability'])
+        with self.assertRaises(ValueError):
+            ensemble.ensemble(scores, {'SVC': 1.0})
+
+    @unittest.skipIf(sys.version_info < (3, 8),
+                     'multiprocessing.shared_memory needs Python 3.8')
+    def test_process_executor(self):
+        from ml import executors
+
+        options = {
+            'ENABLED': True,
+            'WORKERS': 2,
+            # a few rows per block, so batches span several round trips
+            'BUFFER_SIZE': 1024,
+            'MIN_ROWS': 2,
+        }
+        records = [dict(test_data, age=age) for age in range(20, 80)]
+        local = RandomForestClassifier(zone='german')
+        expected = local.compute_batch(records)
+
+        with override_settings(SCORECARD_INFERENCE_EXECUTOR=options), \
+                mock.patch.object(executors, '_executor', None):
+            try:
+                classifier = RandomForestClassifier(zone='german')
+                self.assertIsInstance(classifier.engine,
+                                      executors.ProcessEngine)
+                self.assertEqual(classifier.compute_batch(records), expected)
+                # single rows are below MIN_ROWS and scored in process
+                self.assertEqual(
+                    classifier.compute_prediction(dict(test_data)),
+                    local.compute_prediction(dict(test_data)))
+
+                # worker errors are raised in the caller
+                svc = SVC(zone='german')
+                for result in svc.compute_batch([test_data, test_data]):
+                    self.assertIn('probability', result['error'])
+
+                # models not read from the zoo stay in process
+                explicit = RandomForestClassifier(model=local.model)
+                self.assertNotIsInstance(explicit.engine,
+                                         executors.ProcessEngine)
+
+                # dead workers are replaced
+                executor = executors.get_process_executor()
+                worker = executor._idle.queue[0]
+                worker.process.kill()
+                worker.process.join()
+                result = classifier.compute_batch(records[:2])[0]
+                self.assertIn('inference worker exited', result['error'])
+                self.assertEqual(classifier.compute_batch(records), expected)
+
+                # workers that cannot be replaced are started by a later call
+                worker = executor._idle.queue[0]
+                worker.process.kill()
+                worker.process.join()
+                with mock.patch.object(executors, '_Worker',
+                                       side_effect=OSError('no memory')):
+                    classifier.compute_batch(records[:2])
+                self.assertEqual(executor._missing, 1)
+                self.assertEqual(classifier.compute_batch(records), expected)
+                self.assertEqual(executor._missing, 0)
+                self.assertEqual(executor._idle.qsize(), executor.workers)
+            finally:
+                if executors._executor is not None:
+                    executors._executor.shutdown()
+
+    def test_prediction_cache(self):
+        features = list(test_data)
+        self.assertEqual(input_digest(test_data, features),
+                         input_digest(dict(test_data, age=22.0, extra=1),
+                                      features))
+        self.assertNotEqual(input_digest(test_data, features),
+                            input_digest(dict(test_data, age=23), features))
+
+        classifier = RandomForestClassifier(features=features)
+        for cache in [
+                LocalPredictionCache(max_size=1, ttl=60),
+                DjangoPredictionCache(ttl=60)
+        ]:
+            with mock.patch.object(classifier,
+                                   'compute_prediction',
+                                   wraps=classifier.compute_prediction) as m:
+                first = cache.get_or_compute(1, classifier, test_data)
+                first['request_id'] = 1
+                second = cache.get_or_compute(1, classifier, test_data)
+                self.assertEqual(m.call_count, 1)
+                self.assertNotIn('request_id', second)
+                self.assertEqual(second['label'], expected_output)
+
+                # other algorithms and re-registered models miss
+                cache.get_or_compute(2, classifier, test_data)
+                cache.invalidate(1)
+                cache.get_or_compute(1, classifier, test_data)
+                self.assertEqual(m.call_count, 3)
+            self.assertEqual(cache.stats()['hits'], 1)
+            self.assertEqual(cache.stats()['misses'], 3)
+
+        # least recently used entries are evicted and entries expire
+        cache = LocalPredictionCache(max_size=1, ttl=60)
+        cache.get_or_compute(1, classifier, test_data)
+        cache.get_or_compute(1, classifier, dict(test_data, age=30))
+        self.assertEqual(cache.stats()['size'], 1)
+        cache.get_or_compute(1, classifier, dict(test_data, age=30))
+        self.assertEqual(cache.hits, 1)
+        with mock.patch('ml.cache.time.monotonic', return_value=1e12):
+            cache.get_or_compute(1, classifier, dict(test_data, age=30))
+        self.assertEqual(cache.hits, 1)
+
+    def test_dataloader(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        arff_path = os.path.join(directory, 'sample.arff')
+        with open(arff_path, 'w') as arff_file:
+            arff_file.write("% comment\n@relation sample\n"
+                            "@attribute 'Attr 1' numeric\n"
+                            "@attribute class {0,1}\n@data\n"
+                            "1.5,0\n?,1\n% comment\n-2,0\n")
+        csv_path = os.path.join(directory, 'sample.csv')
+        with open(csv_path, 'w') as csv_file:
+            csv_file.write(",age,housing,note\n0,20,own,\n1,35,rent,\n"
+                           "2,41,own,\n3,,free,x\n")
+
+        cache = {'DIRECTORY': os.path.join(directory, 'cache')}
+        with override_settings(SCORECARD_DATASET_CACHE=cache):
+            dataset = dataloader.open_dataset(arff_path)
+            frame = dataset.to_frame()
+            self.assertEqual(list(frame.columns), ['Attr 1', 'class'])
+            self.assertEqual(list(frame['class']), ['0', '1', '0'])
+            self.assertEqual(list(frame['class'].cat.categories), ['0', '1'])
+            np.testing.assert_array_equal(frame['Attr 1'], [1.5, np.nan, -2])
+
+            # chunks of two rows: age becomes float once a value is missing
+            # and note is text although its first chunk is empty
+            dataset = dataloader.open_dataset(csv_path,
+                                              chunksize=2,
+                                              index_col=0)
+            self.assertIsInstance(dataset.column('age'), np.memmap)
+            self.assertEqual(dataset.dtypes['age'], np.float64)
+            self.assertEqual(list(dataset.dtypes['housing'].categories),
+                             ['own', 'rent', 'free'])
+            frame = dataset.to_frame()
+            self.assertEqual(list(frame['housing']),
+                             ['own', 'rent', 'own', 'free'])
+            self.assertEqual(frame['note'].isna().sum(), 3)
+            self.assertEqual(
+                [len(chunk) for chunk in dataset.iter_frames(3)], [3, 1])
+            self.assertEqual(list(dataset.to_frame(['age'], 1, 3)['age']),
+                             [35, 41])
+
+            # later opens read the cache until the source changes
+            with mock.patch.object(dataloader, 'read_chunks') as read_chunks:
+                dataloader.open_dataset(csv_path, chunksize=2, index_col=0)
+            read_chunks.assert_not_called()
+            self.assertEqual(len(os.listdir(cache['DIRECTORY'])), 2)
+            with open(csv_path, 'a') as csv_file:
+                csv_file.write("4,50,own,\n")
+            self.assertEqual(
+                len(dataloader.open_dataset(csv_path, index_col=0)), 5)
+
+            uncached = dataloader.open_dataset(csv_path,
+                                               cache=False,
+                                               index_col=0)
+            self.assertEqual(list(uncached.to_frame()['age'])[-1], 50)
+
+        # datasets are read without cache when it cannot be written
+        unwritable = {'DIRECTORY': os.path.join(csv_path, 'cache')}
+        with override_settings(SCORECARD_DATASET_CACHE=unwritable):
+            dataset = dataloader.open_dataset(csv_path, index_col=0)
+            self.assertNotIsInstance(dataset.column('age'), np.memmap)
+            self.assertEqual(len(dataset), 5)
+
+        write_columns = dataloader.write_columns
+
+        def disk_full(chunks, directory):
+            if directory.startswith(full['DIRECTORY']):
+                raise OSError('disk full')
+            return write_columns(chunks, directory)
+
+        full = {'DIRECTORY': os.path.join(directory, 'full')}
+        with override_settings(SCORECARD_DATASET_CACHE=full), \
+                mock.patch.object(dataloader, 'write_columns',
+                                  side_effect=disk_full):
+            dataset = dataloader.open_dataset(csv_path, index_col=0)
+            self.assertEqual(len(dataset), 5)
+        self.assertEqual(os.listdir(full['DIRECTORY']), [])
+
+    @mock.patch.dict(artifacts._artifacts)
+    def test_train_scorecards(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        manifest = os.path.join(directory, 'manifest.yml')
+        shutil.copy(os.path.join(artifacts.ZOO_DIR, 'manifest.yml'), manifest)
+
+        call_command('train_scorecards',
+                     datasets=['german'],
+                     classifiers=['RandomForestClassifier', 'SVC'],
+                     model_version='test',
+                     n_jobs=1,
+                     folds=2,
+                     output_dir=directory,
+                     manifest=manifest,
+                     stdout=open(os.devnull, 'w'))
+
+        version = os.path.join(directory, 'german', 'test')
+        with open(os.path.join(version, 'metrics.json')) as metrics_file:
+            metrics = json.load(metrics_file)
+        self.assertEqual(set(metrics['classifiers']),
+                         {'RandomForestClassifier', 'SVC'})
+        self.assertGreater(
+            metrics['classifiers']['SVC']['test']['roc_auc'], 0.5)
+
+        # the version is included in the manifest and registered
+        versions = [(a['classifier'], a['version'])
+                    for a in read_manifest(manifest)['algorithms']]
+        self.assertIn(('SVC', 'test'), versions)
+        self.assertEqual(
+            Algorithm.objects.filter(version='test',
+                                     status='testing').count(), 2)
+
+        algorithm_id, classifier = registry.lookup('SVC', 'test', 'testing',
+                                                   'german')
+        self.assertIsInstance(classifier.engine, backends.Standardized)
+        prediction = classifier.compute_prediction(test_data)
+        self.assertIn(prediction['label'], ['good', 'bad'])
+        rows = benchmark.synthetic_rows(classifier, 100)
+        np.testing.assert_allclose(classifier.predict(rows),
+                                   classifier.model.predict_proba(rows),
+                                   atol=1e-9)
+
+    def test_manifest_registry(self):
+        registry = MLRegistry()
+        registry.load_manifest()
+        self.assertEqual(len(registry.classifiers), 20)
+        self.assertFalse(
+            any(c.loaded for c in registry.classifiers.values()))
+
+        australian = open('zoo/data/australian.dat').readline().split()
+        japanese = open('zoo/data/japanese/japanese.data').readline()
+        samples = {
+            'german': test_data,
+            'australian': dict(zip(map(str, range(14)), australian)),
+            'japanese': dict(zip(map(str, range(15)), japanese.split(','))),
+        }
+        for classifier in registry.classifiers.values():
+            if not isinstance(classifier, RandomForestClassifier):
+                continue
+            sample = samples.get(classifier.zone,
+                                 dict.fromkeys(classifier.features, 0))
+            response = classifier.compute_prediction(sample)
+            self.assertTrue('label' in response)
+
     def test_registry(self):
         registry = MLRegistry()
         self.assertEqual(len(registry.classifiers), 0)
@@ -75,7 +590,7 @@ class MLTests(TestCase):
             'description': "Random Forest with simple pre and post-processing",
             'status': "production",
             'version': "0.0.1",
-            'dataset': 'German',
+            'dataset': 'german',
             'region': 'Germany',
             'created_by': "xurror"
         }
@@ -84,3 +599,81 @@ class MLTests(TestCase):
         registry.add_algorithms([rf_algo])
         # there should be one endpoint available
         self.assertEqual(len(registry.classifiers), 1)
+
+        algorithm_id, classifier = registry.lookup('RandomForestClassifier',
+                                                   '0.0.1', 'production',
+                                                   'german')
+        self.assertIs(classifier, rf_algo['classifier'])
+
+        # registering the same model again keeps its cached predictions,
+        # another model drops them
+        with mock.patch('ml.cache.invalidate') as invalidate:
+            registry.add_algorithms([dict(rf_algo)])
+            registry.add_algorithms(
+                [dict(rf_algo, classifier=RandomForestClassifier())])
+            invalidate.assert_not_called()
+            registry.add_algorithms([
+                dict(rf_algo,
+                     classifier=RandomForestClassifier(backend='compiled'))
+            ])
+            invalidate.assert_called_once_with(algorithm_id)
+
+    def test_registry_index_invalidation(self):
+        algorithm_id, _ = registry.lookup('MLP', '0.0.1', 'testing', 'german')
+
+        # saving re-indexes the algorithm under its new status
+        algorithm = Algorithm.objects.get(id=algorithm_id)
+        algorithm.status = 'production'
+        algorithm.save()
+        self.assertIsNone(registry.lookup('MLP', '0.0.1', 'testing',
+                                          'german'))
+        self.assertEqual(
+            registry.lookup('MLP', '0.0.1', 'production', 'german')[0],
+            algorithm_id)
+
+        algorithm.delete()
+        self.assertIsNone(
+            registry.lookup('MLP', '0.0.1', 'production', 'german'))
+
+    @override_settings(SCORECARD_REGISTRY={'CHECK_INTERVAL': 3600})
+    def test_registry_negative_lookup(self):
+        registry.lookup('MLP', '0.0.1', 'testing', 'german')
+        self.assertIsNone(registry.lookup('MLP', '9.9.9', 'testing',
+                                          'german'))
+        # misses are remembered until the next invalidation
+        with self.assertNumQueries(0):
+            self.assertIsNone(
+                registry.lookup('MLP', '9.9.9', 'testing', 'german'))
+
+        algorithm_id, _ = registry.lookup('MLP', '0.0.1', 'testing', 'german')
+        Algorithm.objects.filter(id=algorithm_id).update(version='9.9.9')
+        registry.index_algorithm(Algorithm.objects.get(id=algorithm_id))
+        self.assertEqual(
+            registry.lookup('MLP', '9.9.9', 'testing', 'german')[0],
+            algorithm_id)
+
+    @override_settings(SCORECARD_REGISTRY={'CHECK_INTERVAL': 0})
+    def test_registry_invalidation_across_processes(self):
+        algorithm_id, _ = registry.lookup('MLP', '0.0.1', 'testing', 'german')
+
+        # another process changes the row: no signal reaches this one, the
+        # generation counter tells it to sync
+        Algorithm.objects.filter(id=algorithm_id).update(status='production')
+        self.assertIsNotNone(
+            registry.lookup('MLP', '0.0.1', 'testing', 'german'))
+        registry.invalidate()
+        self.assertIsNone(registry.lookup('MLP', '0.0.1', 'testing',
+                                          'german'))
+        self.assertEqual(
+            registry.lookup('MLP', '0.0.1', 'production', 'german')[0],
+            algorithm_id)
+
+        # without a shared cache the index is synced after MAX_AGE seconds
+        Algorithm.objects.filter(id=algorithm_id).update(status='staging')
+        with override_settings(SCORECARD_REGISTRY={
+                'CHECK_INTERVAL': 0,
+                'MAX_AGE': 0
+        }):
+            self.assertEqual(
+                registry.lookup('MLP', '0.0.1', 'staging', 'german')[0],
+                algorithm_id)
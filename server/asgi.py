@@ -0,0 +1,57 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+ASGI config for scorecardapp project.
+
+It exposes the ASGI callable as a module-level variable named
+``application`` for ASGI servers such as uvicorn:
+
+    uvicorn server.asgi:application --workers 4
+
+The async predict view (api/v1/async/algorithms/predict) keeps many scoring
+calls in flight per worker. The DRF views still work but run one at a time
+per worker, in Django's thread for synchronous code.
+
+For more information, visit
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import gc
+import os
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+application = get_asgi_application()
+
+from api.drift import preload_baselines  # noqa: E402
+from ml.registry import registry  # noqa: E402
+
+# read and bin the training datasets of the drift monitor now rather than
+# in the first scored requests
+preload_baselines()
+
+if settings.SCORECARD_PRELOAD_MODELS:
+    # see server.wsgi, the same applies to ASGI servers that load the
+    # application before forking their workers
+    registry.preload()
+    gc.freeze()
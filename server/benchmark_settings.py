@@ -0,0 +1,34 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Settings for the benchmark commands
+
+Runs on SQLite so benchmarks do not need a MySQL server, and only logs
+warnings so console logging does not end up in the timings.
+
+    python manage.py benchmark_scoring --settings=server.benchmark_settings
+"""
+
+from server.settings import *  # noqa: F401,F403
+from server.settings import DATABASES, LOGGING
+
+DATABASES = dict(DATABASES, default=DATABASES['sqlite3'])
+
+LOGGING = dict(LOGGING, root=dict(LOGGING['root'], level='WARNING'))
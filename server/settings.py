@@ -31,6 +31,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 
 import os
 import posixpath
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -69,6 +70,7 @@ INSTALLED_APPS = [
     'django.contrib.sites',
     'django.contrib.staticfiles',
     'rest_framework',
+    'django_filters',
     'drf_spectacular',
     'corsheaders',
 ]
@@ -107,6 +109,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'server.wsgi.application'
+ASGI_APPLICATION = 'server.asgi.application'
+
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 DATABASES = {
@@ -154,6 +158,10 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = posixpath.join(*(BASE_DIR.split(os.path.sep) + ['static']))
 
+# Uploaded scoring job files and their results
+MEDIA_ROOT = os.environ.get('SCORECARD_MEDIA_ROOT',
+                            os.path.join(BASE_DIR, 'media'))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny'
@@ -178,6 +186,165 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:8000"
 ]
 
+# Model registry
+# Manifest of the algorithms served by the API
+SCORECARD_MODEL_MANIFEST = os.path.join(BASE_DIR, 'zoo', 'models',
+                                        'manifest.yml')
+
+# Algorithms are resolved from an in-process index. Saving or deleting an
+# algorithm bumps a generation counter in the CACHE_ALIAS cache; every process
+# reads it at most every CHECK_INTERVAL seconds and reloads its index from the
+# database when it changed. With a cache that is not shared between the
+# processes, such as the default LocMemCache, changes made by another process
+# are picked up after MAX_AGE seconds at the latest.
+SCORECARD_REGISTRY = {
+    'CACHE_ALIAS': 'default',
+    'CHECK_INTERVAL': 1.0,
+    'MAX_AGE': 60,
+}
+
+# Load every model artifact when server.wsgi is imported. With a pre-forking
+# server that imports the application before forking (gunicorn --preload,
+# uwsgi without --lazy-apps) the models are loaded once in the master process
+# and the workers share them copy-on-write.
+SCORECARD_PRELOAD_MODELS = os.environ.get('SCORECARD_PRELOAD_MODELS',
+                                          'False').lower() in ('1', 'true')
+
+# Prediction audit trail
+# 'sync' saves every PredictionRequest before responding. 'async' queues them
+# in memory and a background thread writes them in bulk; predict then returns
+# a null request_id and the request is identified by request_uuid.
+SCORECARD_AUDIT_MODE = os.environ.get('SCORECARD_AUDIT_MODE', 'sync')
+
+SCORECARD_AUDIT_WRITER = {
+    'MAX_QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'PUT_TIMEOUT': 0.5,
+}
+
+# Prediction cache
+# Caches predictions per algorithm and normalized input. The 'local' backend
+# keeps a bounded LRU in each process; the 'django' backend stores them in the
+# CACHE_ALIAS cache of CACHES, e.g. a FileBasedCache shared by the workers of
+# a host. Entries expire after TTL seconds and are invalidated when their
+# algorithm is registered again.
+SCORECARD_PREDICTION_CACHE = {
+    'ENABLED': os.environ.get('SCORECARD_PREDICTION_CACHE',
+                              'False').lower() in ('1', 'true'),
+    'BACKEND': os.environ.get('SCORECARD_PREDICTION_CACHE_BACKEND', 'local'),
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'CACHE_ALIAS': 'default',
+}
+
+# Columnar copies of the raw datasets in zoo/data, written on first use to
+# DIRECTORY, the system temporary directory by default. Datasets are read
+# without cache when DIRECTORY cannot be written.
+SCORECARD_DATASET_CACHE = {
+    'ENABLED': os.environ.get('SCORECARD_DATASET_CACHE',
+                              'True').lower() in ('1', 'true'),
+    'DIRECTORY': os.environ.get(
+        'SCORECARD_DATASET_CACHE_DIR',
+        os.path.join(tempfile.gettempdir(), 'scorecard', 'datasets')),
+    'CHUNK_SIZE': 50000,
+}
+
+# Async predict view (api/v1/async/algorithms/predict, served by server.asgi)
+# Scoring runs on INFERENCE_THREADS threads per worker. Requests beyond
+# MAX_PENDING running or waiting scores get a 503 instead of queueing.
+SCORECARD_ASYNC = {
+    'INFERENCE_THREADS': int(
+        os.environ.get('SCORECARD_INFERENCE_THREADS', 4)),
+    'MAX_PENDING': int(os.environ.get('SCORECARD_MAX_PENDING', 1024)),
+}
+
+# Scoring metrics (ml.metrics), served on /metrics
+# Request and error counters and per-stage latency histograms, kept by each
+# process. Disabling them skips the timers and turns the endpoint off.
+SCORECARD_METRICS = {
+    'ENABLED': os.environ.get('SCORECARD_METRICS',
+                              'True').lower() in ('1', 'true'),
+}
+
+# Inference process pool (ml.executors)
+# When enabled, classifiers loaded from the zoo run predict_proba in WORKERS
+# long-lived processes, fed through shared memory blocks of BUFFER_SIZE
+# bytes, instead of the threads of the calling process. Inputs of fewer than
+# MIN_ROWS rows are scored in process.
+SCORECARD_INFERENCE_EXECUTOR = {
+    'ENABLED': os.environ.get('SCORECARD_INFERENCE_EXECUTOR',
+                              'False').lower() in ('1', 'true'),
+    'WORKERS': int(
+        os.environ.get('SCORECARD_INFERENCE_WORKERS', os.cpu_count() or 1)),
+    'BUFFER_SIZE': 4 * 2**20,
+    'MIN_ROWS': int(os.environ.get('SCORECARD_INFERENCE_MIN_ROWS', 1)),
+    'START_METHOD': 'spawn',
+}
+
+# Multi-model scoring
+# Threads that run the classifiers of an algorithms/compare call concurrently,
+# 0 or 1 to run them one after the other in the request thread.
+SCORECARD_ENSEMBLE = {
+    'THREADS': int(os.environ.get('SCORECARD_ENSEMBLE_THREADS', 4)),
+}
+
+# Bulk scoring jobs
+# Run by `manage.py run_scoring_jobs`, which scores CHUNK_SIZE rows at a time
+# in a pool of WORKERS processes, checkpointing after every chunk. The worker
+# refreshes the heartbeat of its job every HEARTBEAT_INTERVAL seconds, also
+# while a chunk is scored; running jobs without a heartbeat for STALE_AFTER
+# seconds are queued again and their former worker stops writing to them.
+SCORECARD_SCORING_JOBS = {
+    'WORKERS': int(
+        os.environ.get('SCORECARD_SCORING_WORKERS', os.cpu_count() or 1)),
+    'CHUNK_SIZE': 10000,
+    'POLL_INTERVAL': 2.0,
+    'HEARTBEAT_INTERVAL': 30,
+    'STALE_AFTER': 300,
+}
+
+# Prediction audit trail retention
+# `manage.py archive_requests` moves PredictionRequest rows older than DAYS
+# days into gzip compressed JSON Lines files in DIRECTORY, BATCH_SIZE rows
+# at a time.
+SCORECARD_RETENTION = {
+    'DAYS': int(os.environ.get('SCORECARD_RETENTION_DAYS', 365)),
+    'DIRECTORY': os.environ.get('SCORECARD_ARCHIVE_DIR',
+                                os.path.join(BASE_DIR, 'archive')),
+    'BATCH_SIZE': 5000,
+}
+
+# Streaming export of the prediction audit trail (api/v1/requests/export and
+# `manage.py export_requests`), reading CHUNK_SIZE rows at a time.
+SCORECARD_EXPORT = {
+    'CHUNK_SIZE': 2000,
+    'COMPRESS_LEVEL': 6,
+}
+
+# Bulk feedback (api/v1/requests/feedback): at most MAX_ITEMS outcomes per
+# call, written and summarized BATCH_SIZE requests per transaction.
+SCORECARD_FEEDBACK = {
+    'BATCH_SIZE': 1000,
+    'MAX_ITEMS': 10000,
+}
+
+# Feature drift monitor (api.drift)
+# Applicants of the prediction requests are counted in BINS quantile bins of
+# the training data of their algorithm and flushed to the database every
+# FLUSH_INTERVAL seconds. A feature is in warning or alert when its PSI
+# reaches PSI_WARNING or PSI_ALERT over at least MIN_OBSERVATIONS applicants.
+SCORECARD_DRIFT = {
+    'ENABLED': os.environ.get('SCORECARD_DRIFT',
+                              'True').lower() in ('1', 'true'),
+    'BINS': 10,
+    'FLUSH_INTERVAL': float(os.environ.get('SCORECARD_DRIFT_FLUSH_INTERVAL',
+                                           10)),
+    'MIN_OBSERVATIONS': 100,
+    'PSI_WARNING': 0.1,
+    'PSI_ALERT': 0.25,
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
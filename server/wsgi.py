@@ -35,18 +35,12 @@ For more information, visit
 https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
 """
 
-import logging
+import gc
 import os
-import sys
-import joblib
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
-from ml.registry import MLRegistry
-from ml.classifiers import GradientBoostClassifier, MLP, RandomForestClassifier, SVC
-
-log = logging.getLogger(__name__)
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 
 # This application object is used by any WSGI server configured to use this
@@ -54,59 +48,17 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 # setting points here.
 application = get_wsgi_application()
 
-registry = MLRegistry()
+from api.drift import preload_baselines  # noqa: E402
+from ml.registry import registry  # noqa: E402
+
+# read and bin the training datasets of the drift monitor now rather than
+# in the first scored requests
+preload_baselines()
 
-if ('runserver' in sys.argv or 'test' in sys.argv):
-    
-    # create ML registry
-    try:
-        zone = "german"
-        
-        registry.add_algorithms([
-            # Random Forest classifier
-            {'classifier': RandomForestClassifier(model=joblib.load(f'zoo/models/{zone}/rf_classifier.joblib'),
-                                                  categorical=joblib.load(f'zoo/models/{zone}/categorical.joblib'),
-                                                  label_encoders=joblib.load(f'zoo/models/{zone}/label_encoders.joblib')),
-             'description': "Random Forest with simple pre and post-processing",
-             'status': "production",
-             'version': "0.0.1",
-             'dataset': 'german',
-             'region': 'Germany',
-             'created_by': "xurror"},
-            
-            # SVC classifier
-            {'classifier': SVC(model=joblib.load(f'zoo/models/{zone}/svc_classifier.joblib'),
-                               categorical=joblib.load(f'zoo/models/{zone}/categorical.joblib'),
-                               label_encoders=joblib.load(f'zoo/models/{zone}/label_encoders.joblib')),
-             'description': "SVC Classifier with simple pre- and post-processing",
-             'status': "testing",
-             'version': "0.0.1",
-             'dataset': 'german',
-             'region': 'Germany',
-             'created_by': "xurror"},
-            
-            # MLP classifier
-            {'classifier': MLP(model=joblib.load(f'zoo/models/{zone}/mlp_classifier.joblib'),
-                               categorical=joblib.load(f'zoo/models/{zone}/categorical.joblib'),
-                               label_encoders=joblib.load(f'zoo/models/{zone}/label_encoders.joblib')),
-             'description': "MLP Classifier with simple pre- and post-processing",
-             'status': "testing",
-             'version': "0.0.1",
-             'dataset': 'german',
-             'region': 'Germany',
-             'created_by': "xurror"},
-            
-            # Gradient Boost classifier
-            {'classifier': GradientBoostClassifier(model=joblib.load(f'zoo/models/{zone}/gb_classifier.joblib'),
-                                                   categorical=joblib.load(f'zoo/models/{zone}/categorical.joblib'),
-                                                   label_encoders=joblib.load(f'zoo/models/{zone}/label_encoders.joblib')),
-             'description': "Gradient Boost CLassifier with simple pre- and post-processing",
-             'status': "testing",
-             'version': "0.0.1",
-             'dataset': 'german',
-             'region': 'Germany',
-             'created_by': "xurror"}])
-        
-    except Exception as e:
-        log.debug(f"Exception while loading the algorithms to the registry; {str(e)}")
-        exit()
+if settings.SCORECARD_PRELOAD_MODELS:
+    # Runs in the master process of a preloading server, before the workers
+    # are forked. Freezing moves the loaded models out of the collector's
+    # reach so that collections in the workers do not write to, and thereby
+    # copy, the shared pages.
+    registry.preload()
+    gc.freeze()
@@ -18,24 +18,44 @@
 #
 
 import logging
+import os
+import threading
+from functools import lru_cache
 import numpy as np
 import pandas as pd
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import LabelEncoder
 from sklearn.preprocessing import PolynomialFeatures
 from sklearn.pipeline import Pipeline
-from statsmodels.multivariate.manova import MANOVA
 from rest_framework.exceptions import APIException
 
+from ml.dataloader import open_dataset
+
 log = logging.getLogger(__name__)
 
+DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'zoo',
+    'data')
+
+
+def make_regression(model_type):
+    """
+    Return an unfitted regression model for a statistical scoring method
+    """
+    if model_type == 'linearRegression':
+        return LinearRegression()
+    elif model_type == 'polynomialRegression':
+        return Pipeline([('poly', PolynomialFeatures(degree=2)),
+                         ('linear', LinearRegression(fit_intercept=False))])
+    raise ValueError(f"Unknown statistical method {model_type}")
+
 
 def linear_regression(input_data, data):
 
     y = data['risk']
     x = data.drop(columns=['risk'])
 
-    reg = LinearRegression().fit(x, y)
+    reg = make_regression('linearRegression').fit(x, y)
 
     predictions = reg.predict(input_data)
 
@@ -50,9 +70,7 @@ def polynomial_regression(input_data, data):
     y = data['risk']
     x = data.drop(columns=['risk'])
 
-    model = Pipeline([('poly', PolynomialFeatures(degree=2)),
-                      ('linear', LinearRegression(fit_intercept=False))])
-    reg = model.fit(x, y)
+    reg = make_regression('polynomialRegression').fit(x, y)
 
     predictions = reg.predict(input_data)
 
@@ -62,107 +80,63 @@ def polynomial_regression(input_data, data):
     return {"color": color, "probability": probability}
 
 
-def manova(test_row, data, categorical):
-
-    data = data.dropna()
-    data.loc[len(data)] = test_row
-
-    le = LabelEncoder()
-    for val in categorical:
-        data[val] = le.fit_transform(data[val])
-
-    for col in data.columns:
-        if (col not in categorical):
-            data[col] = (data[col] - np.mean(data[col])) / np.std(data[col])
-
-    test_row = data.iloc[len(data) - 1]
-    data.drop([len(data) - 1])
-
-    data_good = data[data[10] == 0]
-    data_bad = data[data[10] == 1]
-
-    x_good = data_good.drop([10, 9], axis=1)
-    y_good = data_good[[9]]
-    x_bad = data_bad.drop([10, 9], axis=1)
-    y_bad = data_bad[[9]]
-
-    man_good = MANOVA(endog=x_good, exog=y_good)
-    man_bad = MANOVA(endog=x_bad, exog=y_bad)
-
-    output_good = man_good.mv_test()
-    output_bad = man_bad.mv_test()
-
-    out_good = np.array(output_good['x0']['stat'])
-    out_bad = np.array(output_bad['x0']['stat'])
-
-    # Wilki's Lambda
-    WL_good = out_good[0][0]
-
-    # Pillai's Trace
-    PT_good = out_good[1][0]
-
-    # Hotelling-Lawley Trace
-    HT_good = out_good[2][0]
-
-    # Roy's Greatest Roots
-    RGR_good = out_good[3][0]
-
-    WL_bad = out_bad[0][0]
-    PT_bad = out_bad[1][0]
-    HT_bad = out_bad[2][0]
-    RGR_bad = out_bad[3][0]
-
-    x = test_row.drop([10, 9])
-    y = test_row[[9]]
-
-    data_test_x = x_good.append(x)
-    data_test_y = y_good.append(y)
-
-    man_test = MANOVA(endog=data_test_x, exog=data_test_y)
-    output_test = man_test.mv_test()
-
-    out_test = np.array(output_test['x0']['stat'])
-
-    # Wilki's Lambda
-    WL_test_good = out_test[0][0]
-
-    # Pillai's Trace
-    PT_test_good = out_test[1][0]
-
-    # Hotelling-Lawley Trace
-    HT_test_good = out_test[2][0]
-
-    # Roy's Greatest Roots
-    RGR_test_good = out_test[3][0]
-
-    data_test_x = x_bad.append(x)
-    data_test_y = y_bad.append(y)
-
-    man_test = MANOVA(endog=data_test_x, exog=data_test_y)
-    output_test = man_test.mv_test()
-
-    out_test = np.array(output_test['x0']['stat'])
-
-    WL_test_bad = out_test[0][0]
-    PT_test_bad = out_test[1][0]
-    HT_test_bad = out_test[2][0]
-    RGR_test_bad = out_test[3][0]
-
-    scorecard = {
-        "method": "MANOVA",
-        "WL_good": WL_good,
-        "WL_test_good": WL_test_good,
-        "WL_bad": WL_bad,
-        "WL_test_bad": WL_test_bad
+class ManovaGroup(object):
+    """
+    Sums of squares and cross products of one risk group for MANOVA scoring
+
+    The MANOVA of the applicant features (endog) on the loan purpose (exog,
+    without intercept) only depends on X'X, X'y and y'y. Keeping them and
+    the inverse of X'X turns adding an applicant to the group into a
+    rank-one (Sherman-Morrison) update instead of a refit.
+
+    Parameters
+    ----------
+    x: numpy.ndarray
+        endog matrix of shape (n_samples, n_features)
+    y: numpy.ndarray
+        exog vector of shape (n_samples,)
+    """
+    def __init__(self, x, y):
+        self.sscp = x.T @ x
+        self.inverse = np.linalg.inv(self.sscp)
+        self.cross = x.T @ y
+        self.yy = y @ y
+
+    def theta(self, x=None, y=None):
+        """
+        Return the non-zero eigenvalue of (E + H)^-1 H
+
+        The hypothesis matrix of a single exog column has rank one, so its
+        only eigenvalue is h' (X'X)^-1 h with h = X'y / sqrt(y'y).
+
+        Parameters
+        ----------
+        x: numpy.ndarray
+            endog row of an applicant to add to the group
+        y: float
+            exog value of the applicant
+        """
+        inverse, cross, yy = self.inverse, self.cross, self.yy
+        if x is not None:
+            ax = inverse @ x
+            inverse = inverse - np.outer(ax, ax) / (1 + x @ ax)
+            cross = cross + y * x
+            yy = yy + y * y
+        return float(cross @ inverse @ cross / yy)
+
+
+def manova_statistics(theta):
+    """
+    Return the MANOVA test statistics of a rank-one hypothesis
+    """
+    root = theta / (1 - theta)
+    return {
+        "wilkis_lambda": 1 - theta,
+        "pillais_trace": theta,
+        "hotelling_tawley": root,
+        "roys_reatest_roots": root
     }
 
-    ret = "WL good : " + str(WL_good) + " WL test good : " + str(WL_test_good) + \
-        "\nWL bad : " + \
-        str(WL_bad) + " WL test bad : " + \
-        str(WL_test_bad)
-
-    return scorecard
-
 
 def rename_df_columns(df):
     dat_dict = df.to_dict()
@@ -204,35 +178,227 @@ def prepare_data(data):
     return data, input_data
 
 
-def stat_score(input_data, model_type):
-    df = pd.read_csv(f'zoo/data/german.csv', index_col=0)
+def load_dataset(name='german'):
+    """
+    Read a reference dataset the way the statistical methods expect it
+    """
+    df = open_dataset(os.path.join(DATA_DIR, f'{name}.csv'),
+                      index_col=0).to_frame()
     dataset = df.drop(columns=['Saving accounts', 'Checking account'])
     dataset = dataset.dropna()
 
     # rename columns(Make them lowercase and snakecase)
-    dataset = rename_df_columns(dataset)
-
-    # Assume input risk is bad
-    input_data['risk'] = 'bad'
-    dataset.loc[len(dataset)] = input_data
+    return rename_df_columns(dataset)
+
+
+class ReferenceModel(object):
+    """
+    Statistical scoring state fitted once per reference dataset
+
+    Holds the label encoders, the standardization statistics and the fitted
+    regressions, so that scoring an applicant is a transform and a predict
+    instead of re-reading and refitting the whole dataset.
+
+    Parameters
+    ----------
+    dataset: DataFrame
+        reference dataset as returned by load_dataset
+    """
+    def __init__(self, dataset):
+        data = dataset.copy()
+        data['job'] = data['job'].astype('int')
+
+        cols = data.columns
+        num_cols = data._get_numeric_data().columns
+        self.categorical = [col for col in cols if col not in num_cols]
+
+        self.encoders = {}
+        for col in self.categorical:
+            self.encoders[col] = LabelEncoder().fit(data[col])
+            data[col] = self.encoders[col].transform(data[col])
+
+        self.mean = {}
+        self.std = {}
+        for col in data.columns:
+            if col not in self.categorical:
+                self.mean[col] = np.mean(data[col])
+                self.std[col] = np.std(data[col])
+                data[col] = (data[col] - self.mean[col]) / self.std[col]
+
+        self.data = data
+        self.columns = [col for col in data.columns if col != 'risk']
+        self.codes = {
+            col: {value: code
+                  for code, value in enumerate(encoder.classes_)}
+            for col, encoder in self.encoders.items()
+        }
+
+        self.endog = [col for col in self.columns if col != 'purpose']
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def transform(self, input_data):
+        """
+        Encode and standardize an applicant with the reference statistics
+
+        Parameters
+        ----------
+        input_data: dict
+            applicant data keyed by the snake case dataset columns
+
+        Returns
+        -------
+        numpy.ndarray
+            array of shape (1, n_columns) in the column order of the dataset
+        """
+        row = []
+        for col in self.columns:
+            if col not in input_data or input_data[col] is None:
+                raise ValueError(f'{col} cannot be null')
+            value = input_data[col]
+            if col in self.codes:
+                if value not in self.codes[col]:
+                    raise ValueError(f'unknown value for {col}: {value}')
+                row.append(self.codes[col][value])
+            else:
+                row.append((float(value) - self.mean[col]) / self.std[col])
+
+        return np.array([row])
+
+    def model(self, model_type):
+        """
+        Return the regression for model_type, fitting it on first use
+        """
+        model = self._models.get(model_type)
+        if model is None:
+            with self._lock:
+                model = self._models.get(model_type)
+                if model is None:
+                    y = self.data['risk'].values
+                    x = self.data[self.columns].values
+                    model = make_regression(model_type).fit(x, y)
+                    self._models[model_type] = model
+        return model
+
+    def manova_groups(self):
+        """
+        Return the good and bad ManovaGroup, computing them on first use
+        """
+        groups = self._models.get('manova')
+        if groups is None:
+            with self._lock:
+                groups = self._models.get('manova')
+                if groups is None:
+                    risk = self.encoders['risk'].transform(['good', 'bad'])
+                    groups = []
+                    for code in risk:
+                        group = self.data[self.data['risk'] == code]
+                        groups.append(
+                            ManovaGroup(group[self.endog].values,
+                                        group['purpose'].values))
+                    self._models['manova'] = groups = tuple(groups)
+        return groups
+
+    def manova(self, input_data):
+        """
+        Score an applicant by the risk group it disturbs the least
+
+        The applicant is added to the good and the bad group in turn and
+        gets the risk of the group whose Wilks' lambda moves the least. The
+        test statistics returned are the ones of that group.
+        """
+        row = self.transform(input_data)[0]
+        purpose = row[self.columns.index('purpose')]
+        x = row[[self.columns.index(col) for col in self.endog]]
+
+        good, bad = self.manova_groups()
+        wl_good = 1 - good.theta()
+        wl_test_good = 1 - good.theta(x, purpose)
+        wl_bad = 1 - bad.theta()
+        wl_test_bad = 1 - bad.theta(x, purpose)
+
+        if abs(wl_test_good - wl_good) <= abs(wl_test_bad - wl_bad):
+            color, wl_test = 'green', wl_test_good
+        else:
+            color, wl_test = 'red', wl_test_bad
+
+        output = manova_statistics(1 - wl_test)
+        output.update({
+            "color": color,
+            "WL_good": wl_good,
+            "WL_test_good": wl_test_good,
+            "WL_bad": wl_bad,
+            "WL_test_bad": wl_test_bad
+        })
+        return output
 
-    # Prepare and normalize data
-    dataset, input_data = prepare_data(dataset)
+    def score(self, input_data, model_type):
+        probability = self.model(model_type).predict(
+            self.transform(input_data))[0]
+        color = 'green' if probability > 0.5 else 'red'
+
+        return {"color": color, "probability": probability}
+
+
+@lru_cache(maxsize=None)
+def reference_model(name='german'):
+    """
+    Return the fitted ReferenceModel of a dataset, built once per process
+    """
+    return ReferenceModel(load_dataset(name))
+
+
+def stat_score(input_data, model_type, refit=False):
+    """
+    Score an applicant with a statistical method
+
+    Parameters
+    ----------
+    input_data: dict
+        applicant data
+    model_type: str
+        linearRegression, polynomialRegression or manova
+    refit: bool
+        append the applicant to the reference dataset before normalization
+        and refit the model for this request, as scoring originally did.
+        Much slower, kept for parity testing.
+    """
+    if model_type not in ['manova', 'linearRegression',
+                          'polynomialRegression']:
+        raise ValueError(f"Unknown statistical method {model_type}")
 
     try:
         if model_type == 'manova':
-            raise APIException(
-                "Statistical Method Manova is not implemented yet")
-            # output = manova(input_data, dataset)
-
-        elif model_type == 'linearRegression':
-            output = linear_regression(input_data, dataset)
+            output = reference_model().manova(input_data)
 
-        elif model_type == 'polynomialRegression':
-            output = polynomial_regression(input_data, dataset)
+        elif model_type in ['linearRegression', 'polynomialRegression']:
+            if refit:
+                output = refit_score(input_data, model_type)
+            else:
+                output = reference_model().score(input_data, model_type)
 
         output['method'] = model_type
         return output
 
     except Exception as e:
         log.debug(f"An Exception Occurred; {str(e)}")
+        raise APIException(str(e))
+
+
+def refit_score(input_data, model_type):
+    """
+    Score an applicant by appending it to the reference dataset before
+    normalization and refitting the regression on every call
+    """
+    dataset = load_dataset()
+
+    # Assume input risk is bad
+    input_data = dict(input_data, risk='bad')
+    dataset.loc[len(dataset)] = input_data
+
+    # Prepare and normalize data
+    dataset, input_data = prepare_data(dataset)
+
+    if model_type == 'linearRegression':
+        return linear_regression(input_data, dataset)
+    return polynomial_regression(input_data, dataset)